@@ -0,0 +1,156 @@
+"""Admission control for generations sent to an Ollama host.
+
+Ollama serves a fixed number of requests in parallel and queues the rest, so
+without control an emergency assessment can wait behind several routine
+generations from other users. Every generation first takes a slot from an
+``AdmissionController`` attached to the client:
+
+- strict priority classes: ``emergency`` > ``chat`` > ``checkin`` > ``batch``;
+  when a slot frees up it goes to the highest-priority waiting request;
+- per-class concurrency caps (batch reports use a single slot by default);
+- one slot is reserved for emergencies, so an emergency never waits in this
+  queue behind routine requests. The reserve is client-side only: Ollama
+  itself still runs at most ``OLLAMA_NUM_PARALLEL`` generations, so with the
+  default of 1 an emergency is sent at once but may still wait inside Ollama
+  for the one generation already running (never for the queued ones). Run
+  Ollama with one more parallel slot than ``OLLAMA_NUM_PARALLEL`` given here
+  to remove that wait;
+- each class has a maximum queue wait, after which the request is rejected
+  instead of hanging;
+- queue-wait metrics per class (admitted, waiting, in flight, average and
+  maximum wait, rejections).
+
+The number of routine slots follows ``OLLAMA_NUM_PARALLEL`` (default 1), the
+same setting that controls parallelism in the Ollama server.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PRIORITY_CLASSES = ('emergency', 'chat', 'checkin', 'batch')
+DEFAULT_PARALLEL = 1
+EMERGENCY_RESERVE = 1
+
+# Longest time a request may wait for a slot, per class (seconds)
+MAX_QUEUE_WAIT = {'emergency': 120, 'chat': 120, 'checkin': 180, 'batch': 900}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request waited longer than its class allows"""
+
+
+def admission_options_from_env():
+    return {'parallel': max(int(os.environ.get('OLLAMA_NUM_PARALLEL', DEFAULT_PARALLEL)), 1)}
+
+
+class AdmissionController:
+    """Priority admission with per-class caps and a client-side emergency reserve slot"""
+
+    def __init__(self, parallel=DEFAULT_PARALLEL, reserve=EMERGENCY_RESERVE, caps=None,
+                 max_wait=None):
+        self.routine_slots = parallel
+        self.total_slots = parallel + reserve
+        self.caps = {
+            'emergency': self.total_slots,
+            'chat': parallel,
+            'checkin': parallel,
+            'batch': 1,
+        }
+        self.caps.update(caps or {})
+        self.max_wait = dict(MAX_QUEUE_WAIT, **(max_wait or {}))
+
+        self._condition = threading.Condition()
+        self._in_use = 0
+        self._in_flight = {cls: 0 for cls in PRIORITY_CLASSES}
+        # Waiting tickets: (class rank, arrival sequence)
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._metrics = {cls: {'admitted': 0, 'rejected': 0, 'total_wait': 0.0, 'max_wait': 0.0,
+                               'last_wait': None} for cls in PRIORITY_CLASSES}
+
+    def _has_slot(self, cls):
+        if self._in_flight[cls] >= self.caps[cls]:
+            return False
+        limit = self.total_slots if cls == 'emergency' else self.routine_slots
+        return self._in_use < limit
+
+    def _is_next(self, ticket):
+        """True if no waiting request of a higher (or same, earlier) priority could take a slot first"""
+        for other in sorted(self._waiting):
+            if other == ticket:
+                return True
+            if self._has_slot(PRIORITY_CLASSES[other[0]]):
+                return False
+        return False
+
+    def acquire(self, cls):
+        """Block until a slot is granted to `cls`; returns the queue wait in seconds"""
+        if cls not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class '{cls}'")
+        start = time.monotonic()
+        deadline = start + self.max_wait[cls]
+        with self._condition:
+            ticket = (PRIORITY_CLASSES.index(cls), next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while not (self._has_slot(cls) and self._is_next(ticket)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics[cls]['rejected'] += 1
+                        raise AdmissionRejected(
+                            "Servidor ocupado: demasiadas consultas en curso, inténtalo de nuevo en unos minutos"
+                        )
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                # Someone else may be eligible now that this ticket left the queue
+                self._condition.notify_all()
+
+            self._in_use += 1
+            self._in_flight[cls] += 1
+            wait = time.monotonic() - start
+            metrics = self._metrics[cls]
+            metrics['admitted'] += 1
+            metrics['total_wait'] += wait
+            metrics['max_wait'] = max(metrics['max_wait'], wait)
+            metrics['last_wait'] = wait
+            return wait
+
+    def release(self, cls):
+        with self._condition:
+            self._in_use -= 1
+            self._in_flight[cls] -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, cls):
+        """Context manager holding a slot of class `cls`"""
+        self.acquire(cls)
+        try:
+            yield
+        finally:
+            self.release(cls)
+
+    def stats(self):
+        """Per-class admission and queue-wait metrics"""
+        with self._condition:
+            waiting = {cls: 0 for cls in PRIORITY_CLASSES}
+            for rank, _ in self._waiting:
+                waiting[PRIORITY_CLASSES[rank]] += 1
+            return {
+                cls: {
+                    'admitted': metrics['admitted'],
+                    'rejected': metrics['rejected'],
+                    'waiting': waiting[cls],
+                    'in_flight': self._in_flight[cls],
+                    'cap': self.caps[cls],
+                    'avg_wait': metrics['total_wait'] / metrics['admitted'] if metrics['admitted'] else None,
+                    'max_wait': metrics['max_wait'],
+                    'last_wait': metrics['last_wait'],
+                }
+                for cls, metrics in self._metrics.items()
+            }
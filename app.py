@@ -1,24 +1,34 @@
 import streamlit as st
-import requests
 import json
 import time
-import base64
 import io
 from PIL import Image
 import mimetypes
-from datetime import datetime, timedelta
+from datetime import datetime
 import uuid
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-import tempfile
 import os
 import pandas as pd
+from storage import get_storage
+from admission import AdmissionController, admission_options_from_env
+from ollama_client import OllamaClient, OllamaHealthMonitor, client_options_from_env, pool_size_for
+from llm_jobs import FINISHED, JobQueue, job_queue_options_from_env, make_handlers
+from llm_cache import LLMResponseCache, cache_options_from_env
+from report_cache import ReportCache, make_report_key, report_cache_options_from_env
+from patient_summary import delete_summary_state, history_high_water
+from image_pipeline import prepare_image
+from checkin_analytics import analyze_checkins, format_features
+from history_stats import (add_checkin, add_consultation, build_stats, count_consultations,
+                           counts_by_type, matches_history)
+from history_view import PAGE_SIZES, HistoryFrame, paginate
+from reports import (REPORT_FORMATS, REPORT_PERIODS, build_json_report, excluded_types, render_pdf_report,
+                     report_cutoff, report_scope)
+from reference_db import ReferenceData
+from remedy_retrieval import build_remedy_index, embed_model_from_env
+from prompts import health_assistant_prompt
 # New dependencies for audio input
 from audiorecorder import audiorecorder
-import speech_recognition as sr
+from transcription import get_transcription_service, segment_to_audio_data
+from audio_pipeline import prepare_recording
 
 # --- Most of the existing code remains the same ---
 
@@ -30,20 +40,22 @@ st.set_page_config(
 )
 
 # File management functions (ensure_data_directory, load_user_profile, etc.)
-# ... (These functions are unchanged)
 def ensure_data_directory():
     """Create data directory if it doesn't exist"""
     if not os.path.exists('data'):
         os.makedirs('data')
 
+@st.cache_resource
+def get_storage_backend():
+    """Shared storage backend (txt files or SQLite, see storage.py)"""
+    return get_storage()
+
 def load_user_profile(user_id=None):
-    """Load user profile from TXT file"""
+    """Load user profile from the storage backend"""
     ensure_data_directory()
     if user_id is None:
         user_id = st.session_state.get('current_user_id', str(uuid.uuid4()))
     
-    profile_file = f'data/perfil_usuario_{user_id}.txt'
-    
     default_profile = {
         'user_id': user_id,
         'name': '',
@@ -59,263 +71,123 @@ def load_user_profile(user_id=None):
     }
     
     try:
-        if os.path.exists(profile_file):
-            with open(profile_file, 'r', encoding='utf-8') as f:
-                profile_data = json.load(f)
-                return profile_data
-        else:
-            return default_profile
+        profile_data = get_storage_backend().load_user_profile(user_id)
+        return profile_data if profile_data is not None else default_profile
     except Exception as e:
         st.error(f"Error loading profile: {e}")
         return default_profile
 
 def save_user_profile(profile_data):
-    """Save user profile to TXT file"""
-    ensure_data_directory()
-    profile_file = f'data/perfil_usuario_{profile_data["user_id"]}.txt'
-    
+    """Save user profile to the storage backend"""
     try:
         profile_data['last_updated'] = datetime.now().isoformat()
-        with open(profile_file, 'w', encoding='utf-8') as f:
-            json.dump(profile_data, f, indent=2, ensure_ascii=False)
+        get_storage_backend().save_user_profile(profile_data)
         return True
     except Exception as e:
         st.error(f"Error saving profile: {e}")
         return False
 
 def load_medical_history(user_id):
-    """Load medical history from TXT file"""
-    ensure_data_directory()
-    history_file = f'data/historial_medico_{user_id}.txt'
-    
+    """Load medical history from the storage backend"""
     try:
-        if os.path.exists(history_file):
-            with open(history_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            return []
+        return get_storage_backend().load_medical_history(user_id)
     except Exception as e:
         st.error(f"Error loading medical history: {e}")
         return []
 
 def save_medical_history(user_id, history_data):
-    """Save medical history to TXT file"""
-    ensure_data_directory()
-    history_file = f'data/historial_medico_{user_id}.txt'
-    
+    """Replace the full medical history in the storage backend"""
     try:
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(history_data, f, indent=2, ensure_ascii=False)
+        storage = get_storage_backend()
+        storage.save_medical_history(user_id, history_data)
+        stats = build_stats(history_data, storage.load_daily_checkins(user_id))
+        storage.save_history_stats(user_id, stats)
+        st.session_state.history_stats = (user_id, stats)
         return True
     except Exception as e:
         st.error(f"Error saving medical history: {e}")
         return False
 
-def load_herbal_medicines():
-    """Load herbal medicines database from TXT file"""
-    ensure_data_directory()
-    herbal_file = 'data/plantas_medicinales.txt'
-    
-    default_herbs = {
-        'manzanilla': {
-            'name': 'Manzanilla (Chamomile)',
-            'scientific_name': 'Matricaria chamomilla',
-            'uses': ['Digestive problems', 'Anxiety', 'Sleep disorders', 'Skin irritation'],
-            'preparation': 'Tea: 1 tsp dried flowers per cup of hot water, steep 5-10 minutes',
-            'contraindications': ['Pregnancy (large amounts)', 'Allergy to asteraceae family'],
-            'region': 'Available throughout South America'
-        },
-        'eucalipto': {
-            'name': 'Eucalipto (Eucalyptus)',
-            'scientific_name': 'Eucalyptus globulus',
-            'uses': ['Respiratory problems', 'Cough', 'Congestion', 'Wound healing'],
-            'preparation': 'Inhalation: 5-10 drops oil in hot water. Tea: 2-3 leaves per cup',
-            'contraindications': ['Not for children under 2', 'Not for internal use in pregnancy'],
-            'region': 'Common in Andean regions'
-        },
-        'hierba_buena': {
-            'name': 'Hierbabuena (Spearmint)',
-            'scientific_name': 'Mentha spicata',
-            'uses': ['Digestive issues', 'Nausea', 'Headaches', 'Common cold'],
-            'preparation': 'Tea: 1 tbsp fresh leaves or 1 tsp dried per cup, steep 5 minutes',
-            'contraindications': ['GERD (may worsen symptoms)', 'Hiatal hernia'],
-            'region': 'Grows well in most South American climates'
-        },
-        'aloe_vera': {
-            'name': 'Sábila (Aloe Vera)',
-            'scientific_name': 'Aloe barbadensis',
-            'uses': ['Burns', 'Skin wounds', 'Constipation', 'Digestive inflammation'],
-            'preparation': 'Topical: Apply gel directly. Internal: 1-2 tbsp gel (pure) in water',
-            'contraindications': ['Pregnancy', 'Breastfeeding', 'Intestinal obstruction'],
-            'region': 'Thrives in dry climates across South America'
-        },
-        'cola_de_caballo': {
-            'name': 'Cola de Caballo (Horsetail)',
-            'scientific_name': 'Equisetum arvense',
-            'uses': ['Kidney problems', 'Urinary tract infections', 'Wound healing', 'Bone health'],
-            'preparation': 'Tea: 2-3 tsp dried herb per cup, boil 5 minutes, steep 10 minutes',
-            'contraindications': ['Pregnancy', 'Heart/kidney disease', 'Low potassium'],
-            'region': 'Found in moist areas throughout South America'
-        }
-    }
+def get_history_stats(user_id):
+    """Aggregate history counters (see history_stats.py), loaded once per user and updated on write"""
+    cached = st.session_state.get('history_stats')
+    if cached and cached[0] == user_id:
+        return cached[1]
     
+    storage = get_storage_backend()
+    if user_id == st.session_state.get('current_user_id'):
+        history = st.session_state.medical_history
+    else:
+        history = load_medical_history(user_id)
     try:
-        if os.path.exists(herbal_file):
-            with open(herbal_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            # Create default file
-            with open(herbal_file, 'w', encoding='utf-8') as f:
-                json.dump(default_herbs, f, indent=2, ensure_ascii=False)
-            return default_herbs
+        stats = storage.load_history_stats(user_id)
+        if not matches_history(stats, history):
+            stats = build_stats(history, storage.load_daily_checkins(user_id))
+            storage.save_history_stats(user_id, stats)
     except Exception as e:
-        st.error(f"Error loading herbal medicines: {e}")
-        return default_herbs
+        st.error(f"Error loading history stats: {e}")
+        stats = build_stats(history)
+    st.session_state.history_stats = (user_id, stats)
+    return stats
 
-def generate_ai_patient_summary(user_profile, medical_history, ollama_host, model_name):
-    """Generate AI summary of patient's current health status using Gemma 3"""
+def get_history_frame():
+    """Columnar view of the session history (history_view.py), rebuilt only when the history changes"""
+    medical_history = st.session_state.medical_history
+    version = (st.session_state.current_user_id, *history_high_water(medical_history))
+    cached = st.session_state.get('history_frame')
+    if cached is None or cached[0] != version:
+        cached = (version, HistoryFrame(medical_history))
+        st.session_state.history_frame = cached
+    return cached[1]
+
+def get_checkin_analytics(user_id):
+    """Check-in trend features (see checkin_analytics.py), recomputed only after a new check-in or day"""
+    stats = get_history_stats(user_id)
+    version = (user_id, stats['checkins'], stats['last_checkin_date'], datetime.now().date())
+    cached = st.session_state.get('checkin_analytics')
+    if cached is None or cached[0] != version:
+        cached = (version, analyze_checkins(load_daily_checkins(user_id)))
+        st.session_state.checkin_analytics = cached
+    return cached[1]
+
+def update_history_stats(user_id, stats):
+    """Persist a stats record after an incremental update"""
     try:
-        # Prepare comprehensive data for AI analysis
-        summary_data = {
-            'patient_profile': user_profile,
-            'total_consultations': len(medical_history),
-            'recent_history': medical_history[-10:] if len(medical_history) > 10 else medical_history,
-            'consultation_types': {}
-        }
-        
-        # Count consultation types
-        for entry in medical_history:
-            entry_type = entry.get('type', 'general')
-            summary_data['consultation_types'][entry_type] = summary_data['consultation_types'].get(entry_type, 0) + 1
-        
-        # Create comprehensive prompt for AI analysis
-        analysis_prompt = f"""
-        Como médico especialista, analiza el siguiente perfil completo del paciente y genera un resumen profesional de su estado de salud actual:
-
-        DATOS DEL PACIENTE:
-        - Nombre: {user_profile.get('name', 'No especificado')}
-        - Edad: {user_profile.get('age', 'No especificado')} años
-        - Ubicación: {user_profile.get('location', 'No especificado')}
-        - Condiciones crónicas: {', '.join(user_profile.get('chronic_conditions', [])) or 'Ninguna reportada'}
-        - Alergias: {', '.join(user_profile.get('allergies', [])) or 'Ninguna reportada'}
-        - Medicamentos actuales: {', '.join(user_profile.get('current_medications', [])) or 'Ninguno reportado'}
-
-        ESTADÍSTICAS DE CONSULTAS:
-        - Total de consultas: {len(medical_history)}
-        - Tipos de consultas: {json.dumps(summary_data['consultation_types'], ensure_ascii=False)}
-
-        HISTORIAL MÉDICO RECIENTE:
-        {json.dumps(summary_data['recent_history'], ensure_ascii=False, indent=2)}
-
-        Por favor, proporciona un resumen médico profesional que incluya:
-        1. ESTADO DE SALUD ACTUAL: Evaluación general basada en las consultas recientes
-        2. PATRONES IDENTIFICADOS: Síntomas recurrentes, tendencias preocupantes o mejoras
-        3. FACTORES DE RIESGO: Elementos que requieren atención o monitoreo
-        4. RECOMENDACIONES PRIORITARIAS: Acciones inmediatas y seguimiento sugerido
-        5. OBSERVACIONES CLÍNICAS: Notas importantes para el médico tratante
-
-        Mantén un tono profesional y médico, pero accesible para el paciente.
-        """
-
-        system_prompt = """Eres un médico especialista experimentado que revisa historiales médicos para generar resúmenes clínicos precisos y útiles. Tu análisis debe ser profesional, basado en evidencia, y proporcionar insights valiosos tanto para el paciente como para otros profesionales de la salud."""
-
-        # Call Ollama API for analysis
-        result = call_ollama_api(
-            ollama_host, model_name, analysis_prompt,
-            temperature=0.2, max_tokens=1000,
-            system_prompt=system_prompt
-        )
-
-        if result["success"]:
-            return {
-                "success": True,
-                "summary": result["text"],
-                "stats": summary_data['consultation_types']
-            }
-        else:
-            return {
-                "success": False,
-                "error": result.get("error", "Error generating summary")
-            }
-
+        get_storage_backend().save_history_stats(user_id, stats)
     except Exception as e:
-        return {
-            "success": False,
-            "error": f"Error in AI analysis: {str(e)}"
-        }
-
+        st.error(f"Error saving history stats: {e}")
 
-def load_generic_medicines():
-    """Load generic medicines database from TXT file"""
-    ensure_data_directory()
-    generic_file = 'data/medicamentos_genericos.txt'
-    
-    default_generics = {
-        'paracetamol': {
-            'name': 'Paracetamol (Acetaminofén)',
-            'uses': ['Fever', 'Mild to moderate pain', 'Headache'],
-            'dosage': 'Adults: 500-1000mg every 4-6 hours (max 4g/day)',
-            'contraindications': ['Severe liver disease', 'Alcohol abuse'],
-            'side_effects': ['Rare: liver damage with overdose'],
-            'availability': 'Widely available'
-        },
-        'ibuprofeno': {
-            'name': 'Ibuprofeno',
-            'uses': ['Pain', 'Inflammation', 'Fever'],
-            'dosage': 'Adults: 200-400mg every 4-6 hours (max 1200mg/day)',
-            'contraindications': ['Stomach ulcers', 'Kidney disease', 'Heart disease'],
-            'side_effects': ['Stomach irritation', 'Nausea', 'Dizziness'],
-            'availability': 'Common in pharmacies'
-        },
-        'omeprazol': {
-            'name': 'Omeprazol',
-            'uses': ['Stomach acid reduction', 'Gastritis', 'GERD'],
-            'dosage': 'Adults: 20mg once daily before meals',
-            'contraindications': ['Known allergy to proton pump inhibitors'],
-            'side_effects': ['Headache', 'Nausea', 'Diarrhea'],
-            'availability': 'Prescription or OTC'
-        }
-    }
-    
+def append_medical_history(user_id, entry):
+    """Append a single consultation without rewriting the history"""
     try:
-        if os.path.exists(generic_file):
-            with open(generic_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            # Create default file
-            with open(generic_file, 'w', encoding='utf-8') as f:
-                json.dump(default_generics, f, indent=2, ensure_ascii=False)
-            return default_generics
+        get_storage_backend().append_consultation(user_id, entry)
+        return True
     except Exception as e:
-        st.error(f"Error loading generic medicines: {e}")
-        return default_generics
+        st.error(f"Error saving medical history: {e}")
+        return False
+
+@st.cache_resource
+def get_reference_data():
+    """Plant and generic medicine databases shared by all sessions (see reference_db.py)"""
+    return ReferenceData()
+
+def get_reference_snapshot():
+    """Current view of the reference databases; reloaded when the files change"""
+    reference = get_reference_data()
+    snapshot = reference.snapshot()
+    for error in reference.errors:
+        st.error(f"Error loading reference databases: {error}")
+    return snapshot
 
 def save_daily_checkin(user_id, checkin_data):
-    """Save daily check-in data"""
-    ensure_data_directory()
-    checkin_file = f'data/checkin_diario_{user_id}.txt'
-    
+    """Save daily check-in data (the backend keeps only the last 30 days)"""
     try:
-        # Load existing data
-        if os.path.exists(checkin_file):
-            with open(checkin_file, 'r', encoding='utf-8') as f:
-                all_checkins = json.load(f)
-        else:
-            all_checkins = []
-        
-        # Add new check-in
+        # Loaded before the write so the new check-in is counted exactly once
+        stats = get_history_stats(user_id)
         checkin_data['timestamp'] = datetime.now().isoformat()
         checkin_data['date'] = datetime.now().strftime('%Y-%m-%d')
-        all_checkins.append(checkin_data)
-        
-        # Keep only last 30 days
-        cutoff_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-        all_checkins = [c for c in all_checkins if c['date'] >= cutoff_date]
-        
-        # Save updated data
-        with open(checkin_file, 'w', encoding='utf-8') as f:
-            json.dump(all_checkins, f, indent=2, ensure_ascii=False)
-        
+        get_storage_backend().save_daily_checkin(user_id, checkin_data)
+        update_history_stats(user_id, add_checkin(stats, checkin_data))
         return True
     except Exception as e:
         st.error(f"Error saving check-in: {e}")
@@ -323,15 +195,8 @@ def save_daily_checkin(user_id, checkin_data):
 
 def load_daily_checkins(user_id):
     """Load daily check-in history"""
-    ensure_data_directory()
-    checkin_file = f'data/checkin_diario_{user_id}.txt'
-    
     try:
-        if os.path.exists(checkin_file):
-            with open(checkin_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            return []
+        return get_storage_backend().load_daily_checkins(user_id)
     except Exception as e:
         st.error(f"Error loading check-ins: {e}")
         return []
@@ -347,12 +212,11 @@ def initialize_session_state():
         st.session_state.user_profile = {}
     if 'medical_history' not in st.session_state:
         st.session_state.medical_history = []
-    if 'herbal_database' not in st.session_state:
-        st.session_state.herbal_database = load_herbal_medicines()
-    if 'generic_database' not in st.session_state:
-        st.session_state.generic_database = load_generic_medicines()
     if 'chat_messages' not in st.session_state:
         st.session_state.chat_messages = []
+    # Conversation thread the chat messages are stored in (see persist_chat_thread)
+    if 'chat_thread' not in st.session_state:
+        st.session_state.chat_thread = None
     # For handling voice input
     if 'voice_input' not in st.session_state:
         st.session_state.voice_input = ""
@@ -423,34 +287,29 @@ def show_user_profile_popup():
                 else:
                     st.error("Por favor completa los campos obligatorios (*)")
 
-def get_system_prompts():
+def retrieve_remedies(host, query):
+    """Plants and generic medicines relevant to `query` (empty if retrieval is unavailable)"""
+    if not query or not query.strip():
+        return []
+    try:
+        reference = get_reference_data().snapshot()
+        index = get_remedy_index(host)
+        # No-op unless the databases changed since the last sync
+        index.sync({'herbal': reference.herbal, 'generic': reference.generic}, reference.version)
+        return index.search(query)
+    except Exception:
+        return []
+
+def get_system_prompts(query=None):
+    """System prompts; `query` (the user's message) selects the remedies described in full"""
     user_profile = st.session_state.get('user_profile', {})
     medical_history = st.session_state.get('medical_history', [])
-    herbal_db = st.session_state.get('herbal_database', {})
-    generic_db = st.session_state.get('generic_database', {})
+    reference = get_reference_data().snapshot()
+    relevant_remedies = [(database, data) for database, _, data, _ in retrieve_remedies(ollama_host, query)]
     
     return {
-        'health_assistant': f"""Eres un asistente de salud especializado para comunidades rurales de Sudamérica con acceso limitado a servicios médicos.
-
-## Contexto del Usuario:
-- Información personal: {json.dumps(user_profile, ensure_ascii=False)}
-- Historial médico: {json.dumps(medical_history[-5:], ensure_ascii=False)}
-- Plantas medicinales disponibles: {json.dumps(list(herbal_db.keys()), ensure_ascii=False)}
-- Medicamentos genéricos disponibles: {json.dumps(list(generic_db.keys()), ensure_ascii=False)}
-
-## Tu Rol Principal:
-EVALUAR el estado de salud considerando el perfil completo del usuario
-PROPORCIONAR orientación médica básica adaptada al contexto rural
-RECOMENDAR tratamientos accesibles priorizando plantas medicinales locales
-IDENTIFICAR niveles de urgencia médica
-DOCUMENTAR cada consulta para seguimiento
-
-## Principios:
-- Usa español simple y claro
-- Sé empático y culturalmente sensible
-- Considera limitaciones de recursos
-- NUNCA diagnostiques sin confirmación médica
-- Prioriza la seguridad del paciente""",
+        'health_assistant': health_assistant_prompt(user_profile, medical_history, reference.herbal,
+                                                    reference.generic, relevant_remedies),
 
         'emergency_assessment': """Eres un evaluador de emergencias médicas para áreas rurales.
 
@@ -471,73 +330,167 @@ En emergencias, sé directo y claro. Cada minuto cuenta.""",
 Identifica patrones preocupantes y da recomendaciones personalizadas con tono motivador."""
     }
 
+@st.cache_resource
+def get_llm_cache():
+    """Persistent LLM response cache shared by all sessions"""
+    return LLMResponseCache(**cache_options_from_env())
+
+@st.cache_resource
+def get_speech_service():
+    """Speech-to-text backend (transcription.py); an offline model is loaded once per process"""
+    return get_transcription_service()
+
+@st.cache_resource
+def get_report_cache():
+    """Persistent cache of generated reports shared by all sessions"""
+    return ReportCache(**report_cache_options_from_env())
+
+@st.cache_resource
+def get_remedy_index(host):
+    """Vector index of plants and generic medicines, synced incrementally with the databases"""
+    embed_model = embed_model_from_env()
+    index = build_remedy_index(get_ollama_client(host) if embed_model else None, embed_model)
+    reference = get_reference_data().snapshot()
+    index.sync({'herbal': reference.herbal, 'generic': reference.generic}, reference.version)
+    return index
+
+@st.cache_resource
+def get_ollama_client(host):
+    """Process-wide pooled HTTP client for an Ollama host, shared by all sessions"""
+    # Emergencies first, then chat, check-ins and batch jobs (see admission.py)
+    admission = AdmissionController(**admission_options_from_env())
+    options = client_options_from_env()
+    options['pool_size'] = pool_size_for(admission, options['pool_size'])
+    client = OllamaClient(host, **options)
+    client.cache = get_llm_cache()
+    client.admission = admission
+    # Probes the host in the background; also opens the circuit when it is down
+    OllamaHealthMonitor(client).start()
+    return client
+
+@st.cache_resource
+def get_job_queue():
+    """Background queue for long LLM tasks (see llm_jobs.py), shared by all sessions"""
+    return JobQueue(make_handlers(get_ollama_client, get_storage_backend(), get_reference_data()), **job_queue_options_from_env()).start()
+
+JOB_POLL_SECONDS = 2
+
+def submit_llm_job(kind, payload, lane='batch'):
+    """Queue an LLM job for the current user and return (user_id, job_id)"""
+    user_id = st.session_state.current_user_id
+    return user_id, get_job_queue().submit(kind, payload, user_id=user_id, lane=lane)
+
+def get_user_job(job_ref):
+    """Job of a (user_id, job_id) reference, only if it belongs to the current user"""
+    user_id = st.session_state.current_user_id
+    if not job_ref or job_ref[0] != user_id:
+        return None
+    return get_job_queue().get(job_ref[1], user_id=user_id)
+
+def forget_llm_jobs():
+    """Drop the session's references to jobs (another user, or a cleared history)"""
+    st.session_state.trend_job = None
+    st.session_state.report_request = None
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def poll_llm_job(job_ref, label):
+    """Status box of a pending job; reruns the whole app once the job finishes"""
+    job = get_user_job(job_ref)
+    if job is None or job['status'] in FINISHED:
+        st.rerun()
+    if job['status'] == 'queued':
+        st.info(f"⏳ {label} En cola (posición {job['position']})")
+    else:
+        st.info(f"🤖 {label} En proceso ({int(time.time() - job['started_at'])} s)")
+
+def show_llm_job(job_ref, label):
+    """Return the finished job, or None while it is pending (a status box polls it meanwhile)"""
+    job = get_user_job(job_ref)
+    if job is None or job['status'] in FINISHED:
+        return job
+    poll_llm_job(job_ref, label)
+    return None
+
 def check_ollama_connection(host):
-    """Check if Ollama is running and accessible"""
-    try:
-        response = requests.get(f"{host}/api/tags", timeout=5)
-        return response.status_code == 200
-    except:
-        return False
+    """Last known Ollama status from the background health monitor (never blocks)"""
+    return get_ollama_client(host).health.is_available()
+
+def call_ollama_api(host, model, prompt, image_base64=None, temperature=0.7, max_tokens=512, system_prompt="", use_cache=False,
+                    priority='chat'):
+    """Call the Ollama API with text and optional image.
+
+    use_cache=True serves repeated prompts (same model, prompt, image and options)
+    from the persistent response cache. `priority` is the admission class
+    (emergency, chat, checkin or batch).
+    """
+    return get_ollama_client(host).generate(
+        model, prompt, image_base64,
+        temperature=temperature, max_tokens=max_tokens,
+        system_prompt=system_prompt, use_cache=use_cache, priority=priority
+    )
 
-def call_ollama_api(host, model, prompt, image_base64=None, temperature=0.7, max_tokens=512, system_prompt=""):
-    """Call the Ollama API with text and optional image"""
-    url = f"{host}/api/generate"
-    full_prompt = f"{system_prompt}\n\nUsuario: {prompt}" if system_prompt else prompt
-
-    payload = {
-        "model": model,
-        "prompt": full_prompt,
-        "stream": False,
-        "options": {
-            "temperature": temperature,
-            "num_predict": max_tokens
-        }
-    }
+def stream_ollama_api(host, model, prompt, image_base64=None, temperature=0.7, max_tokens=512, system_prompt="", use_cache=False,
+                      priority='chat'):
+    """Start a streaming Ollama call; pass the returned stream to st.write_stream"""
+    return get_ollama_client(host).generate_stream(
+        model, prompt, image_base64,
+        temperature=temperature, max_tokens=max_tokens,
+        system_prompt=system_prompt, use_cache=use_cache, priority=priority
+    )
 
-    if image_base64:
-        payload["images"] = [image_base64]
+def show_stream_timing(stream):
+    """Show time-to-first-token and total generation time of a finished stream"""
+    if stream.cached:
+        st.caption("⚡ Respuesta recuperada de la caché")
+    elif stream.ttft is not None:
+        st.caption(
+            f"⏱️ Primer token: {stream.ttft:.1f} s | Respuesta completa: {stream.response_time:.1f} s | "
+            f"📝 Prompt: {stream.prompt_tokens} tokens"
+        )
 
+def delete_chat_threads(user_id):
+    """Delete every stored conversation transcript of a user"""
     try:
-        start_time = time.time()
-        response = requests.post(url, json=payload, timeout=120)
-        end_time = time.time()
-
-        if response.status_code != 200:
-            return {"success": False, "error": f"HTTP {response.status_code}: {response.text}"}
-
-        result = response.json()
-        response_time = end_time - start_time
-
-        if "response" in result:
-            return {
-                "success": True,
-                "text": result["response"],
-                "response_time": response_time,
-                "model": model
-            }
-        else:
-            return {"success": False, "error": "No response in result"}
-
+        get_storage_backend().delete_chat_threads(user_id)
+        return True
     except Exception as e:
-        return {"success": False, "error": f"Error: {str(e)}"}
+        st.error(f"Error deleting conversations: {e}")
+        return False
+
+def persist_chat_thread(user_id, chat_history):
+    """Store the not-yet-saved messages of the current chat in its thread.
+
+    Each message is written once; returns (thread_id, turn_index) where
+    turn_index is the number of messages the thread holds so far.
+    """
+    thread = st.session_state.get('chat_thread')
+    if not thread or thread['user_id'] != user_id or thread['persisted_turns'] > len(chat_history):
+        thread = {'user_id': user_id, 'thread_id': str(uuid.uuid4()), 'persisted_turns': 0}
+    
+    # Ensure messages are serializable (no image objects)
+    new_messages = []
+    for msg in chat_history[thread['persisted_turns']:]:
+        new_msg = msg.copy()
+        if "image" in new_msg:
+            # Replace image object with a placeholder for the history
+            new_msg["image"] = "[Imagen adjunta]"
+        new_messages.append(new_msg)
+    
+    if new_messages:
+        get_storage_backend().append_chat_messages(
+            user_id, thread['thread_id'], new_messages, thread['persisted_turns']
+        )
+        thread['persisted_turns'] = len(chat_history)
+    
+    st.session_state.chat_thread = thread
+    return thread['thread_id'], thread['persisted_turns']
 
 def save_consultation_to_history(user_input, ai_response, assessment_level="", consultation_type="general", chat_history=None):
-    """Save consultation to medical history, now including chat history"""
+    """Save consultation to medical history, referencing its chat thread if any"""
     if 'current_user_id' not in st.session_state:
         return False
         
     user_id = st.session_state.current_user_id
-    medical_history = load_medical_history(user_id)
-    
-    # Ensure chat history is serializable (no image objects)
-    serializable_chat = []
-    if chat_history:
-        for msg in chat_history:
-            new_msg = msg.copy()
-            if "image" in new_msg:
-                # Replace image object with a placeholder or filename for the history
-                new_msg["image"] = "[Imagen adjunta]"
-            serializable_chat.append(new_msg)
 
     consultation = {
         'id': str(uuid.uuid4()),
@@ -545,14 +498,22 @@ def save_consultation_to_history(user_input, ai_response, assessment_level="", c
         'type': consultation_type,
         'user_input': user_input,
         'ai_response': ai_response,
-        'assessment_level': assessment_level,
-        'chat_history': serializable_chat if serializable_chat else []
+        'assessment_level': assessment_level
     }
     
-    medical_history.append(consultation)
+    # Loaded before the write so the new consultation is counted exactly once
+    stats = get_history_stats(user_id)
     
-    if save_medical_history(user_id, medical_history):
-        st.session_state.medical_history = medical_history
+    if chat_history:
+        try:
+            consultation['thread_id'], consultation['turn_index'] = persist_chat_thread(user_id, chat_history)
+        except Exception as e:
+            st.error(f"Error saving chat history: {e}")
+            return False
+    
+    if append_medical_history(user_id, consultation):
+        st.session_state.medical_history.append(consultation)
+        update_history_stats(user_id, add_consultation(stats, consultation))
         return True
     return False
 
@@ -562,17 +523,16 @@ initialize_session_state()
 
 # Show user profile popup if not initialized
 if not st.session_state.user_initialized or not st.session_state.current_user_id:
-    # ... (This logic is unchanged)
-    profile_files = [f for f in os.listdir('data') if f.startswith('perfil_usuario_') and f.endswith('.txt')] if os.path.exists('data') else []
+    profile_ids = get_storage_backend().list_user_ids()
     
-    if profile_files:
+    if profile_ids:
         st.sidebar.header("👤 Usuario Existente")
         selected_profile = st.sidebar.selectbox("Seleccionar perfil:", 
-                                               ["Crear nuevo perfil"] + profile_files)
+                                               ["Crear nuevo perfil"] + profile_ids)
         
         if selected_profile != "Crear nuevo perfil":
             try:
-                user_id = selected_profile.replace('perfil_usuario_', '').replace('.txt', '')
+                user_id = selected_profile
                 profile_data = load_user_profile(user_id)
                 
                 if st.sidebar.button("Cargar Perfil"):
@@ -601,14 +561,50 @@ st.sidebar.header("⚙️ Configuración")
 ollama_host = st.sidebar.text_input("Ollama Host:", value="http://localhost:11434")
 model_name = st.sidebar.selectbox("Modelo:", ["gemma3:4b"])
 
-if check_ollama_connection(ollama_host):
+ollama_health = get_ollama_client(ollama_host).health.status()
+if ollama_health['available'] is None:
+    st.sidebar.info("⏳ Verificando conexión con Ollama...")
+elif ollama_health['available']:
     st.sidebar.success("✅ Conectado a Ollama")
+elif ollama_health['state'] == OllamaHealthMonitor.OPEN:
+    st.sidebar.error("❌ Ollama desconectado - reintentando en segundo plano")
 else:
     st.sidebar.error("❌ Ollama desconectado")
 
+ollama_stats = get_ollama_client(ollama_host).stats()
+st.sidebar.caption(
+    f"🔌 Conexiones abiertas: {ollama_stats['connections_opened']} | "
+    f"reutilizadas: {ollama_stats['connections_reused']} | "
+    f"solicitudes: {ollama_stats['requests']}"
+    + (f" | ⏱️ primer token (prom.): {ollama_stats['avg_ttft']:.1f} s" if ollama_stats['avg_ttft'] is not None else "")
+    + (f" | 📝 último prompt: {ollama_stats['last_prompt_tokens']} tokens" if ollama_stats['last_prompt_tokens'] else "")
+)
+admission_stats = ollama_stats['admission']
+busy_classes = [
+    f"{label}: {admission_stats[cls]['in_flight']} en curso / {admission_stats[cls]['waiting']} en espera"
+    + (f" (espera prom. {admission_stats[cls]['avg_wait']:.1f} s)" if admission_stats[cls]['avg_wait'] else "")
+    for cls, label in (('emergency', 'emergencias'), ('chat', 'chat'), ('checkin', 'check-in'), ('batch', 'reportes'))
+    if admission_stats[cls]['admitted'] or admission_stats[cls]['waiting']
+]
+if busy_classes:
+    st.sidebar.caption("🚦 Cola de IA - " + " | ".join(busy_classes))
+cache_stats = get_llm_cache().stats()
+st.sidebar.caption(
+    f"🧠 Caché IA: {cache_stats['hits']} aciertos | {cache_stats['misses']} fallos | "
+    f"{cache_stats['entries']} respuestas ({cache_stats['bytes'] / 1024:.0f} KB)"
+)
+
 # --- UPDATED: Voice Input Button in Sidebar ---
 st.sidebar.markdown("---")
 st.sidebar.header("🎤 Entrada de Voz")
+try:
+    speech_stats = get_speech_service().stats()
+    st.sidebar.caption(
+        f"Reconocimiento: {speech_stats['backend']} ({'sin conexión' if speech_stats['offline'] else 'requiere internet'})"
+        + (f" | factor de tiempo real prom.: {speech_stats['avg_rtf']:.2f}" if speech_stats['avg_rtf'] is not None else "")
+    )
+except Exception as e:
+    st.sidebar.warning(f"Reconocimiento de voz no disponible: {e}")
 if st.sidebar.button("Enviar mensaje de Voz al IA"):
     # Set the state to trigger the dialog on the next rerun
     st.session_state.run_voice_recorder = True
@@ -621,29 +617,32 @@ if st.session_state.get("run_voice_recorder", False):
         audio = audiorecorder("🎤 Grabar", "⏹️ Detener")
 
         if len(audio) > 0:
-            st.audio(audio.export().read())
+            # 16 kHz mono without the leading/trailing silence, all in memory (audio_pipeline.py)
+            recording = prepare_recording(audio)
+            st.audio(recording["wav"], format="audio/wav")
             
-            with st.spinner("Transcribiendo audio..."):
-                # Save audio to a temporary file
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_audio_file:
-                    audio.export(temp_audio_file.name, format="wav")
-                    temp_audio_file_path = temp_audio_file.name
-
-                try:
-                    r = sr.Recognizer()
-                    with sr.AudioFile(temp_audio_file_path) as source:
-                        audio_data = r.record(source)
-                        # Transcribe using Google's free web API
-                        text = r.recognize_google(audio_data, language='es-ES')
-                        st.session_state.voice_input = text
-                        st.success("Transcripción completada. Cierra esta ventana.")
-                except sr.UnknownValueError:
-                    st.error("No se pudo entender el audio. Inténtalo de nuevo.")
-                except sr.RequestError as e:
-                    st.error(f"Error en el servicio de reconocimiento de voz; {e}")
-                finally:
-                    # Clean up the temporary file
-                    os.remove(temp_audio_file_path)
+            if not recording["chunks"]:
+                st.warning("No se detectó voz en la grabación. Inténtalo de nuevo.")
+            else:
+                with st.spinner("Transcribiendo audio..."):
+                    try:
+                        result = get_speech_service().transcribe_chunks(
+                            [segment_to_audio_data(chunk) for chunk in recording["chunks"]]
+                        )
+                    except Exception as e:
+                        result = {"success": False, "error": f"Error en el servicio de reconocimiento de voz; {e}"}
+
+                if result["success"]:
+                    st.session_state.voice_input = result["text"]
+                    st.success("Transcripción completada. Cierra esta ventana.")
+                else:
+                    st.error(result["error"])
+                if result.get("rtf") is not None:
+                    st.caption(
+                        f"⏱️ {recording['speech_seconds']:.1f} s de voz (de {recording['original_seconds']:.1f} s grabados, "
+                        f"{result['chunks']} fragmento(s)) transcritos en {result['transcribe_seconds']:.1f} s "
+                        f"(factor de tiempo real {result['rtf']:.2f}, {result['backend']})"
+                    )
 
         if st.button("Cerrar"):
             st.session_state.run_voice_recorder = False
@@ -652,14 +651,18 @@ if st.session_state.get("run_voice_recorder", False):
     # This will open the dialog
     voice_recorder_dialog()
 
-# Main Interface Tabs
-tab1, tab2, tab3, tab4, tab5 = st.tabs([
+# Main Interface Sections. Unlike st.tabs, which executes every tab body on
+# each rerun, only the selected section computes and renders.
+SECTIONS = [
     "💪 Consulta Diaria", "🩺 Evaluación Médica", "🌿 Plantas Medicinales", 
     "📋 Historial Médico", "📄 Reporte PDF"
-])
+]
+active_section = st.radio(
+    "Sección:", SECTIONS, horizontal=True, key="active_section", label_visibility="collapsed"
+)
 
 # ... Tab 1 is unchanged ...
-with tab1:
+if active_section == SECTIONS[0]:
     st.header("💪 Check-in Diario de Salud")
     st.markdown("Registra tu estado de salud diario para un mejor seguimiento")
     
@@ -719,8 +722,9 @@ with tab1:
         if save_daily_checkin(st.session_state.current_user_id, checkin_data):
             st.success("✅ Check-in guardado exitosamente!")
             
-            # Analyze check-in data
-            system_prompts = get_system_prompts()
+            # Analyze check-in data; trends are computed locally and sent as features
+            system_prompts = get_system_prompts(daily_notes)
+            checkin_features = format_features(get_checkin_analytics(st.session_state.current_user_id))
             analysis_prompt = f"""
             Datos del check-in diario:
             - Hidratación: {water_intake} vasos (meta: 8)
@@ -729,29 +733,62 @@ with tab1:
             - Sueño: {sleep_quality}
             - Notas: {daily_notes}
             
+            Tendencias recientes (calculadas a partir de los check-ins):
+            {checkin_features}
+            
             Analiza estos datos y proporciona recomendaciones personalizadas.
             """
             
-            with st.spinner("Analizando tu check-in..."):
-                result = call_ollama_api(
-                    ollama_host, model_name, analysis_prompt,
-                    temperature=0.3, max_tokens=600,
-                    system_prompt=system_prompts['daily_checkin']
-                )
+            st.info("🤖 Análisis de tu check-in diario:")
+            stream = stream_ollama_api(
+                ollama_host, model_name, analysis_prompt,
+                temperature=0.3, max_tokens=600,
+                system_prompt=system_prompts['daily_checkin'],
+                priority='checkin'
+            )
+            st.write_stream(stream)
             
-            if result["success"]:
-                st.info("🤖 Análisis de tu check-in diario:")
-                st.write(result["text"])
+            if stream.success:
+                show_stream_timing(stream)
                 
                 # Save analysis to history
                 save_consultation_to_history(
                     f"Check-in diario: Agua:{water_intake}, Ejercicio:{exercise_minutes}min, Bienestar:{wellness_score}/10",
-                    result["text"],
+                    stream.text,
                     consultation_type="daily_checkin"
                 )
+            else:
+                st.error(f"Error en el análisis: {stream.error}")
+    
+    # Check-in trends, computed locally without calling the model
+    checkin_analytics = get_checkin_analytics(st.session_state.current_user_id)
+    if checkin_analytics:
+        st.markdown("---")
+        st.subheader("📈 Tus Tendencias")
+        st.caption(f"{checkin_analytics['days_logged']} días con check-in · "
+                   f"Racha actual: {checkin_analytics['checkin_streak']} días")
+        
+        metric_columns = st.columns(len(checkin_analytics['metrics']))
+        for column, data in zip(metric_columns, checkin_analytics['metrics'].values()):
+            with column:
+                delta = None
+                if data['mean_7d'] is not None and data['mean_30d'] is not None:
+                    delta = f"{data['mean_7d'] - data['mean_30d']:+.1f} vs 30 días"
+                st.metric(
+                    f"{data['label']} (media 7 días)",
+                    "-" if data['mean_7d'] is None else f"{data['mean_7d']:.1f}{data['unit']}",
+                    delta=delta
+                )
+                attainment = "-" if data['attainment_7d'] is None else f"{data['attainment_7d']:.0%}"
+                st.caption(f"Meta ({data['goal']}) cumplida: {attainment} · Racha: {data['goal_streak']} días")
+        
+        for data in checkin_analytics['metrics'].values():
+            if data['anomaly']:
+                st.warning(f"⚠️ {data['label']}: tu último registro ({data['latest']:.0f}{data['unit']}) "
+                           f"es inusualmente {data['anomaly']} comparado con tus últimos 30 días")
 
 # --- UPDATED: Tab 2 with voice input handling ---
-with tab2:
+if active_section == SECTIONS[1]:
     st.header("🩺 Evaluación Médica Avanzada")
     st.markdown("Chat interactivo para evaluación de síntomas con soporte de imágenes")
     
@@ -791,9 +828,18 @@ with tab2:
             help="Heridas, erupciones, medicamentos, etc."
         )
         
+        prepared_image = None
         if uploaded_image:
-            image = Image.open(uploaded_image)
-            st.image(image, width=150)
+            # Decoded, downscaled and stripped of EXIF once per photo (cached by content hash)
+            try:
+                prepared_image = prepare_image(uploaded_image.getvalue())
+                st.image(prepared_image.thumbnail, width=150)
+                st.caption(
+                    f"🖼️ {prepared_image.original_size / 1024:.0f} KB → "
+                    f"{prepared_image.encoded_size / 1024:.0f} KB ({prepared_image.width}x{prepared_image.height})"
+                )
+            except Exception as e:
+                st.error(f"No se pudo procesar la imagen: {e}")
     
     col1, col2, col3 = st.columns([1, 1, 2])
     
@@ -803,40 +849,48 @@ with tab2:
                 user_msg = {"role": "user", "content": user_message}
                 image_base64 = None
                 
-                if uploaded_image:
-                    img_bytes = uploaded_image.getvalue()
-                    user_msg["image"] = img_bytes # Store bytes for display
-                    image_base64 = base64.b64encode(img_bytes).decode('utf-8')
+                if prepared_image:
+                    user_msg["image"] = prepared_image.thumbnail # Thumbnail bytes for display
+                    image_base64 = prepared_image.base64
 
                 st.session_state.chat_messages.append(user_msg)
                 
-                system_prompts = get_system_prompts()
-                with st.spinner("Analizando consulta médica..."):
-                    result = call_ollama_api(
-                        ollama_host, model_name, user_message, image_base64,
-                        temperature=0.3, max_tokens=800,
-                        system_prompt=system_prompts['health_assistant']
-                    )
+                system_prompts = get_system_prompts(user_message)
+                # Render the new turn right away and stream the answer into it
+                with chat_container:
+                    with st.chat_message("user"):
+                        st.write(user_message)
+                        if "image" in user_msg:
+                            st.image(user_msg["image"], width=200)
+                    with st.chat_message("assistant"):
+                        stream = stream_ollama_api(
+                            ollama_host, model_name, user_message, image_base64,
+                            temperature=0.3, max_tokens=800,
+                            system_prompt=system_prompts['health_assistant']
+                        )
+                        st.write_stream(stream)
                 
-                if result["success"]:
+                if stream.success:
                     st.session_state.chat_messages.append({
                         "role": "assistant", 
-                        "content": result["text"]
+                        "content": stream.text
                     })
                     
                     save_consultation_to_history(
-                        user_message, result["text"], 
+                        user_message, stream.text, 
                         consultation_type="medical_evaluation",
                         chat_history=st.session_state.chat_messages
                     )
                     
                     st.rerun()
                 else:
-                    st.error(f"Error en la consulta: {result['error']}")
+                    st.error(f"Error en la consulta: {stream.error}")
     
     with col2:
         if st.button("🗑️ Limpiar Chat"):
             st.session_state.chat_messages = []
+            # The next message starts a new conversation thread
+            st.session_state.chat_thread = None
             st.rerun()
     
     # Emergency Assessment Box
@@ -851,22 +905,28 @@ with tab2:
     
     if st.button("🚨 EVALUAR EMERGENCIA", type="primary"):
         if emergency_symptoms.strip():
-            system_prompts = get_system_prompts()
+            system_prompts = get_system_prompts(emergency_symptoms)
             emergency_prompt = f"""
             SÍNTOMAS DE EMERGENCIA REPORTADOS: {emergency_symptoms}
             
             Evalúa INMEDIATAMENTE el nivel de urgencia y proporciona instrucciones de primeros auxilios.
             """
             
-            with st.spinner("🚨 Evaluando emergencia..."):
-                result = call_ollama_api(
+            # Stream the instructions as they arrive, then re-render them with the urgency banner
+            stream_placeholder = st.empty()
+            with stream_placeholder.container():
+                st.caption("🚨 Evaluando emergencia...")
+                stream = stream_ollama_api(
                     ollama_host, model_name, emergency_prompt,
                     temperature=0.1, max_tokens=600,
-                    system_prompt=system_prompts['emergency_assessment']
+                    system_prompt=system_prompts['emergency_assessment'],
+                    use_cache=True, priority='emergency'
                 )
+                st.write_stream(stream)
+            stream_placeholder.empty()
             
-            if result["success"]:
-                response = result["text"]
+            if stream.success:
+                response = stream.text
                 if "🔴" in response or "EMERGENCIA" in response.upper():
                     st.error("🔴 **EMERGENCIA MÉDICA DETECTADA**")
                     st.error(response)
@@ -876,6 +936,7 @@ with tab2:
                 else:
                     st.info("🟢 **SEGUIMIENTO RECOMENDADO**")
                     st.info(response)
+                show_stream_timing(stream)
                 
                 # Save emergency assessment
                 save_consultation_to_history(
@@ -884,10 +945,12 @@ with tab2:
                     assessment_level="EMERGENCY",
                     consultation_type="emergency"
                 )
+            else:
+                st.error(f"Error en la evaluación: {stream.error}")
 
 # --- The rest of the tabs (3, 4, 5) and the footer remain the same. ---
 # ... Code for tabs 3, 4, 5, and footer ...
-with tab3:
+if active_section == SECTIONS[2]:
     st.header("🌿 Base de Datos de Plantas Medicinales")
     st.markdown("Plantas medicinales tradicionales de Sudamérica con información científica")
     
@@ -898,19 +961,24 @@ with tab3:
     with col2:
         show_all = st.checkbox("Mostrar todas las plantas", value=False)
     
-    herbal_db = st.session_state.herbal_database
+    reference = get_reference_snapshot()
+    herbal_db = reference.herbal
     
-    # Filter plants based on search
+    # Filter plants based on search (ranked, accent/typo tolerant, see herbal_search.py)
     filtered_plants = {}
     if show_all or not search_term:
         filtered_plants = herbal_db
     else:
-        search_lower = search_term.lower()
-        for plant_key, plant_data in herbal_db.items():
-            if (search_lower in plant_data['name'].lower() or 
-                search_lower in plant_data['scientific_name'].lower() or
-                any(search_lower in use.lower() for use in plant_data['uses'])):
-                filtered_plants[plant_key] = plant_data
+        search_index = reference.search_index
+        for plant_key in search_index.search(search_term, 'herbal'):
+            if plant_key in herbal_db:
+                filtered_plants[plant_key] = herbal_db[plant_key]
+        
+        generic_db = reference.generic
+        generic_matches = [generic_db[key]['name'] for key in search_index.search(search_term, 'generic', limit=3)
+                           if key in generic_db]
+        if generic_matches:
+            st.caption(f"💊 Medicamentos genéricos relacionados: {', '.join(generic_matches)}")
     
     # Display plants in expandable cards
     if filtered_plants:
@@ -935,22 +1003,25 @@ with tab3:
                 if st.button(f"💬 Consultar sobre {plant_data['name']}", key=f"consult_{plant_key}"):
                     plant_question = f"Cuéntame más sobre los usos medicinales de {plant_data['name']} para mi condición de salud actual."
                     
-                    system_prompts = get_system_prompts()
-                    with st.spinner(f"Consultando sobre {plant_data['name']}..."):
-                        result = call_ollama_api(
-                            ollama_host, model_name, plant_question,
-                            temperature=0.3, max_tokens=600,
-                            system_prompt=system_prompts['health_assistant']
-                        )
+                    system_prompts = get_system_prompts(plant_question)
+                    st.success(f"Información sobre {plant_data['name']}:")
+                    stream = stream_ollama_api(
+                        ollama_host, model_name, plant_question,
+                        temperature=0.3, max_tokens=600,
+                        system_prompt=system_prompts['health_assistant'],
+                        use_cache=True
+                    )
+                    st.write_stream(stream)
                     
-                    if result["success"]:
-                        st.success(f"Información sobre {plant_data['name']}:")
-                        st.write(result["text"])
+                    if stream.success:
+                        show_stream_timing(stream)
                         
                         save_consultation_to_history(
-                            plant_question, result["text"], 
+                            plant_question, stream.text, 
                             consultation_type="herbal_consultation"
                         )
+                    else:
+                        st.error(f"Error en la consulta: {stream.error}")
     else:
         st.info("No se encontraron plantas medicinales que coincidan con tu búsqueda.")
     
@@ -979,14 +1050,16 @@ with tab3:
                         'region': new_region
                     }
                     
-                    herbal_db[plant_key] = new_plant_data
-                    
-                    # Save to file
+                    # Save to file; every session sees the new plant on its next rerun
                     try:
-                        with open('data/plantas_medicinales.txt', 'w', encoding='utf-8') as f:
-                            json.dump(herbal_db, f, indent=2, ensure_ascii=False)
-                        
-                        st.session_state.herbal_database = herbal_db
+                        reference = get_reference_data().add_plant(plant_key, new_plant_data)
+                        # Only the new plant is embedded; a failure here must not lose the saved plant
+                        try:
+                            get_remedy_index(ollama_host).sync(
+                                {'herbal': reference.herbal, 'generic': reference.generic}, reference.version
+                            )
+                        except Exception:
+                            pass
                         st.success(f"✅ Planta {new_name} agregada exitosamente!")
                         st.rerun()
                     except Exception as e:
@@ -994,35 +1067,31 @@ with tab3:
                 else:
                     st.error("Por favor completa los campos obligatorios.")
 
-with tab4:
+if active_section == SECTIONS[3]:
     st.header("📋 Historial Médico Completo")
     st.markdown("Registro completo de consultas, check-ins y evaluaciones")
     
     medical_history = st.session_state.medical_history
+    storage = get_storage_backend()
+    user_id = st.session_state.current_user_id
     
-    # Summary statistics
+    # Summary statistics (maintained on write, see history_stats.py)
     if medical_history:
+        history_stats = get_history_stats(user_id)
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            st.metric("📊 Total Consultas", len(medical_history))
+            st.metric("📊 Total Consultas", history_stats['total'])
         
         with col2:
-            emergency_count = sum(1 for entry in medical_history 
-                                if entry.get('assessment_level') == 'EMERGENCY' or 
-                                   entry.get('type') == 'emergency')
-            st.metric("🚨 Emergencias", emergency_count)
+            st.metric("🚨 Emergencias", history_stats['emergencies'])
         
         with col3:
-            recent_count = sum(1 for entry in medical_history 
-                             if datetime.fromisoformat(entry['timestamp']) > 
-                             datetime.now() - timedelta(days=7))
+            recent_count = count_consultations(history_stats, since=report_cutoff("Última semana"))
             st.metric("📅 Última Semana", recent_count)
         
         with col4:
-            checkin_count = sum(1 for entry in medical_history 
-                              if entry.get('type') == 'daily_checkin')
-            st.metric("💪 Check-ins", checkin_count)
+            st.metric("💪 Check-ins", history_stats['by_type'].get('daily_checkin', 0))
         
         st.markdown("---")
         
@@ -1041,21 +1110,28 @@ with tab4:
             )
         
         # Apply filters
-        filtered_history = medical_history.copy()
+        filter_types = None if filter_type == "Todas" else [filter_type]
+        # Same calendar periods as the "Última Semana" metric and the reports (midnight starts)
+        cutoff_date = None if date_range == "Todos" else report_cutoff(date_range)
         
-        if filter_type != "Todas":
-            filtered_history = [entry for entry in filtered_history 
-                              if entry.get('type') == filter_type]
+        # The frame keeps each filter's sorted order, so paging does not re-sort the history
+        filtered_history, history_order = get_history_frame().view(types=filter_types, since=cutoff_date)
         
-        if date_range != "Todos":
-            days_map = {"Última semana": 7, "Último mes": 30, "Últimos 3 meses": 90}
-            cutoff_date = datetime.now() - timedelta(days=days_map[date_range])
-            filtered_history = [entry for entry in filtered_history 
-                              if datetime.fromisoformat(entry['timestamp']) > cutoff_date]
+        # Changing the filters goes back to the newest page
+        if st.session_state.get('history_filters') != (filter_type, date_range):
+            st.session_state.history_filters = (filter_type, date_range)
+            st.session_state.history_cursor = None
+        if 'history_full_responses' not in st.session_state:
+            st.session_state.history_full_responses = set()
         
-        # Display filtered history
+        # Display filtered history one page at a time (see history_view.py)
         if filtered_history:
-            for i, entry in enumerate(reversed(filtered_history), 1):
+            page = paginate(
+                filtered_history, st.session_state.history_cursor,
+                st.session_state.get('history_page_size', PAGE_SIZES[0]), order=history_order
+            )
+            for i, entry in enumerate(page.entries, 1):
+                entry_id = entry.get('id') or entry['timestamp']
                 entry_date = datetime.fromisoformat(entry['timestamp'])
                 
                 # Determine entry type icon and color
@@ -1071,7 +1147,7 @@ with tab4:
                 
                 with st.expander(
                     f"{icon} {entry_date.strftime('%d/%m/%Y %H:%M')} - {entry.get('type', 'general').replace('_', ' ').title()}",
-                    expanded=i <= 3
+                    expanded=page.number == 1 and i <= 3
                 ):
                     col1, col2 = st.columns([2, 3])
                     
@@ -1091,7 +1167,29 @@ with tab4:
                     
                     with col2:
                         st.markdown("**Respuesta/Recomendaciones:**")
-                        st.write(entry['ai_response'][:300] + "..." if len(entry['ai_response']) > 300 else entry['ai_response'])
+                        # The full response is only sent to the browser when requested
+                        if len(entry['ai_response']) > 300 and entry_id not in st.session_state.history_full_responses:
+                            st.write(entry['ai_response'][:300] + "...")
+                            if st.button("📖 Ver respuesta completa", key=f"full_response_{entry_id}"):
+                                st.session_state.history_full_responses.add(entry_id)
+                                st.rerun()
+                        else:
+                            st.write(entry['ai_response'])
+            
+            # Page navigation
+            col1, col2, col3, col4 = st.columns([1, 2, 1, 1])
+            with col1:
+                if st.button("⬅️ Más recientes", disabled=page.number == 1):
+                    st.session_state.history_cursor = page.newer_cursor
+                    st.rerun()
+            with col2:
+                st.caption(f"Página {page.number} de {page.total_pages} · {page.total} registros")
+            with col3:
+                if st.button("Anteriores ➡️", disabled=page.older_cursor is None):
+                    st.session_state.history_cursor = page.older_cursor
+                    st.rerun()
+            with col4:
+                st.selectbox("Por página:", PAGE_SIZES, key="history_page_size", label_visibility="collapsed")
         else:
             st.info("No hay registros que coincidan con los filtros seleccionados.")
         
@@ -1101,9 +1199,11 @@ with tab4:
         
         with col1:
             if st.button("📊 Exportar Historial (JSON)"):
+                thread_ids = {entry['thread_id'] for entry in medical_history if entry.get('thread_id')}
                 export_data = {
                     'user_profile': st.session_state.user_profile,
                     'medical_history': medical_history,
+                    'conversations': storage.load_chat_threads(user_id, thread_ids) if thread_ids else {},
                     'export_date': datetime.now().isoformat(),
                     'total_entries': len(medical_history)
                 }
@@ -1119,31 +1219,38 @@ with tab4:
             if st.button("📈 Análisis de Tendencias"):
                 # Simple trend analysis
                 if len(medical_history) > 5:
-                    trend_prompt = f"""
-                    Analiza las siguientes consultas médicas de los últimos registros:
-                    {json.dumps(medical_history[-10:], ensure_ascii=False)}
-                    
-                    Identifica patrones, tendencias preocupantes y mejoras en la salud del usuario.
-                    """
-                    
-                    system_prompts = get_system_prompts()
-                    with st.spinner("Analizando tendencias de salud..."):
-                        result = call_ollama_api(
-                            ollama_host, model_name, trend_prompt,
-                            temperature=0.3, max_tokens=800,
-                            system_prompt=system_prompts['health_assistant']
-                        )
-                    
+                    # Runs in the background job queue, which builds the prompt
+                    # from storage; the result is polled below
+                    st.session_state.trend_job = submit_llm_job('trend_analysis', {
+                        'host': ollama_host,
+                        'model': model_name,
+                        'user_id': user_id,
+                        'temperature': 0.3,
+                        'max_tokens': 800,
+                        'use_cache': True
+                    })
+                else:
+                    st.info("Se necesitan más consultas para analizar tendencias.")
+            
+            # Latest analysis of this session, or of the last hour after a page refresh
+            trend_job_ref = st.session_state.get('trend_job')
+            if not trend_job_ref or trend_job_ref[0] != user_id:
+                latest = get_job_queue().latest_job_id(user_id, 'trend_analysis', max_age=3600)
+                trend_job_ref = (user_id, latest) if latest else None
+            if trend_job_ref:
+                trend_job = show_llm_job(trend_job_ref, "Analizando tendencias de salud...")
+                if trend_job is not None:
+                    result = trend_job['result'] or {"success": False, "error": trend_job['error']}
                     if result["success"]:
                         st.success("📈 Análisis de Tendencias de Salud:")
                         st.write(result["text"])
-                else:
-                    st.info("Se necesitan más consultas para analizar tendencias.")
+                    else:
+                        st.error(f"Error en el análisis de tendencias: {result['error']}")
     
     else:
         st.info("📝 No hay registros médicos todavía. Comienza con un check-in diario o una consulta médica.")
 
-with tab5:
+if active_section == SECTIONS[4]:
     st.header("📄 Reporte Médico Profesional")
     st.markdown("Genera reportes detallados para compartir con profesionales de la salud")
     
@@ -1157,7 +1264,7 @@ with tab5:
         with col1:
             report_period = st.selectbox(
                 "Período del reporte:",
-                ["Última semana", "Último mes", "Últimos 3 meses", "Todo el historial"]
+                list(REPORT_PERIODS)
             )
             
             include_checkins = st.checkbox("Incluir check-ins diarios", value=True)
@@ -1166,7 +1273,7 @@ with tab5:
         with col2:
             report_format = st.selectbox(
                 "Formato del reporte:",
-                ["PDF Completo", "PDF Resumido", "Datos JSON"]
+                REPORT_FORMATS
             )
             
             include_trends = st.checkbox("🤖 Incluir análisis médico con IA", value=True, 
@@ -1181,248 +1288,137 @@ with tab5:
                 st.warning("⚠️ Ollama desconectado - El análisis con IA no estará disponible")
         
         # Show data summary before generation
-        filtered_preview = st.session_state.medical_history.copy()
-        if report_period != "Todo el historial":
-            days_map = {"Última semana": 7, "Último mes": 30, "Últimos 3 meses": 90}
-            cutoff_date = datetime.now() - timedelta(days=days_map[report_period])
-            filtered_preview = [entry for entry in filtered_preview 
-                              if datetime.fromisoformat(entry['timestamp']) > cutoff_date]
+        user_id = st.session_state.current_user_id
+        # Periods are whole calendar days so the counts come from the day buckets of the stats
+        period_cutoff = report_cutoff(report_period)
+        report_excluded = excluded_types(include_checkins, include_emergency)
+        report_counts = counts_by_type(get_history_stats(user_id), since=period_cutoff, exclude_types=report_excluded)
         
-        st.info(f"📊 Este reporte incluirá {len(filtered_preview)} consultas del período seleccionado")
+        preview_count = sum(report_counts.values())
+        st.info(f"📊 Este reporte incluirá {preview_count} consultas del período seleccionado")
+        
+        summary_scope = report_scope(report_period, include_checkins, include_emergency)
+        report_settings = (summary_scope, report_format, include_trends)
+        report_key = make_report_key(
+            user_id, st.session_state.user_profile, st.session_state.medical_history, report_settings,
+            cutoff=period_cutoff, model=model_name if include_trends else None
+        )
         
         if st.button("📄 Generar Reporte", type="primary"):
+            # Same settings on an unchanged history: serve the stored report (report_cache.py)
+            cached_report = get_report_cache().get(report_key)
+            # The AI summary runs in the background job queue; the report is
+            # built below once it has finished
+            summary_job = None
+            if cached_report is None and include_trends and check_ollama_connection(ollama_host):
+                # The worker loads the profile and history from storage: no copy of them in the queue
+                summary_job = submit_llm_job('patient_summary', {
+                    'host': ollama_host,
+                    'model': model_name,
+                    'user_id': user_id,
+                    'scope': summary_scope,
+                    'cutoff': period_cutoff.isoformat() if period_cutoff else None,
+                    'exclude_types': report_excluded
+                })
+            st.session_state.report_request = {'user_id': user_id, 'settings': report_settings,
+                                               'summary_job': summary_job, 'cached_report': cached_report}
+        
+        # A requested report is built once (like a direct click) as soon as its summary is ready
+        report_ready = False
+        summary_job = None
+        report_request = st.session_state.get('report_request')
+        if report_request and report_request['user_id'] == user_id and report_request['settings'] == report_settings:
+            if report_request['summary_job']:
+                summary_job = show_llm_job(report_request['summary_job'], "Generando análisis médico con IA...")
+                report_ready = summary_job is not None
+            else:
+                report_ready = True
+        
+        if report_ready and report_request['cached_report']:
+            st.session_state.report_request = None
+            cached_report = report_request['cached_report']
+            st.caption("⚡ Reporte recuperado de la caché (sin cambios en el historial desde "
+                       f"{datetime.fromtimestamp(cached_report['created_at']).strftime('%d/%m/%Y %H:%M')})")
+            if cached_report['ai_summary']:
+                with st.expander("👁️ Vista previa del análisis médico", expanded=True):
+                    st.write(cached_report['ai_summary'])
+            st.download_button(
+                label="📄 Descargar Reporte" + (" con Análisis IA" if cached_report['ai_summary'] else ""),
+                data=cached_report['data'],
+                file_name=cached_report['file_name'],
+                mime=cached_report['mime']
+            )
+        elif report_ready:
+            st.session_state.report_request = None
             try:
-                # Filter history based on period
-                history_to_include = st.session_state.medical_history.copy()
-                
-                if report_period != "Todo el historial":
-                    days_map = {"Última semana": 7, "Último mes": 30, "Últimos 3 meses": 90}
-                    cutoff_date = datetime.now() - timedelta(days=days_map[report_period])
-                    history_to_include = [entry for entry in history_to_include 
-                                        if datetime.fromisoformat(entry['timestamp']) > cutoff_date]
-                
-                # Apply additional filters
-                if not include_checkins:
-                    history_to_include = [entry for entry in history_to_include 
-                                        if entry.get('type') != 'daily_checkin']
-                
-                if not include_emergency:
-                    history_to_include = [entry for entry in history_to_include 
-                                        if entry.get('type') != 'emergency']
+                # Filter history based on period and included types
+                history_to_include = get_history_frame().filter(since=period_cutoff, exclude_types=report_excluded)
 
-                # Generate AI summary first
+                # AI summary from the background job
                 ai_summary = None
-                if include_trends and check_ollama_connection(ollama_host):
-                    with st.spinner("🤖 Generando análisis médico con IA..."):
-                        ai_result = generate_ai_patient_summary(
-                            st.session_state.user_profile, 
-                            history_to_include, 
-                            ollama_host, 
-                            model_name
-                        )
-                        
-                        if ai_result["success"]:
-                            ai_summary = ai_result["summary"]
-                            st.success("✅ Análisis médico completado")
-                            
-                            # Show preview of AI summary
-                            with st.expander("👁️ Vista previa del análisis médico", expanded=True):
-                                st.write(ai_summary)
+                if summary_job is not None:
+                    ai_result = summary_job['result'] or {"success": False, "error": summary_job['error']}
+                    
+                    if ai_result["success"]:
+                        ai_summary = ai_result["summary"]
+                        if ai_result["cached"]:
+                            st.success("✅ Análisis médico al día (sin consultas nuevas desde el último resumen)")
+                        elif ai_result["incremental"]:
+                            st.success("✅ Análisis médico actualizado con las consultas nuevas")
                         else:
-                            st.warning(f"⚠️ No se pudo generar el análisis IA: {ai_result['error']}")
+                            st.success("✅ Análisis médico completado")
+                        
+                        # Show preview of AI summary
+                        with st.expander("👁️ Vista previa del análisis médico", expanded=True):
+                            st.write(ai_summary)
+                    else:
+                        st.warning(f"⚠️ No se pudo generar el análisis IA: {ai_result['error']}")
+                
+                config = {
+                    'period': report_period,
+                    'include_checkins': include_checkins,
+                    'include_emergency': include_emergency,
+                    'format': report_format,
+                    'counts': report_counts
+                }
                 
                 if report_format == "Datos JSON":
                     # Enhanced JSON export with AI summary
-                    report_data = {
-                        'patient_info': st.session_state.user_profile,
-                        'ai_medical_summary': ai_summary,
-                        'medical_history': history_to_include,
-                        'report_config': {
-                            'period': report_period,
-                            'generated_date': datetime.now().isoformat(),
-                            'total_entries': len(history_to_include),
-                            'ai_analysis_included': ai_summary is not None
-                        }
+                    report_data = build_json_report(st.session_state.user_profile, history_to_include, config, ai_summary)
+                    report_file = {
+                        'data': json.dumps(report_data, indent=2, ensure_ascii=False),
+                        'file_name': f"reporte_medico_ia_{datetime.now().strftime('%Y%m%d')}.json",
+                        'mime': "application/json"
                     }
                     
-                    st.download_button(
-                        label="📁 Descargar Reporte JSON con Análisis IA",
-                        data=json.dumps(report_data, indent=2, ensure_ascii=False),
-                        file_name=f"reporte_medico_ia_{datetime.now().strftime('%Y%m%d')}.json",
-                        mime="application/json"
-                    )
+                    st.download_button(label="📁 Descargar Reporte JSON con Análisis IA", **report_file)
                 
                 else:
-                    # Enhanced PDF report generation with AI summary
-                    def generate_enhanced_pdf_report_with_ai(user_profile, medical_history, config, ai_summary=None):
-                        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-                        doc = SimpleDocTemplate(temp_file.name, pagesize=letter)
-                        styles = getSampleStyleSheet()
-                        story = []
-
-                        # Title
-                        title_style = ParagraphStyle(
-                            'CustomTitle',
-                            parent=styles['Heading1'],
-                            fontSize=18,
-                            textColor=colors.darkblue,
-                            alignment=1
-                        )
-                        story.append(Paragraph("REPORTE MÉDICO - ASISTENTE DE SALUD RURAL", title_style))
-                        if ai_summary:
-                            story.append(Paragraph("Incluye Análisis Médico con Inteligencia Artificial", styles['Normal']))
-                        story.append(Spacer(1, 20))
-
-                        # Patient information (same as before)
-                        story.append(Paragraph("INFORMACIÓN DEL PACIENTE", styles['Heading2']))
-                        patient_data = [
-                            ['Nombre:', user_profile.get('name', 'No especificado')],
-                            ['Edad:', user_profile.get('age', 'No especificado')],
-                            ['Ubicación:', user_profile.get('location', 'No especificado')],
-                            ['Teléfono:', user_profile.get('phone', 'No especificado')],
-                            ['Contacto de emergencia:', user_profile.get('emergency_contact', 'No especificado')],
-                            ['Período del reporte:', config['period']],
-                            ['Fecha de generación:', datetime.now().strftime('%d/%m/%Y %H:%M')]
-                        ]
-
-                        patient_table = Table(patient_data, colWidths=[2*inch, 4*inch])
-                        patient_table.setStyle(TableStyle([
-                            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-                            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-                            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-                            ('FONTSIZE', (0, 0), (-1, -1), 10),
-                            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-                            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-                        ]))
-                        story.append(patient_table)
-                        story.append(Spacer(1, 20))
-
-                        # NEW: AI Medical Summary Section
-                        if ai_summary:
-                            story.append(Paragraph("ANÁLISIS MÉDICO CON INTELIGENCIA ARTIFICIAL", styles['Heading2']))
-                            
-                            # Create a highlighted box for AI summary
-                            ai_style = ParagraphStyle(
-                                'AIAnalysis',
-                                parent=styles['Normal'],
-                                fontSize=10,
-                                textColor=colors.darkblue,
-                                leftIndent=10,
-                                rightIndent=10,
-                                spaceAfter=10,
-                                borderColor=colors.lightblue,
-                                borderWidth=1,
-                                borderPadding=10
-                            )
-                            
-                            story.append(Paragraph(ai_summary.replace('\n', '<br/>'), ai_style))
-                            story.append(Spacer(1, 20))
-
-                        # Medical conditions (same as before)
-                        if user_profile.get('chronic_conditions') or user_profile.get('allergies'):
-                            story.append(Paragraph("CONDICIONES MÉDICAS", styles['Heading2']))
-                            
-                            if user_profile.get('chronic_conditions'):
-                                story.append(Paragraph(f"<b>Condiciones crónicas:</b> {', '.join(user_profile['chronic_conditions'])}", styles['Normal']))
-                            
-                            if user_profile.get('allergies'):
-                                story.append(Paragraph(f"<b>Alergias:</b> {', '.join(user_profile['allergies'])}", styles['Normal']))
-                            
-                            if user_profile.get('current_medications'):
-                                story.append(Paragraph(f"<b>Medicamentos actuales:</b> {', '.join(user_profile['current_medications'])}", styles['Normal']))
-                            
-                            story.append(Spacer(1, 15))
-
-                        # Enhanced consultation summary
-                        story.append(Paragraph("RESUMEN DE CONSULTAS", styles['Heading2']))
-                        
-                        # Statistics
-                        total_consultations = len(medical_history)
-                        emergency_count = sum(1 for entry in medical_history if entry.get('type') == 'emergency')
-                        checkin_count = sum(1 for entry in medical_history if entry.get('type') == 'daily_checkin')
-                        medical_eval_count = sum(1 for entry in medical_history if entry.get('type') == 'medical_evaluation')
-                        
-                        summary_data = [
-                            ['Total de consultas:', str(total_consultations)],
-                            ['Evaluaciones médicas:', str(medical_eval_count)],
-                            ['Evaluaciones de emergencia:', str(emergency_count)],
-                            ['Check-ins diarios:', str(checkin_count)],
-                            ['Análisis IA incluido:', 'Sí' if ai_summary else 'No']
-                        ]
-                        
-                        summary_table = Table(summary_data, colWidths=[3*inch, 1*inch])
-                        summary_table.setStyle(TableStyle([
-                            ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
-                            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-                            ('FONTSIZE', (0, 0), (-1, -1), 10)
-                        ]))
-                        story.append(summary_table)
-                        story.append(Spacer(1, 15))
-
-                        # Rest of the consultation details (same as before but limit to recent ones if AI summary is included)
-                        story.append(Paragraph("DETALLE DE CONSULTAS", styles['Heading2']))
-                        
-                        consultations = sorted(medical_history, key=lambda x: x['timestamp'], reverse=True)
-                        
-                        # If AI summary is included, limit detailed consultations to most recent 5
-                        max_consultations = 5 if ai_summary else len(consultations)
-                        
-                        for i, consultation in enumerate(consultations[:max_consultations], 1):
-                            entry_date = datetime.fromisoformat(consultation['timestamp'])
-                            story.append(Paragraph(f"Consulta {i} - {entry_date.strftime('%d/%m/%Y %H:%M')}", styles['Heading3']))
-                            
-                            consultation_type = consultation.get('type', 'general').replace('_', ' ').title()
-                            story.append(Paragraph(f"<b>Tipo:</b> {consultation_type}", styles['Normal']))
-                            
-                            if consultation.get('assessment_level'):
-                                story.append(Paragraph(f"<b>Nivel de urgencia:</b> {consultation['assessment_level']}", styles['Normal']))
-                            
-                            # Shortened version for space efficiency when AI summary is included
-                            if ai_summary and len(consultation['user_input']) > 200:
-                                story.append(Paragraph(f"<b>Consulta:</b> {consultation['user_input'][:200]}...", styles['BodyText']))
-                                story.append(Paragraph(f"<b>Respuesta:</b> {consultation['ai_response'][:200]}...", styles['BodyText']))
-                            else:
-                                story.append(Paragraph(f"<b>Síntomas/Consulta:</b>", styles['Normal']))
-                                story.append(Paragraph(consultation['user_input'], styles['BodyText']))
-                                story.append(Paragraph(f"<b>Evaluación y recomendaciones:</b>", styles['Normal']))
-                                story.append(Paragraph(consultation['ai_response'], styles['BodyText']))
-
-                            story.append(Spacer(1, 12))
-                        
-                        if ai_summary and len(consultations) > max_consultations:
-                            story.append(Paragraph(f"... y {len(consultations) - max_consultations} consultas adicionales (ver historial completo para más detalles)", styles['Normal']))
-
-                        doc.build(story)
-                        return temp_file.name
-
-                    config = {
-                        'period': report_period,
-                        'include_checkins': include_checkins,
-                        'include_emergency': include_emergency,
-                        'format': report_format
-                    }
-                    
+                    # Enhanced PDF report generation with AI summary, rendered in memory (reports.py)
                     with st.spinner("📄 Generando reporte PDF..."):
-                        pdf_path = generate_enhanced_pdf_report_with_ai(
+                        pdf_bytes = render_pdf_report(
                             st.session_state.user_profile,
                             history_to_include,
                             config,
                             ai_summary
                         )
                     
-                    with open(pdf_path, 'rb') as pdf_file:
-                        filename_suffix = "_con_ia" if ai_summary else ""
-                        st.download_button(
-                            label="📄 Descargar Reporte PDF con Análisis IA" if ai_summary else "📄 Descargar Reporte PDF",
-                            data=pdf_file.read(),
-                            file_name=f"reporte_medico{filename_suffix}_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf",
-                            mime="application/pdf"
-                        )
+                    filename_suffix = "_con_ia" if ai_summary else ""
+                    report_file = {
+                        'data': pdf_bytes,
+                        'file_name': f"reporte_medico{filename_suffix}_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf",
+                        'mime': "application/pdf"
+                    }
+                    st.download_button(
+                        label="📄 Descargar Reporte PDF con Análisis IA" if ai_summary else "📄 Descargar Reporte PDF",
+                        **report_file
+                    )
                     
-                    os.unlink(pdf_path)
                     st.success("✅ ¡Reporte generado exitosamente!" + (" (incluye análisis médico con IA)" if ai_summary else ""))
+                
+                # A report that asked for the AI summary but could not get it is not stored
+                if ai_summary is not None or not include_trends:
+                    get_report_cache().put(report_key, user_id, ai_summary=ai_summary, **report_file)
                     
             except Exception as e:
                 st.error(f"Error generando reporte: {str(e)}")
@@ -1459,8 +1455,15 @@ if st.sidebar.button("👤 Editar Perfil"):
     st.rerun()
 
 if st.sidebar.button("🗑️ Limpiar Historial"):
-    if save_medical_history(st.session_state.current_user_id, []):
+    if save_medical_history(st.session_state.current_user_id, []) and delete_chat_threads(st.session_state.current_user_id):
         st.session_state.medical_history = []
+        # The next message starts a new conversation thread
+        st.session_state.chat_thread = None
+        # Stored reports, AI summaries and queued/finished AI jobs still contain the old history
+        get_report_cache().clear(st.session_state.current_user_id)
+        delete_summary_state(st.session_state.current_user_id)
+        get_job_queue().clear(st.session_state.current_user_id)
+        forget_llm_jobs()
         st.sidebar.success("Historial limpiado")
     else:
         st.sidebar.error("Error al limpiar historial")
@@ -1468,6 +1471,8 @@ if st.sidebar.button("🗑️ Limpiar Historial"):
 if st.sidebar.button("🔄 Cambiar Usuario"):
     st.session_state.user_initialized = False
     st.session_state.current_user_id = None
+    # Results of the previous user's jobs must not be shown to the next one
+    forget_llm_jobs()
     st.rerun()
 
 # Display current data directory info
@@ -0,0 +1,112 @@
+"""In-memory preprocessing of voice recordings before transcription.
+
+The recording from ``audiorecorder`` (a pydub ``AudioSegment``) used to be
+exported twice (``export()`` for playback, which goes through a temporary
+file, and a temp WAV for ``sr.AudioFile``) and sent to the recognizer at full
+sample rate with its pauses. ``prepare_recording`` now, without touching the
+disk:
+
+- converts to 16 kHz, 16-bit mono (what the recognizers work with),
+- trims leading and trailing silence with a frame-energy voice activity
+  detector (30 ms frames; the threshold adapts to the recording's noise floor),
+- splits long recordings at the quietest point near every ``max_chunk_seconds``
+  so the chunks can be transcribed in parallel
+  (``TranscriptionService.transcribe_chunks``),
+- exports the processed audio once, as WAV bytes for playback.
+"""
+import io
+import wave
+
+import numpy as np
+
+TARGET_RATE = 16000
+FRAME_MS = 30
+# Speech frames are louder than the noise floor by this margin (dB) ...
+VAD_MARGIN_DB = 10
+# ... and than this absolute level; never stricter than PEAK_MARGIN_DB below the peak
+MIN_SPEECH_DBFS = -50
+PEAK_MARGIN_DB = 20
+# Silence kept around the detected speech
+PAD_MS = 200
+MAX_CHUNK_SECONDS = 15
+# Chunk boundaries are searched in this window before the limit
+SPLIT_SEARCH_SECONDS = 3
+
+
+def to_mono_16k(segment):
+    return segment.set_channels(1).set_frame_rate(TARGET_RATE).set_sample_width(2)
+
+
+def frame_levels(segment, frame_ms=FRAME_MS):
+    """Level (dBFS) of each frame of a 16-bit mono segment"""
+    samples = np.frombuffer(segment.raw_data, dtype=np.int16).astype(np.float32)
+    frame_len = segment.frame_rate * frame_ms // 1000
+    frame_count = len(samples) // frame_len
+    if frame_count == 0:
+        return np.empty(0)
+    frames = samples[:frame_count * frame_len].reshape(frame_count, frame_len)
+    rms = np.sqrt((frames ** 2).mean(axis=1))
+    return 20 * np.log10(np.maximum(rms, 1.0) / 32768)
+
+
+def speech_mask(levels):
+    """Frames with voice activity, relative to the recording's noise floor and peak"""
+    if levels.size == 0:
+        return np.zeros(0, dtype=bool)
+    noise_floor = np.percentile(levels, 10)
+    threshold = max(MIN_SPEECH_DBFS, min(noise_floor + VAD_MARGIN_DB, levels.max() - PEAK_MARGIN_DB))
+    return levels > threshold
+
+
+def _split_points(levels, max_frames, search_frames):
+    """Frame indexes where to cut so that no chunk is longer than max_frames"""
+    points = []
+    start = 0
+    while len(levels) - start > max_frames:
+        window_start = start + max_frames - search_frames
+        cut = window_start + int(np.argmin(levels[window_start:start + max_frames]))
+        points.append(cut)
+        start = cut
+    return points
+
+
+def to_wav_bytes(segment):
+    """WAV file contents of a segment, written in memory"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(segment.channels)
+        wav.setsampwidth(segment.sample_width)
+        wav.setframerate(segment.frame_rate)
+        wav.writeframes(segment.raw_data)
+    return buffer.getvalue()
+
+
+def prepare_recording(segment, max_chunk_seconds=MAX_CHUNK_SECONDS):
+    """Return {"audio", "chunks", "wav", "original_seconds", "speech_seconds"}; no chunks if no voice was found"""
+    original_seconds = len(segment) / 1000
+    audio = to_mono_16k(segment)
+    levels = frame_levels(audio)
+    voiced = np.flatnonzero(speech_mask(levels))
+
+    if voiced.size == 0:
+        audio = audio[:0]
+        chunks = []
+    else:
+        start_ms = max(int(voiced[0]) * FRAME_MS - PAD_MS, 0)
+        end_ms = min((int(voiced[-1]) + 1) * FRAME_MS + PAD_MS, len(audio))
+        audio = audio[start_ms:end_ms]
+
+        first_frame = start_ms // FRAME_MS
+        trimmed_levels = levels[first_frame:first_frame + (end_ms - start_ms) // FRAME_MS]
+        points = _split_points(trimmed_levels, int(max_chunk_seconds * 1000 // FRAME_MS),
+                               int(SPLIT_SEARCH_SECONDS * 1000 // FRAME_MS))
+        bounds = [0] + [point * FRAME_MS for point in points] + [len(audio)]
+        chunks = [audio[begin:end] for begin, end in zip(bounds, bounds[1:]) if end > begin]
+
+    return {
+        "audio": audio,
+        "chunks": chunks,
+        "wav": to_wav_bytes(audio),
+        "original_seconds": original_seconds,
+        "speech_seconds": len(audio) / 1000,
+    }
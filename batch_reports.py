@@ -0,0 +1,261 @@
+"""Headless batch generation of the patient reports (e.g. weekly reports for
+community health workers)::
+
+    python batch_reports.py --period "Última semana" --format pdf
+
+Every user with a saved profile in the storage backend is processed by a pool
+of worker processes. Reports go to ``data/reportes/`` and are tracked in
+``data/reportes/manifest.json``:
+
+- a patient whose history, profile and report settings did not change since
+  their last report is skipped (``--force`` regenerates everything);
+- the manifest is rewritten after every patient, so an interrupted run resumes
+  where it stopped;
+- AI summaries (patient_summary.py) go through one Ollama client per worker
+  whose admission is a semaphore shared by all processes, so at most
+  ``--llm-concurrency`` generations (default ``OLLAMA_NUM_PARALLEL`` or 1) run
+  at the same time whatever the number of workers. A report whose summary
+  failed is written without it and retried on the next run.
+
+A throughput summary (reports per minute, LLM time) is printed at the end.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from history_stats import build_stats, counts_by_type, matches_history
+from history_view import HistoryFrame
+from llm_cache import LLMResponseCache, cache_options_from_env
+from ollama_client import OllamaClient, client_options_from_env
+from patient_summary import summarize_patient
+from report_cache import make_report_key
+from reports import (REPORT_PERIODS, build_json_report, excluded_types, render_pdf_report, report_cutoff,
+                     report_scope)
+from storage import DATA_DIR, get_storage
+
+REPORTS_DIRNAME = 'reportes'
+MANIFEST_FILENAME = 'manifest.json'
+DEFAULT_HOST = 'http://localhost:11434'
+DEFAULT_MODEL = 'gemma3:4b'
+
+# CLI format name -> (report format of the app, file extension)
+FORMATS = {
+    'pdf': ("PDF Completo", 'pdf'),
+    'pdf-resumido': ("PDF Resumido", 'pdf'),
+    'json': ("Datos JSON", 'json'),
+}
+
+
+class _SharedSlots:
+    """OllamaClient admission backed by a semaphore shared by the worker processes"""
+
+    def __init__(self, semaphore):
+        self.semaphore = semaphore
+
+    def acquire(self, cls):
+        start = time.monotonic()
+        self.semaphore.acquire()
+        return time.monotonic() - start
+
+    def release(self, cls):
+        self.semaphore.release()
+
+    def stats(self):
+        return None
+
+
+# Per-process state set by _init_worker
+_worker = {}
+
+
+def _init_worker(options, llm_slots):
+    _worker['storage'] = get_storage(data_dir=options['data_dir'])
+    _worker['options'] = options
+    client = None
+    if options['ai']:
+        client = OllamaClient(options['host'], **client_options_from_env())
+        client.cache = LLMResponseCache(os.path.join(options['data_dir'], 'llm_cache.sqlite'),
+                                        **cache_options_from_env())
+        client.admission = _SharedSlots(llm_slots)
+    _worker['client'] = client
+
+
+def process_patient(user_id, previous):
+    """Generate (or skip) the report of one patient; runs in a worker process"""
+    start = time.monotonic()
+    storage, options, client = _worker['storage'], _worker['options'], _worker['client']
+    result = {'user_id': user_id, 'status': 'skipped', 'llm': None, 'llm_time': 0.0}
+
+    try:
+        # A corrupt profile or history fails this patient only, not the whole run
+        profile = storage.load_user_profile(user_id)
+        if profile is None:
+            return dict(result, status='failed', error='Perfil no encontrado', seconds=time.monotonic() - start)
+        medical_history = storage.load_medical_history(user_id)
+        cutoff = report_cutoff(options['period'])
+        scope = report_scope(options['period'], options['include_checkins'], options['include_emergency'])
+        # Same key as the app's report cache: changes with the profile, history, settings and period start
+        version = make_report_key(user_id, profile, medical_history, (scope, options['format'], options['ai']),
+                                  cutoff=cutoff, model=options['model'] if options['ai'] else None)
+
+        # Reports that missed their AI summary are not final
+        up_to_date = (previous and previous['version'] == version and previous['complete']
+                      and os.path.exists(os.path.join(options['output_dir'], previous['file'])))
+        if up_to_date and not options['force']:
+            return dict(result, seconds=time.monotonic() - start)
+
+        excluded = excluded_types(options['include_checkins'], options['include_emergency'])
+        history_to_include = HistoryFrame(medical_history).filter(since=cutoff, exclude_types=excluded)
+        stats = storage.load_history_stats(user_id)
+        if not matches_history(stats, medical_history):
+            stats = build_stats(medical_history)
+        config = {
+            'period': options['period'],
+            'include_checkins': options['include_checkins'],
+            'include_emergency': options['include_emergency'],
+            'format': options['format'],
+            'counts': counts_by_type(stats, since=cutoff, exclude_types=excluded),
+        }
+
+        ai_summary = None
+        if client is not None and history_to_include:
+            llm_start = time.monotonic()
+            summary = summarize_patient(
+                client, options['model'], profile, history_to_include,
+                scope=scope,
+                data_dir=options['data_dir'], consultation_types=config['counts']
+            )
+            result['llm_time'] = time.monotonic() - llm_start
+            if summary['success']:
+                ai_summary = summary['summary']
+                result['llm'] = 'cached' if summary['cached'] else 'generated'
+            else:
+                result['llm'] = 'failed'
+                result['error'] = summary['error']
+
+        extension = FORMATS[options['format_name']][1]
+        filename = f"reporte_{user_id}_{datetime.now().strftime('%Y%m%d')}.{extension}"
+        path = os.path.join(options['output_dir'], filename)
+        temp_path = path + '.tmp'
+        if extension == 'json':
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(build_json_report(profile, history_to_include, config, ai_summary), f,
+                          indent=2, ensure_ascii=False)
+        else:
+            render_pdf_report(profile, history_to_include, config, ai_summary, output=temp_path)
+        os.replace(temp_path, path)
+    except Exception as e:
+        return dict(result, status='failed', error=str(e), seconds=time.monotonic() - start)
+
+    result.update({
+        'status': 'generated',
+        'entry': {
+            'version': version,
+            'file': filename,
+            'generated_at': datetime.now().isoformat(),
+            'consultations': len(history_to_include),
+            'ai_summary': ai_summary is not None,
+            'complete': result['llm'] != 'failed',
+        },
+        'seconds': time.monotonic() - start,
+    })
+    return result
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def run_batch(options, workers=None, llm_concurrency=1, log=print):
+    """Process every patient and return the run statistics"""
+    os.makedirs(options['output_dir'], exist_ok=True)
+    manifest_path = os.path.join(options['output_dir'], MANIFEST_FILENAME)
+    manifest = load_manifest(manifest_path)
+    user_ids = get_storage(data_dir=options['data_dir']).list_user_ids()
+
+    counts = {'generated': 0, 'skipped': 0, 'failed': 0}
+    llm_counts = {'generated': 0, 'cached': 0, 'failed': 0}
+    llm_time = 0.0
+    start = time.monotonic()
+
+    llm_slots = multiprocessing.Semaphore(llm_concurrency)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(options, llm_slots)) as pool:
+        futures = [pool.submit(process_patient, user_id, manifest.get(user_id)) for user_id in user_ids]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            counts[result['status']] += 1
+            if result['llm']:
+                llm_counts[result['llm']] += 1
+            llm_time += result['llm_time']
+            if result['status'] == 'generated':
+                manifest[result['user_id']] = result['entry']
+                save_manifest(manifest_path, manifest)
+
+            line = f"[{done}/{len(user_ids)}] {result['user_id']}: {result['status']} ({result['seconds']:.1f} s)"
+            if result.get('error'):
+                line += f" - {result['error']}"
+            log(line)
+
+    elapsed = time.monotonic() - start
+    return {
+        'patients': len(user_ids),
+        **counts,
+        'llm': llm_counts,
+        'llm_time': llm_time,
+        'elapsed': elapsed,
+        'reports_per_minute': counts['generated'] / elapsed * 60 if elapsed else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generar los reportes médicos de todos los pacientes')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--output-dir', default=None, help=f'Por defecto <data-dir>/{REPORTS_DIRNAME}')
+    parser.add_argument('--period', default="Última semana", choices=list(REPORT_PERIODS))
+    parser.add_argument('--format', default='pdf', choices=list(FORMATS))
+    parser.add_argument('--no-checkins', action='store_true', help='Excluir los check-ins diarios')
+    parser.add_argument('--no-emergency', action='store_true', help='Excluir las evaluaciones de emergencia')
+    parser.add_argument('--no-ai', action='store_true', help='Sin resumen médico con IA')
+    parser.add_argument('--host', default=os.environ.get('OLLAMA_HOST', DEFAULT_HOST))
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--workers', type=int, default=None, help='Procesos (por defecto, uno por CPU)')
+    parser.add_argument('--llm-concurrency', type=int,
+                        default=int(os.environ.get('OLLAMA_NUM_PARALLEL', 1)),
+                        help='Generaciones simultáneas en Ollama (por defecto OLLAMA_NUM_PARALLEL o 1)')
+    parser.add_argument('--force', action='store_true', help='Regenerar aunque el historial no haya cambiado')
+    args = parser.parse_args()
+
+    options = {
+        'data_dir': args.data_dir,
+        'output_dir': args.output_dir or os.path.join(args.data_dir, REPORTS_DIRNAME),
+        'period': args.period,
+        'format_name': args.format,
+        'format': FORMATS[args.format][0],
+        'include_checkins': not args.no_checkins,
+        'include_emergency': not args.no_emergency,
+        'ai': not args.no_ai,
+        'host': args.host.rstrip('/'),
+        'model': args.model,
+        'force': args.force,
+    }
+    result = run_batch(options, workers=args.workers, llm_concurrency=max(args.llm_concurrency, 1))
+    print(f"Pacientes: {result['patients']} | Generados: {result['generated']} | "
+          f"Sin cambios: {result['skipped']} | Errores: {result['failed']}")
+    print(f"Resúmenes IA: {result['llm']['generated']} nuevos, {result['llm']['cached']} al día, "
+          f"{result['llm']['failed']} fallidos ({result['llm_time']:.1f} s de IA)")
+    print(f"Tiempo total: {result['elapsed']:.1f} s | {result['reports_per_minute']:.1f} reportes/min")
@@ -0,0 +1,84 @@
+"""Benchmark of the PDF report renderer (reports.py) on synthetic histories.
+
+    python benchmarks/bench_reports.py [--sizes 10 100 1000] [--repeat 3]
+
+For each history size it renders the full report (no AI summary, so every
+consultation is detailed) with the chunked story and with a single story
+built up front, and prints the best time, the peak Python memory traced
+during rendering and the PDF size.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reports import CONSULTATION_CHUNK, render_pdf_report  # noqa: E402
+
+PROFILE = {
+    'user_id': 'benchmark',
+    'name': 'Paciente de Prueba',
+    'age': 45,
+    'location': 'Quito, Ecuador',
+    'phone': '0999999999',
+    'emergency_contact': 'Familiar 0988888888',
+    'chronic_conditions': ['Hipertensión'],
+    'allergies': ['Penicilina'],
+    'current_medications': ['Losartán'],
+}
+
+TYPES = ['medical_evaluation', 'daily_checkin', 'emergency']
+
+
+def synthetic_history(size):
+    start = datetime(2025, 1, 1, 8, 0)
+    history = []
+    for i in range(size):
+        entry_type = TYPES[i % len(TYPES)]
+        history.append({
+            'id': f'c{i}',
+            'timestamp': (start + timedelta(hours=6 * i)).isoformat(),
+            'type': entry_type,
+            'assessment_level': 'EMERGENCY' if entry_type == 'emergency' else None,
+            'user_input': f"Consulta {i}: dolor de cabeza y cansancio desde hace {i % 7 + 1} días. " * (1 + i % 3),
+            'ai_response': ("Se recomienda descansar, hidratarse bien y tomar una infusión de manzanilla. "
+                            "Si los síntomas persisten más de tres días, acuda al centro de salud. ") * (2 + i % 4),
+        })
+    return history
+
+
+def measure(history, config, chunk_size, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pdf = render_pdf_report(PROFILE, history, config, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    render_pdf_report(PROFILE, history, config, chunk_size=chunk_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, len(pdf)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark del generador de reportes PDF')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'consultas':>10} {'modo':>12} {'tiempo (s)':>11} {'pico mem (MB)':>14} {'PDF (KB)':>9}")
+    for size in args.sizes:
+        history = synthetic_history(size)
+        counts = {}
+        for entry in history:
+            counts[entry['type']] = counts.get(entry['type'], 0) + 1
+        config = {'period': "Todo el historial", 'format': "PDF Completo", 'counts': counts}
+
+        for label, chunk_size in ((f'chunk={CONSULTATION_CHUNK}', CONSULTATION_CHUNK), ('sin chunks', None)):
+            elapsed, peak, pdf_size = measure(history, config, chunk_size, args.repeat)
+            print(f"{size:>10} {label:>12} {elapsed:>11.3f} {peak / 1024 / 1024:>14.1f} {pdf_size / 1024:>9.0f}")
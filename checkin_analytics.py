@@ -0,0 +1,144 @@
+"""Local analytics over the daily check-ins (``checkin_diario_<id>.txt``).
+
+Computes, without any LLM call, for water, exercise, wellness and sleep:
+
+- rolling 7/30-day means (the 7/30 calendar days up to today),
+- goal attainment rates over the last 7/30 days,
+- the current streak of days meeting each goal, and of days with a check-in,
+- anomaly flags: the latest day deviates from the previous 30 days by more
+  than ANOMALY_Z standard deviations (at least ANOMALY_MIN_STD, so a nearly
+  constant baseline does not flag every small change).
+
+Check-ins are resampled to one row per calendar day (days with several
+check-ins are averaged, missing days stay empty) and every statistic is a
+vectorized pandas rolling/grouping operation. ``format_features`` renders the
+result as a short text block, so the model receives a few computed features
+instead of raw check-in history.
+"""
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+SLEEP_SCALE = {"Muy mal": 1, "Mal": 2, "Regular": 3, "Bien": 4, "Muy bien": 5}
+
+# metric -> (label, check-in field, goal, unit); a day meets the goal when value >= goal
+METRICS = OrderedDict([
+    ('water', ('Hidratación', 'water_intake', 8, ' vasos')),
+    ('exercise', ('Ejercicio', 'exercise_minutes', 30, ' min')),
+    ('wellness', ('Bienestar', 'wellness_score', 7, '/10')),
+    ('sleep', ('Sueño', 'sleep_quality', SLEEP_SCALE["Bien"], '/5')),
+])
+
+ANOMALY_Z = 2.0
+ANOMALY_MIN_DAYS = 5
+# Smallest standard deviation used for the z-score, per metric (in its unit)
+ANOMALY_MIN_STD = {'water': 1.0, 'exercise': 10.0, 'wellness': 1.0, 'sleep': 0.5}
+
+
+def daily_frame(checkins, until=None):
+    """One row per calendar day (mean of that day's check-ins), continuous up to the last day or `until`"""
+    if not checkins:
+        return pd.DataFrame(columns=list(METRICS), dtype=float)
+    raw = pd.DataFrame(checkins)
+    frame = pd.DataFrame({'date': pd.to_datetime(raw['date'])})
+    for metric, (_, field, _, _) in METRICS.items():
+        values = raw[field] if field in raw else pd.Series(np.nan, index=raw.index)
+        if metric == 'sleep':
+            values = values.map(SLEEP_SCALE)
+        frame[metric] = pd.to_numeric(values, errors='coerce')
+    daily = frame.groupby('date').mean()
+    end = daily.index.max() if until is None else max(daily.index.max(), pd.Timestamp(until))
+    return daily.reindex(pd.date_range(daily.index.min(), end, freq='D'))
+
+
+def _run_length(flags):
+    """Length of the run of True values ending at each position"""
+    groups = (~flags).cumsum()
+    return flags.astype(int).groupby(groups).cumsum()
+
+
+def analyze_checkins(checkins, today=None):
+    """Trend features of the check-ins; None if there are none"""
+    today = pd.Timestamp((today or datetime.now()).date())
+    # Extended to today: the 7/30-day windows end today, not at the last check-in
+    calendar = daily_frame(checkins, until=today)
+    if calendar.empty:
+        return None
+    daily = calendar.loc[:calendar.notna().any(axis=1)[::-1].idxmax()]
+    logged = daily.notna().any(axis=1)
+    last_day = daily.index[-1]
+    # A streak is still alive if the last check-in was today or yesterday
+    alive = (today - last_day).days <= 1
+
+    means_7 = calendar.rolling(7, min_periods=1).mean().iloc[-1]
+    means_30 = calendar.rolling(30, min_periods=1).mean().iloc[-1]
+
+    # Statistics of the previous 30 days (current day excluded) for anomaly detection
+    history = daily.shift(1).rolling(30, min_periods=ANOMALY_MIN_DAYS)
+    baseline_mean = history.mean().iloc[-1]
+    baseline_std = history.std().iloc[-1]
+
+    metrics = OrderedDict()
+    for metric, (label, _, goal, unit) in METRICS.items():
+        values = daily[metric]
+        calendar_values = calendar[metric]
+        met = calendar_values >= goal
+        present = calendar_values.notna()
+        last_7, last_30 = present.iloc[-7:], present.iloc[-30:]
+        latest = values.iloc[-1]
+
+        anomaly, z_score = None, None
+        std = baseline_std[metric]
+        if pd.notna(latest) and pd.notna(std):
+            z_score = float((latest - baseline_mean[metric]) / max(std, ANOMALY_MIN_STD[metric]))
+            if abs(z_score) >= ANOMALY_Z:
+                anomaly = 'alto' if z_score > 0 else 'bajo'
+
+        metrics[metric] = {
+            'label': label,
+            'unit': unit,
+            'goal': goal,
+            'latest': None if pd.isna(latest) else float(latest),
+            'mean_7d': None if pd.isna(means_7[metric]) else float(means_7[metric]),
+            'mean_30d': None if pd.isna(means_30[metric]) else float(means_30[metric]),
+            'attainment_7d': float(met.iloc[-7:][last_7].mean()) if last_7.any() else None,
+            'attainment_30d': float(met.iloc[-30:][last_30].mean()) if last_30.any() else None,
+            'goal_streak': int(_run_length(values >= goal).iloc[-1]) if alive else 0,
+            'anomaly': anomaly,
+            'z_score': z_score,
+        }
+
+    return {
+        'days_logged': int(logged.sum()),
+        'first_date': daily.index[0].strftime('%Y-%m-%d'),
+        'last_date': last_day.strftime('%Y-%m-%d'),
+        'checkin_streak': int(_run_length(logged).iloc[-1]) if alive else 0,
+        'metrics': metrics,
+    }
+
+
+def _fmt(value, digits=1):
+    return '-' if value is None else f"{value:.{digits}f}"
+
+
+def _pct(value):
+    return '-' if value is None else f"{value:.0%}"
+
+
+def format_features(analytics):
+    """Compact text block of the computed features for an LLM prompt"""
+    if not analytics:
+        return "Sin check-ins registrados."
+    lines = [f"Días con check-in: {analytics['days_logged']} "
+             f"(racha actual: {analytics['checkin_streak']} días)"]
+    for data in analytics['metrics'].values():
+        line = (f"- {data['label']}: último {_fmt(data['latest'])}{data['unit']}, "
+                f"media 7d {_fmt(data['mean_7d'])}, media 30d {_fmt(data['mean_30d'])}, "
+                f"meta {data['goal']} cumplida {_pct(data['attainment_7d'])} (7d) / "
+                f"{_pct(data['attainment_30d'])} (30d), racha {data['goal_streak']} días")
+        if data['anomaly']:
+            line += f", ANOMALÍA: valor {data['anomaly']} respecto a su media"
+        lines.append(line)
+    return "\n".join(lines)
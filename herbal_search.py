@@ -0,0 +1,243 @@
+"""Search index for the herbal medicines and generic medicines databases.
+
+Every entry is tokenized once into an accent-folded inverted index
+(``sábila`` and ``sabila`` match), so a search is a handful of dictionary
+lookups instead of lowercasing every field of every plant on each rerun.
+Query terms are also expanded with Spanish/English synonyms (the databases
+describe uses in English), matched as prefixes while the user is typing, and
+matched fuzzily through a trigram index to tolerate typos. Results are ranked
+by field weight (name > scientific name > uses) and query coverage.
+
+Entries can be added or replaced one at a time with ``add_document``.
+"""
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from bisect import bisect_left
+
+FIELD_WEIGHTS = {
+    'key': 3.0,
+    'name': 3.0,
+    'scientific_name': 2.0,
+    'uses': 1.5,
+}
+
+EXACT_SCORE = 1.0
+SYNONYM_SCORE = 0.9
+PREFIX_SCORE = 0.8
+FUZZY_SCORE = 0.7
+FUZZY_MIN_SIMILARITY = 0.45
+MIN_PREFIX_LENGTH = 3
+
+STOPWORDS = {
+    'de', 'del', 'la', 'las', 'el', 'los', 'y', 'o', 'en', 'para', 'por', 'con', 'un', 'una',
+    'a', 'al', 'mi', 'me', 'the', 'of', 'and', 'or', 'for', 'to', 'in',
+}
+
+# Spanish <-> English equivalences for common symptoms and remedies (accent-folded)
+SYNONYM_GROUPS = [
+    ('dolor', 'pain', 'ache'),
+    ('cabeza', 'headache', 'head'),
+    ('fiebre', 'fever', 'calentura'),
+    ('tos', 'cough'),
+    ('gripe', 'resfriado', 'resfrio', 'cold', 'flu'),
+    ('congestion', 'congestion', 'mocos'),
+    ('respiratorio', 'respiratory'),
+    ('estomago', 'stomach', 'barriga', 'digestive', 'digestion', 'digestivo'),
+    ('nausea', 'nausea', 'vomito', 'mareo'),
+    ('diarrea', 'diarrhea'),
+    ('estrenimiento', 'constipation'),
+    ('acidez', 'gastritis', 'acid', 'gerd', 'reflujo'),
+    ('inflamacion', 'inflammation', 'hinchazon'),
+    ('piel', 'skin'),
+    ('herida', 'wound', 'cortadura'),
+    ('quemadura', 'burn'),
+    ('ansiedad', 'anxiety', 'nervios', 'estres', 'stress'),
+    ('sueno', 'sleep', 'insomnio', 'insomnia', 'dormir'),
+    ('rinon', 'kidney', 'renal'),
+    ('orina', 'urinary', 'urinaria'),
+    ('hueso', 'bone'),
+    ('infeccion', 'infection'),
+    ('sabila', 'aloe'),
+    ('manzanilla', 'chamomile'),
+    ('hierbabuena', 'spearmint', 'menta', 'mint'),
+    ('eucalipto', 'eucalyptus'),
+]
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def fold(text):
+    """Lowercase and strip accents ('Sábila' -> 'sabila')"""
+    decomposed = unicodedata.normalize('NFKD', str(text).lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _stem(token):
+    """Very small plural stemmer: 'heridas'/'herida', 'headaches'/'headache',
+    'inflamaciones'/'inflamacion' map to the same stem"""
+    if len(token) > 3 and token.endswith('s'):
+        token = token[:-1]
+    if len(token) > 4 and token[-1] == 'e' and token[-2] in 'nrld':
+        token = token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [_stem(token) for token in _TOKEN_RE.findall(fold(text)) if token not in STOPWORDS]
+
+
+def _trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _build_synonyms():
+    synonyms = defaultdict(set)
+    for group in SYNONYM_GROUPS:
+        stems = {_stem(word) for word in group}
+        for stem in stems:
+            synonyms[stem] |= stems - {stem}
+    return synonyms
+
+
+SYNONYMS = _build_synonyms()
+
+
+class SearchIndex:
+    """Inverted + trigram index over one or more named databases"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # token -> {(database, key): weight}
+        self._postings = defaultdict(dict)
+        # (database, key) -> set of tokens, to remove a document before re-indexing it
+        self._doc_tokens = {}
+        # trigram -> set of tokens
+        self._trigrams = defaultdict(set)
+        self._vocabulary = []
+        self._vocabulary_dirty = False
+
+    def copy(self):
+        """Independent copy, to update an index that readers may still be using (copy-on-write)"""
+        index = SearchIndex()
+        with self._lock:
+            index._postings = defaultdict(dict, {token: dict(docs) for token, docs in self._postings.items()})
+            index._doc_tokens = {doc_id: set(tokens) for doc_id, tokens in self._doc_tokens.items()}
+            index._trigrams = defaultdict(set, {trigram: set(tokens) for trigram, tokens in self._trigrams.items()})
+            index._vocabulary = self._vocabulary
+            index._vocabulary_dirty = self._vocabulary_dirty
+        return index
+
+    def add_database(self, database, entries):
+        for key, data in entries.items():
+            self.add_document(database, key, data)
+
+    def add_document(self, database, key, data):
+        """Index (or re-index) one entry"""
+        doc_id = (database, key)
+        weights = defaultdict(float)
+        for token in tokenize(key.replace('_', ' ')):
+            weights[token] = max(weights[token], FIELD_WEIGHTS['key'])
+        for field in ('name', 'scientific_name'):
+            for token in tokenize(data.get(field, '')):
+                weights[token] = max(weights[token], FIELD_WEIGHTS[field])
+        for use in data.get('uses', []):
+            for token in tokenize(use):
+                weights[token] = max(weights[token], FIELD_WEIGHTS['uses'])
+
+        with self._lock:
+            self._remove_locked(doc_id)
+            for token, weight in weights.items():
+                if token not in self._postings:
+                    for trigram in _trigrams(token):
+                        self._trigrams[trigram].add(token)
+                    self._vocabulary_dirty = True
+                self._postings[token][doc_id] = weight
+            self._doc_tokens[doc_id] = set(weights)
+
+    def remove_document(self, database, key):
+        with self._lock:
+            self._remove_locked((database, key))
+
+    def _remove_locked(self, doc_id):
+        for token in self._doc_tokens.pop(doc_id, ()):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[token]
+                for trigram in _trigrams(token):
+                    self._trigrams[trigram].discard(token)
+                self._vocabulary_dirty = True
+
+    def _sorted_vocabulary(self):
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        return self._vocabulary
+
+    def _expand(self, term):
+        """Index tokens matching a query term, with their match score"""
+        matches = {}
+        if term in self._postings:
+            matches[term] = EXACT_SCORE
+        for synonym in SYNONYMS.get(term, ()):
+            if synonym in self._postings:
+                matches.setdefault(synonym, SYNONYM_SCORE)
+
+        if len(term) >= MIN_PREFIX_LENGTH:
+            vocabulary = self._sorted_vocabulary()
+            position = bisect_left(vocabulary, term)
+            while position < len(vocabulary) and vocabulary[position].startswith(term):
+                matches.setdefault(vocabulary[position], PREFIX_SCORE)
+                position += 1
+
+        if not matches and len(term) >= MIN_PREFIX_LENGTH:
+            term_trigrams = _trigrams(term)
+            candidates = defaultdict(int)
+            for trigram in term_trigrams:
+                for token in self._trigrams.get(trigram, ()):
+                    candidates[token] += 1
+            for token, shared in candidates.items():
+                similarity = shared / len(term_trigrams | _trigrams(token))
+                if similarity >= FUZZY_MIN_SIMILARITY:
+                    matches[token] = FUZZY_SCORE * similarity
+        return matches
+
+    def search(self, query, database=None, limit=None):
+        """Keys ranked by relevance (optionally only from one database)"""
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        scores = defaultdict(float)
+        matched_terms = defaultdict(int)
+        with self._lock:
+            for term in terms:
+                best = {}
+                for token, match_score in self._expand(term).items():
+                    for doc_id, weight in self._postings[token].items():
+                        if database is not None and doc_id[0] != database:
+                            continue
+                        best[doc_id] = max(best.get(doc_id, 0.0), match_score * weight)
+                for doc_id, score in best.items():
+                    scores[doc_id] += score
+                    matched_terms[doc_id] += 1
+
+        # Entries matching every query term rank above partial matches
+        ranked = sorted(
+            scores,
+            key=lambda doc_id: (-matched_terms[doc_id] / len(terms), -scores[doc_id], doc_id[1])
+        )
+        keys = [doc_id[1] if database is not None else doc_id for doc_id in ranked]
+        return keys[:limit] if limit else keys
+
+
+def build_index(herbal_db, generic_db):
+    index = SearchIndex()
+    index.add_database('herbal', herbal_db)
+    index.add_database('generic', generic_db)
+    return index
@@ -0,0 +1,130 @@
+"""Aggregate counters of a user's medical history, maintained on write.
+
+The history metrics, the report preview/summary table and the AI summary
+used to recount the whole history on every rerun. Instead, a small stats
+record is updated each time a consultation or check-in is saved and stored
+next to the history by the storage backend:
+
+    {
+        "total": 42, "emergencies": 1,
+        "by_type": {"daily_checkin": 30, "medical_evaluation": 12},
+        "by_day": {"2025-07-29": {"daily_checkin": 1}},
+        "first_timestamp": "...", "last_timestamp": "...",
+        "checkins": 30, "checkins_by_date": {"2025-07-29": 1},
+        "last_checkin_date": "2025-07-29"
+    }
+
+``checkins`` counts the daily check-in records kept by the check-in store,
+which drops those older than ``CHECKIN_RETENTION_DAYS`` on every save.
+``add_checkin`` applies the same cutoff to ``checkins_by_date``, so the
+incremental counter always equals a rebuild from the stored check-ins. Counts for a period are sums of day
+buckets, so periods start at midnight (see ``period_start``). A record that
+does not match the loaded history (older data, edits made outside the app) is
+rebuilt from it.
+"""
+from datetime import datetime, time, timedelta
+
+from storage import checkin_cutoff
+
+STATS_VERSION = 2
+
+
+def empty_stats():
+    return {
+        'version': STATS_VERSION,
+        'total': 0,
+        'emergencies': 0,
+        'by_type': {},
+        'by_day': {},
+        'first_timestamp': None,
+        'last_timestamp': None,
+        'checkins': 0,
+        'checkins_by_date': {},
+        'last_checkin_date': None,
+    }
+
+
+def is_emergency(entry):
+    return entry.get('assessment_level') == 'EMERGENCY' or entry.get('type') == 'emergency'
+
+
+def add_consultation(stats, entry):
+    """Count one consultation into `stats` (in place) and return it"""
+    entry_type = entry.get('type', 'general')
+    timestamp = entry['timestamp']
+    day = stats['by_day'].setdefault(timestamp[:10], {})
+    day[entry_type] = day.get(entry_type, 0) + 1
+    stats['by_type'][entry_type] = stats['by_type'].get(entry_type, 0) + 1
+    stats['total'] += 1
+    if is_emergency(entry):
+        stats['emergencies'] += 1
+    if stats['first_timestamp'] is None or timestamp < stats['first_timestamp']:
+        stats['first_timestamp'] = timestamp
+    if stats['last_timestamp'] is None or timestamp > stats['last_timestamp']:
+        stats['last_timestamp'] = timestamp
+    return stats
+
+
+def _count_checkin(stats, checkin):
+    by_date = stats['checkins_by_date']
+    by_date[checkin['date']] = by_date.get(checkin['date'], 0) + 1
+    stats['checkins'] += 1
+    stats['last_checkin_date'] = max(stats['last_checkin_date'] or '', checkin['date'])
+
+
+def add_checkin(stats, checkin, now=None):
+    """Count a newly saved check-in into `stats` (in place), dropping the days the store drops"""
+    _count_checkin(stats, checkin)
+    cutoff = checkin_cutoff(now)
+    by_date = stats['checkins_by_date']
+    for date in [date for date in by_date if date < cutoff]:
+        stats['checkins'] -= by_date.pop(date)
+    return stats
+
+
+def build_stats(medical_history, checkins=()):
+    """Full rebuild from a history (and check-in records)"""
+    stats = empty_stats()
+    for entry in medical_history:
+        add_consultation(stats, entry)
+    # The stored check-ins were already pruned when the last one was saved
+    for checkin in checkins:
+        _count_checkin(stats, checkin)
+    return stats
+
+
+def matches_history(stats, medical_history):
+    """Cheap consistency check between a stored record and the loaded history"""
+    if not stats or stats.get('version') != STATS_VERSION or stats['total'] != len(medical_history):
+        return False
+    return not medical_history or stats['last_timestamp'] >= medical_history[-1]['timestamp']
+
+
+def period_start(days, now=None):
+    """Midnight starting a period of the last `days` calendar days (today included)"""
+    now = now or datetime.now()
+    return datetime.combine((now - timedelta(days=days - 1)).date(), time.min)
+
+
+def counts_by_type(stats, since=None, exclude_types=()):
+    """Consultations per type, optionally only from the day of `since` onwards"""
+    if since is None or stats['last_timestamp'] is None:
+        counts = dict(stats['by_type']) if since is None else {}
+    else:
+        # Only the day buckets inside the period are visited
+        counts = {}
+        day = since.date()
+        last_day = datetime.fromisoformat(stats['last_timestamp']).date()
+        while day <= last_day:
+            for entry_type, count in stats['by_day'].get(day.isoformat(), {}).items():
+                counts[entry_type] = counts.get(entry_type, 0) + count
+            day += timedelta(days=1)
+    for entry_type in exclude_types:
+        counts.pop(entry_type, None)
+    return counts
+
+
+def count_consultations(stats, since=None, exclude_types=()):
+    if since is None and not exclude_types:
+        return stats['total']
+    return sum(counts_by_type(stats, since, exclude_types).values())
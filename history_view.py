@@ -0,0 +1,118 @@
+"""Windowed views of a medical history for the history tab.
+
+The timeline shows one page of consultations at a time, newest first, so the
+widgets rendered (and the bytes sent to the browser) per rerun are bounded by
+the page size instead of growing with the history. Pages are addressed by a
+keyset cursor, the (timestamp, id) key of the newest entry on the page,
+located by binary search over the sorted keys: a consultation saved while
+browsing does not shift the page being read.
+
+Period and type filters run on a ``HistoryFrame``: a pandas view of the
+history with timestamps parsed once into a sorted ``datetime64`` column, so a
+period is a binary search and a type filter a vectorized mask instead of a
+``datetime.fromisoformat`` call per entry. ``HistoryFrame.view`` also keeps
+the sorted pagination order of each filter, so a rerun that only changes the
+page does not sort the history again.
+"""
+from bisect import bisect_right
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_PAGE_SIZE = 10
+PAGE_SIZES = (10, 25, 50)
+# Filter views kept per HistoryFrame (type x period combinations in use)
+MAX_VIEWS = 8
+
+HistoryPage = namedtuple(
+    'HistoryPage',
+    ['entries', 'number', 'total_pages', 'total', 'newer_cursor', 'older_cursor']
+)
+
+
+def entry_key(entry):
+    return (entry.get('timestamp') or '', entry.get('id') or '')
+
+
+def sorted_keys(entries):
+    """Positions of `entries` in chronological order, and their sort keys"""
+    order = sorted(range(len(entries)), key=lambda position: entry_key(entries[position]))
+    return order, [entry_key(entries[position]) for position in order]
+
+
+def paginate(entries, cursor=None, page_size=DEFAULT_PAGE_SIZE, order=None):
+    """Page of `entries` (newest first) starting at `cursor`; None is the newest page.
+
+    `order` can be passed when the caller already has the chronological
+    (positions, keys) pair from sorted_keys.
+    """
+    positions, keys = order or sorted_keys(entries)
+    total = len(positions)
+    end = total if cursor is None else bisect_right(keys, tuple(cursor))
+    if end == 0 and total:
+        # Cursor older than everything left (entries were removed): restart
+        end = total
+    start = max(end - page_size, 0)
+
+    newer_end = min(end + page_size, total)
+    # Pages newer than the cursor, this one and the older ones: entries saved
+    # since the cursor was taken can shift the page boundaries by one page
+    number = -(-(total - end) // page_size) + 1
+    return HistoryPage(
+        entries=[entries[positions[i]] for i in range(end - 1, start - 1, -1)],
+        number=number,
+        total_pages=number + -(-start // page_size),
+        total=total,
+        newer_cursor=keys[newer_end - 1] if end < total else None,
+        older_cursor=keys[start - 1] if start > 0 else None,
+    )
+
+
+class HistoryFrame:
+    """Columnar, time-sorted view of a medical history for fast filtering.
+
+    Build one per history version and reuse it across reruns; entries are
+    returned from the original list, in chronological order.
+    """
+
+    def __init__(self, medical_history):
+        self.entries = medical_history
+        frame = pd.DataFrame({
+            # numpy parses ISO 8601 strings natively (with or without microseconds)
+            'timestamp': np.array([entry['timestamp'] for entry in medical_history], dtype='datetime64[us]'),
+            'type': pd.Categorical([entry.get('type', 'general') for entry in medical_history]),
+            'position': np.arange(len(medical_history)),
+        })
+        self.frame = frame.sort_values('timestamp', kind='stable').reset_index(drop=True)
+        self._timestamps = self.frame['timestamp'].to_numpy()
+        self._views = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def filter(self, types=None, since=None, exclude_types=()):
+        """Entries of the given types, newer than `since` and not of `exclude_types`"""
+        frame = self.frame
+        if since is not None:
+            start = np.searchsorted(self._timestamps, np.datetime64(since, 'us'), side='right')
+            frame = frame.iloc[start:]
+        if types is not None:
+            frame = frame[frame['type'].isin(list(types))]
+        if exclude_types:
+            frame = frame[~frame['type'].isin(list(exclude_types))]
+        return [self.entries[position] for position in frame['position'].to_numpy()]
+
+    def view(self, types=None, since=None):
+        """(entries, order) of a filter, where order is the sorted_keys pair for paginate; memoized"""
+        view_key = (None if types is None else tuple(types), since)
+        cached = self._views.get(view_key)
+        if cached is None:
+            if types is None and since is None:
+                entries = self.entries
+            else:
+                entries = self.filter(types=types, since=since)
+            if len(self._views) >= MAX_VIEWS:
+                self._views.clear()
+            cached = self._views[view_key] = (entries, sorted_keys(entries))
+        return cached
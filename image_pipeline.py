@@ -0,0 +1,88 @@
+"""Preprocessing of uploaded medical photos before they reach the vision model.
+
+Phone photos (4-12 MB) are decoded once, rotated according to their EXIF
+orientation, downscaled to the model's input resolution and re-encoded as a
+compact JPEG without metadata (EXIF, GPS). A small thumbnail is produced for
+the chat display so session state does not keep full-size photos. Results are
+cached by the SHA-256 of the original bytes, so reruns and repeated uploads of
+the same photo are not processed again.
+"""
+import base64
+import hashlib
+import io
+import threading
+from collections import OrderedDict, namedtuple
+
+from PIL import Image, ImageOps
+
+# Gemma 3 vision encoder input resolution; larger images are resized by Ollama anyway
+MODEL_INPUT_SIZE = 896
+THUMBNAIL_SIZE = 200
+JPEG_QUALITY = 85
+THUMBNAIL_QUALITY = 75
+CACHE_MAX_ENTRIES = 32
+
+PreparedImage = namedtuple(
+    'PreparedImage',
+    ['digest', 'base64', 'thumbnail', 'width', 'height', 'original_size', 'encoded_size']
+)
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _encode_jpeg(image, quality):
+    buffer = io.BytesIO()
+    # Saving without exif= drops all metadata from the original file
+    image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _to_rgb(image):
+    """JPEG has no alpha channel: flatten transparent images onto white"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def prepare_image(image_bytes, max_size=MODEL_INPUT_SIZE):
+    """Return a PreparedImage (model-ready base64 JPEG + chat thumbnail) for raw upload bytes"""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    cache_key = (digest, max_size)
+    with _cache_lock:
+        if cache_key in _cache:
+            _cache.move_to_end(cache_key)
+            return _cache[cache_key]
+
+    image = Image.open(io.BytesIO(image_bytes))
+    # Let the JPEG decoder downscale while decoding (DCT scaling) when possible
+    image.draft('RGB', (max_size, max_size))
+    image = _to_rgb(ImageOps.exif_transpose(image))
+
+    model_image = image.copy()
+    model_image.thumbnail((max_size, max_size), Image.LANCZOS)
+    encoded = _encode_jpeg(model_image, JPEG_QUALITY)
+
+    thumbnail = model_image.copy()
+    thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+
+    prepared = PreparedImage(
+        digest=digest,
+        base64=base64.b64encode(encoded).decode('utf-8'),
+        thumbnail=_encode_jpeg(thumbnail, THUMBNAIL_QUALITY),
+        width=model_image.width,
+        height=model_image.height,
+        original_size=len(image_bytes),
+        encoded_size=len(encoded),
+    )
+
+    with _cache_lock:
+        _cache[cache_key] = prepared
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return prepared
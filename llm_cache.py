@@ -0,0 +1,155 @@
+"""Persistent response cache for repeatable LLM prompts.
+
+Responses are stored in ``data/llm_cache.sqlite`` keyed by a SHA-256 of the
+model, the full prompt (system + user), the image digest and the generation
+options, so asking the same question about the same context is answered from
+disk instead of re-running inference. The cache is bounded by entry count and
+total size with least-recently-used eviction, and entries can optionally expire.
+
+Limits can be tuned with environment variables:
+
+- ``LLM_CACHE_MAX_ENTRIES`` (default 500)
+- ``LLM_CACHE_MAX_MB`` (default 20)
+- ``LLM_CACHE_TTL_HOURS`` (default 0, no expiry)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join('data', 'llm_cache.sqlite')
+DEFAULT_MAX_ENTRIES = 500
+DEFAULT_MAX_MB = 20
+
+
+def cache_options_from_env():
+    """Read the cache limits from LLM_CACHE_* environment variables"""
+    ttl_hours = float(os.environ.get('LLM_CACHE_TTL_HOURS', 0))
+    return {
+        'max_entries': int(os.environ.get('LLM_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+        'max_bytes': int(float(os.environ.get('LLM_CACHE_MAX_MB', DEFAULT_MAX_MB)) * 1024 * 1024),
+        'ttl': ttl_hours * 3600 if ttl_hours > 0 else None,
+    }
+
+
+def make_cache_key(payload):
+    """Hash of model, full prompt, image digest and options of a /api/generate payload"""
+    images = payload.get('images') or []
+    key_data = {
+        'model': payload['model'],
+        'prompt': payload['prompt'],
+        'images': [hashlib.sha256(image.encode('utf-8')).hexdigest() for image in images],
+        'options': payload.get('options', {}),
+    }
+    return hashlib.sha256(
+        json.dumps(key_data, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+
+
+class LLMResponseCache:
+    """Size-bounded LRU cache of LLM responses backed by SQLite"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            text TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access);
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_MB * 1024 * 1024, ttl=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return the cached text for `key`, or None on a miss or expired entry"""
+        conn = self._connect()
+        row = conn.execute('SELECT text, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+            with conn:
+                conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            row = None
+
+        with self._lock:
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+
+        with conn:
+            conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def put(self, key, model, text):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, model, text, size, created_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, model, text, len(text.encode('utf-8')), now, now)
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """Drop least recently used entries until both limits hold"""
+        count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        evicted = 0
+        rows = conn.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall()
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            count -= 1
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._evictions += evicted
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM responses')
+
+    def stats(self):
+        count, total = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses'
+        ).fetchone()
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else None,
+                'evictions': self._evictions,
+                'entries': count,
+                'bytes': total,
+            }
@@ -0,0 +1,298 @@
+"""Persistent background queue for long LLM tasks.
+
+Trend analyses and report summaries used to run inside the Streamlit script
+under ``st.spinner``: the session was blocked for the whole generation and a
+browser refresh threw the work away. They are now submitted as jobs:
+
+- jobs are stored in ``data/llm_jobs.sqlite`` (kind, payload, status, result),
+  so results survive reruns and refreshes, and jobs still queued or running
+  when the process stopped are picked up again on the next start;
+- a small pool of worker threads executes them; its size should match how
+  many requests Ollama serves in parallel (``LLM_JOB_WORKERS``, by default
+  ``OLLAMA_NUM_PARALLEL`` or 1), since extra workers would only queue inside
+  Ollama;
+- each job has a priority lane (``emergency`` > ``chat`` > ``checkin`` >
+  ``batch``) and workers always take the highest-priority job first;
+- submitting a job identical to one still pending returns the pending job.
+
+Generations made by jobs go through the client's admission control in the
+``batch`` class unless the payload sets another ``priority``, so they never
+delay interactive or emergency requests.
+
+A job kind maps to a handler ``handler(payload) -> result`` (both JSON
+serializable); see ``make_handlers``. The UI polls ``get(job_id)``. Payloads
+reference patient data by ``user_id`` (the handler loads it from storage)
+rather than copying it into the queue, and ``clear(user_id)`` removes a
+user's jobs and results.
+"""
+import hashlib
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from checkin_analytics import analyze_checkins, format_features
+from patient_summary import summarize_patient
+from prompts import health_assistant_prompt, trend_analysis_prompt
+from reference_db import ReferenceData
+from storage import get_storage
+
+DATA_DIR = 'data'
+JOBS_FILENAME = 'llm_jobs.sqlite'
+DEFAULT_WORKERS = 1
+# Finished jobs are kept this long for polling / refresh recovery
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+PRIORITIES = {'emergency': 0, 'chat': 1, 'checkin': 2, 'batch': 3}
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED = (DONE, FAILED)
+
+
+def job_queue_options_from_env():
+    workers = os.environ.get('LLM_JOB_WORKERS') or os.environ.get('OLLAMA_NUM_PARALLEL') or DEFAULT_WORKERS
+    return {'workers': max(int(workers), 1)}
+
+
+def make_handlers(client_for_host, storage=None, reference=None):
+    """Job handlers; `client_for_host(host)` returns the shared OllamaClient of a host"""
+    storage = storage or get_storage()
+    reference = reference or ReferenceData()
+
+    def generate(payload):
+        client = client_for_host(payload['host'])
+        return client.generate(
+            payload['model'], payload['prompt'],
+            temperature=payload.get('temperature', 0.7),
+            max_tokens=payload.get('max_tokens', 512),
+            system_prompt=payload.get('system_prompt', ''),
+            use_cache=payload.get('use_cache', False),
+            priority=payload.get('priority', 'batch')
+        )
+
+    def patient_summary(payload):
+        """Summary of a user's report selection: {user_id, scope, cutoff (ISO or None), exclude_types}"""
+        user_id = payload['user_id']
+        user_profile = storage.load_user_profile(user_id)
+        if user_profile is None:
+            return {"success": False, "error": "Perfil no encontrado"}
+        cutoff = datetime.fromisoformat(payload['cutoff']) if payload.get('cutoff') else None
+        exclude_types = payload.get('exclude_types', [])
+        # Indexed query on the SQLite backend: only the report's period is read
+        history_to_include = storage.query_history(user_id, since=cutoff, exclude_types=exclude_types)
+        return summarize_patient(
+            client_for_host(payload['host']), payload['model'], user_profile, history_to_include,
+            scope=payload['scope'], priority=payload.get('priority', 'batch')
+        )
+
+    def trend_analysis(payload):
+        """Trend analysis of a user's history: {user_id, host, model, generation options}"""
+        user_id = payload['user_id']
+        user_profile = storage.load_user_profile(user_id)
+        if user_profile is None:
+            return {"success": False, "error": "Perfil no encontrado"}
+        # Check-ins are summarized by the locally computed features
+        # instead of being sent one by one
+        consultations = storage.query_history(user_id, exclude_types=['daily_checkin'])
+        checkin_features = format_features(analyze_checkins(storage.load_daily_checkins(user_id)))
+        snapshot = reference.snapshot()
+        return client_for_host(payload['host']).generate(
+            payload['model'], trend_analysis_prompt(consultations, checkin_features),
+            temperature=payload.get('temperature', 0.3),
+            max_tokens=payload.get('max_tokens', 800),
+            system_prompt=health_assistant_prompt(user_profile, storage.load_medical_history(user_id),
+                                                  snapshot.herbal, snapshot.generic),
+            use_cache=payload.get('use_cache', False),
+            priority=payload.get('priority', 'batch')
+        )
+
+    return {'generate': generate, 'trend_analysis': trend_analysis, 'patient_summary': patient_summary}
+
+
+class JobQueue:
+    """SQLite-backed job queue with priority lanes and a fixed worker pool"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            user_id TEXT,
+            kind TEXT NOT NULL,
+            lane TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            fingerprint TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_user_kind ON jobs (user_id, kind, created_at);
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+    """
+
+    def __init__(self, handlers, db_path=None, workers=DEFAULT_WORKERS):
+        self.handlers = handlers
+        self.db_path = db_path or os.path.join(DATA_DIR, JOBS_FILENAME)
+        self.workers = workers
+        self._local = threading.local()
+        self._condition = threading.Condition()
+        # (priority, sequence, job_id); the sequence keeps FIFO order inside a lane
+        self._heap = []
+        self._sequence = 0
+        self._threads = []
+        self._stopping = False
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def start(self):
+        """Recover unfinished jobs, purge old ones and start the workers"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+                         (DONE, FAILED, time.time() - JOB_RETENTION_SECONDS))
+            # Jobs interrupted by a restart run again from the start
+            conn.execute('UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?', (QUEUED, RUNNING))
+            pending = conn.execute(
+                'SELECT id, priority FROM jobs WHERE status = ? ORDER BY created_at', (QUEUED,)
+            ).fetchall()
+        for row in pending:
+            self._enqueue(row['id'], row['priority'])
+
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'llm-job-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+    def _enqueue(self, job_id, priority):
+        with self._condition:
+            self._sequence += 1
+            heapq.heappush(self._heap, (priority, self._sequence, job_id))
+            self._condition.notify()
+
+    def submit(self, kind, payload, user_id=None, lane='batch'):
+        """Queue a job and return its id (or the id of an identical pending job)"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        priority = PRIORITIES[lane]
+        payload_json = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        fingerprint = hashlib.sha256(f'{user_id}|{kind}|{payload_json}'.encode('utf-8')).hexdigest()
+
+        with self._connect() as conn:
+            existing = conn.execute(
+                'SELECT id FROM jobs WHERE fingerprint = ? AND status IN (?, ?)',
+                (fingerprint, QUEUED, RUNNING)
+            ).fetchone()
+            if existing:
+                return existing['id']
+            job_id = str(uuid.uuid4())
+            conn.execute(
+                'INSERT INTO jobs (id, user_id, kind, lane, priority, fingerprint, status, payload, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, user_id, kind, lane, priority, fingerprint, QUEUED, payload_json, time.time())
+            )
+        self._enqueue(job_id, priority)
+        return job_id
+
+    def _job_dict(self, row):
+        job = {key: row[key] for key in ('id', 'user_id', 'kind', 'lane', 'status', 'error',
+                                          'created_at', 'started_at', 'finished_at')}
+        job['result'] = json.loads(row['result']) if row['result'] else None
+        return job
+
+    def get(self, job_id, user_id=None):
+        """Job status and result, plus its position in the queue while waiting.
+
+        With a `user_id`, a job submitted for another user is reported as missing.
+        """
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None or (user_id is not None and row['user_id'] != user_id):
+            return None
+        job = self._job_dict(row)
+        if job['status'] == QUEUED:
+            with self._condition:
+                ahead = sorted(self._heap)
+            job['position'] = next((i for i, item in enumerate(ahead) if item[2] == job_id), len(ahead)) + 1
+        return job
+
+    def clear(self, user_id):
+        """Delete every job of a user (payloads and results); a running job finishes without a record"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM jobs WHERE user_id = ?', (user_id,))
+
+    def latest_job_id(self, user_id, kind, max_age=None):
+        """Id of the most recent job of a kind for a user (to recover it after a page refresh)"""
+        query = 'SELECT id FROM jobs WHERE user_id = ? AND kind = ?'
+        params = [user_id, kind]
+        if max_age is not None:
+            query += ' AND created_at >= ?'
+            params.append(time.time() - max_age)
+        row = self._connect().execute(query + ' ORDER BY created_at DESC LIMIT 1', params).fetchone()
+        return row['id'] if row else None
+
+    def stats(self):
+        """Job counts by status and queued jobs per lane"""
+        rows = self._connect().execute('SELECT status, lane, COUNT(*) AS n FROM jobs GROUP BY status, lane')
+        by_status, queued_by_lane = {}, {}
+        for row in rows:
+            by_status[row['status']] = by_status.get(row['status'], 0) + row['n']
+            if row['status'] == QUEUED:
+                queued_by_lane[row['lane']] = row['n']
+        return {'by_status': by_status, 'queued_by_lane': queued_by_lane, 'workers': self.workers}
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._heap and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                _, _, job_id = heapq.heappop(self._heap)
+            self._run(job_id)
+
+    def _run(self, job_id):
+        conn = self._connect()
+        with conn:
+            claimed = conn.execute(
+                'UPDATE jobs SET status = ?, started_at = ? WHERE id = ? AND status = ?',
+                (RUNNING, time.time(), job_id, QUEUED)
+            ).rowcount
+        if not claimed:
+            return
+        row = conn.execute('SELECT kind, payload FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+        try:
+            result = self.handlers[row['kind']](json.loads(row['payload']))
+            status, error = DONE, None
+        except Exception as e:
+            result, status, error = None, FAILED, str(e)
+
+        with conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?',
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, time.time(), job_id)
+            )
@@ -0,0 +1,579 @@
+"""Pooled HTTP client for the Ollama API.
+
+A single ``OllamaClient`` per Ollama host keeps a bounded pool of keep-alive
+connections, so consecutive generations reuse the same TCP connection instead
+of paying a new handshake (and leaving a socket in TIME_WAIT) per request.
+The Streamlit app shares one client per host across all sessions through
+``st.cache_resource``.
+
+Pool size, retries and keep-alive can be tuned with environment variables:
+
+- ``OLLAMA_POOL_SIZE`` (default 4): maximum open connections to the host. The
+  app raises it to the admission slots plus one (``pool_size_for``), so every
+  admitted generation, emergencies included, finds a connection.
+- ``OLLAMA_POOL_TIMEOUT`` (default 30): seconds to wait for a free connection
+  before failing (requests itself would wait forever).
+- ``OLLAMA_MAX_RETRIES`` (default 2): retries on connection errors / 502-504.
+- ``OLLAMA_RETRY_BACKOFF`` (default 0.5): exponential backoff factor in seconds.
+- ``OLLAMA_TCP_KEEPALIVE`` (default 1): enable TCP keep-alive probes on idle sockets.
+
+Host availability is tracked by an ``OllamaHealthMonitor`` that probes the host
+from a background thread over its own connection, so page renders only read
+the last known status and a saturated pool cannot stall the probe. It
+also acts as a circuit breaker: after repeated failures generations fail fast
+and probes back off until the host answers again.
+
+Generations can be given a priority class (``emergency``, ``chat``,
+``checkin``, ``batch``); when an ``AdmissionController`` is attached as
+``client.admission`` each generation waits for a slot of its class first (see
+``admission.py``). Cache hits and embeddings bypass admission.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from admission import AdmissionRejected
+from llm_cache import make_cache_key
+from prompt_budget import estimate_tokens
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.5
+HEALTH_TIMEOUT = 5
+GENERATE_TIMEOUT = 120
+
+HEALTH_TTL = 15
+HEALTH_FAILURE_THRESHOLD = 3
+HEALTH_MAX_BACKOFF = 120
+# A refused request asks for a probe at most this often (seconds)
+HEALTH_REFRESH_INTERVAL = 1
+
+
+def client_options_from_env():
+    """Read the client configuration from OLLAMA_* environment variables"""
+    return {
+        'pool_size': int(os.environ.get('OLLAMA_POOL_SIZE', DEFAULT_POOL_SIZE)),
+        'pool_timeout': float(os.environ.get('OLLAMA_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT)),
+        'max_retries': int(os.environ.get('OLLAMA_MAX_RETRIES', DEFAULT_MAX_RETRIES)),
+        'backoff_factor': float(os.environ.get('OLLAMA_RETRY_BACKOFF', DEFAULT_RETRY_BACKOFF)),
+        'tcp_keepalive': os.environ.get('OLLAMA_TCP_KEEPALIVE', '1') != '0',
+    }
+
+
+def pool_size_for(admission, pool_size=DEFAULT_POOL_SIZE):
+    """Pool size that fits every admission slot plus one connection for embeddings"""
+    return max(pool_size, admission.total_slots + 1)
+
+
+class _PoolTimeoutMixin:
+    """Connection pool that waits at most `pool_timeout` seconds for a free connection"""
+
+    def __init__(self, *args, pool_timeout=DEFAULT_POOL_TIMEOUT, **kwargs):
+        self.pool_timeout = pool_timeout
+        super().__init__(*args, **kwargs)
+
+    def _get_conn(self, timeout=None):
+        # requests never passes a pool timeout, so a full blocking pool would wait forever
+        return super()._get_conn(timeout=self.pool_timeout if timeout is None else timeout)
+
+
+class _TimedHTTPConnectionPool(_PoolTimeoutMixin, HTTPConnectionPool):
+    pass
+
+
+class _TimedHTTPSConnectionPool(_PoolTimeoutMixin, HTTPSConnectionPool):
+    pass
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter that enables TCP keep-alive on pooled sockets and bounds the wait for one"""
+
+    def __init__(self, tcp_keepalive=True, pool_timeout=DEFAULT_POOL_TIMEOUT, **kwargs):
+        self.tcp_keepalive = tcp_keepalive
+        self.pool_timeout = pool_timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tcp_keepalive:
+            kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': partial(_TimedHTTPConnectionPool, pool_timeout=self.pool_timeout),
+            'https': partial(_TimedHTTPSConnectionPool, pool_timeout=self.pool_timeout),
+        }
+
+
+class OllamaClient:
+    """Thread-safe, pooled client for one Ollama host"""
+
+    def __init__(self, host, pool_size=DEFAULT_POOL_SIZE, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_RETRY_BACKOFF, tcp_keepalive=True, pool_timeout=DEFAULT_POOL_TIMEOUT):
+        self.host = host.rstrip('/')
+        self.pool_size = pool_size
+
+        # Only connection failures and gateway errors are retried: a read timeout
+        # on a long generation must not silently start the generation again.
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET', 'POST'}),
+            raise_on_status=False,
+        )
+        self._adapter = _KeepAliveAdapter(
+            tcp_keepalive=tcp_keepalive,
+            pool_timeout=pool_timeout,
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.headers['Connection'] = 'keep-alive'
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._streams = 0
+        self._ttft_total = 0.0
+        self._last_ttft = None
+        self._last_prompt_tokens = None
+
+        # Set by OllamaHealthMonitor when one is attached to this client
+        self.health = None
+        # Optional LLMResponseCache consulted by calls made with use_cache=True
+        self.cache = None
+        # Optional AdmissionController that orders generations by priority class
+        self.admission = None
+
+    def _request(self, method, path, **kwargs):
+        with self._lock:
+            self._requests += 1
+        try:
+            response = self.session.request(method, f"{self.host}{path}", **kwargs)
+        except EmptyPoolError:
+            with self._lock:
+                self._errors += 1
+            # Every connection is busy: the host itself is fine
+            raise RuntimeError("Todas las conexiones con Ollama están ocupadas; inténtalo de nuevo") from None
+        except requests.RequestException as e:
+            with self._lock:
+                self._errors += 1
+            # Real traffic feeds the circuit breaker between background probes
+            if self.health is not None and isinstance(e, requests.ConnectionError):
+                self.health.record_failure()
+            raise
+        if self.health is not None and response.status_code < 500:
+            self.health.record_success()
+        return response
+
+    def _circuit_open_result(self):
+        return {"success": False, "error": "Ollama no disponible: se reintentará automáticamente en unos segundos"}
+
+    def _admit(self, priority):
+        """Wait for a generation slot; returns (queue wait, error message or None)"""
+        if self.admission is None:
+            return 0.0, None
+        try:
+            return self.admission.acquire(priority), None
+        except AdmissionRejected as e:
+            return None, str(e)
+
+    def _release(self, priority):
+        if self.admission is not None:
+            self.admission.release(priority)
+
+    def is_available(self, timeout=HEALTH_TIMEOUT):
+        """Return True if the host answers /api/tags"""
+        try:
+            response = self._request('GET', '/api/tags', timeout=timeout)
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+
+    @staticmethod
+    def build_payload(model, prompt, image_base64=None, temperature=0.7, max_tokens=512,
+                      system_prompt="", stream=False):
+        """Build the /api/generate request body"""
+        full_prompt = f"{system_prompt}\n\nUsuario: {prompt}" if system_prompt else prompt
+
+        payload = {
+            "model": model,
+            "prompt": full_prompt,
+            "stream": stream,
+            "options": {
+                "temperature": temperature,
+                "num_predict": max_tokens
+            }
+        }
+
+        if image_base64:
+            payload["images"] = [image_base64]
+        return payload
+
+    def generate(self, model, prompt, image_base64=None, temperature=0.7, max_tokens=512,
+                 system_prompt="", timeout=GENERATE_TIMEOUT, use_cache=False, priority='chat'):
+        """Call /api/generate and return a result dict (success, text/error, response_time, prompt_tokens)"""
+        payload = self.build_payload(model, prompt, image_base64, temperature, max_tokens, system_prompt)
+        prompt_tokens = estimate_tokens(payload["prompt"])
+
+        cache_key = None
+        if use_cache and self.cache is not None:
+            start_time = time.time()
+            cache_key = make_cache_key(payload)
+            cached_text = self.cache.get(cache_key)
+            if cached_text is not None:
+                return {
+                    "success": True,
+                    "text": cached_text,
+                    "response_time": time.time() - start_time,
+                    "prompt_tokens": prompt_tokens,
+                    "model": model,
+                    "cached": True
+                }
+
+        if self.health is not None and not self.health.allow_request(priority):
+            return self._circuit_open_result()
+
+        queue_wait, rejected = self._admit(priority)
+        if rejected:
+            return {"success": False, "error": rejected}
+        try:
+            start_time = time.time()
+            response = self._request('POST', '/api/generate', json=payload, timeout=timeout)
+            end_time = time.time()
+
+            if response.status_code != 200:
+                return {"success": False, "error": f"HTTP {response.status_code}: {response.text}"}
+
+            result = response.json()
+            response_time = end_time - start_time
+
+            if "response" in result:
+                if cache_key is not None:
+                    self.cache.put(cache_key, model, result["response"])
+                # Ollama reports the exact count; keep the estimate for older servers
+                prompt_tokens = result.get("prompt_eval_count", prompt_tokens)
+                self._record_prompt_tokens(prompt_tokens)
+                return {
+                    "success": True,
+                    "text": result["response"],
+                    "response_time": response_time,
+                    "prompt_tokens": prompt_tokens,
+                    "queue_wait": queue_wait,
+                    "model": model
+                }
+            else:
+                return {"success": False, "error": "No response in result"}
+
+        except Exception as e:
+            return {"success": False, "error": f"Error: {str(e)}"}
+        finally:
+            self._release(priority)
+
+    def generate_stream(self, model, prompt, image_base64=None, temperature=0.7, max_tokens=512,
+                        system_prompt="", timeout=GENERATE_TIMEOUT, use_cache=False, priority='chat'):
+        """Start a streaming generation; iterate the returned OllamaStream for text chunks"""
+        payload = self.build_payload(model, prompt, image_base64, temperature, max_tokens,
+                                     system_prompt, stream=True)
+        return OllamaStream(self, model, payload, timeout, use_cache=use_cache, priority=priority)
+
+    def embed(self, model, texts, timeout=GENERATE_TIMEOUT):
+        """Return one embedding (list of floats) per text from /api/embed; raises on failure"""
+        if self.health is not None and not self.health.allow_request():
+            raise RuntimeError(self._circuit_open_result()["error"])
+        response = self._request('POST', '/api/embed', json={"model": model, "input": list(texts)},
+                                 timeout=timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text}")
+        return response.json()["embeddings"]
+
+    def _record_ttft(self, ttft):
+        with self._lock:
+            self._streams += 1
+            self._ttft_total += ttft
+            self._last_ttft = ttft
+
+    def _record_prompt_tokens(self, prompt_tokens):
+        with self._lock:
+            self._last_prompt_tokens = prompt_tokens
+
+    def stats(self):
+        """Connection reuse counters for this host"""
+        opened = 0
+        pool_requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                pool_requests += pool.num_requests
+        admission = self.admission.stats() if self.admission is not None else None
+        with self._lock:
+            return {
+                'requests': self._requests,
+                'errors': self._errors,
+                'connections_opened': opened,
+                'connections_reused': max(pool_requests - opened, 0),
+                'pool_size': self.pool_size,
+                'last_ttft': self._last_ttft,
+                'avg_ttft': self._ttft_total / self._streams if self._streams else None,
+                'last_prompt_tokens': self._last_prompt_tokens,
+                'admission': admission,
+            }
+
+    def close(self):
+        self.session.close()
+
+
+class OllamaStream:
+    """Iterable over the text chunks of a streaming /api/generate call.
+
+    After iteration finishes, ``success``, ``text`` (the full response) or
+    ``error`` are set, along with ``ttft`` (time to first token) and
+    ``response_time`` in seconds. Errors never raise out of the iterator, so the
+    stream can be handed straight to ``st.write_stream``. With ``use_cache`` a
+    cached response is yielded at once and ``cached`` is set. The admission slot
+    is taken when iteration starts and ``queue_wait`` records how long that took.
+    """
+
+    def __init__(self, client, model, payload, timeout, use_cache=False, priority='chat'):
+        self.client = client
+        self.model = model
+        self.payload = payload
+        self.timeout = timeout
+        self.priority = priority
+        self.queue_wait = None
+        self.use_cache = use_cache and client.cache is not None
+        self.cached = False
+        self.success = False
+        self.text = ""
+        self.error = None
+        self.ttft = None
+        self.response_time = None
+        self.prompt_tokens = estimate_tokens(payload["prompt"])
+
+    def __iter__(self):
+        chunks = []
+        start_time = time.time()
+
+        cache_key = None
+        if self.use_cache:
+            # The cache key ignores the "stream" flag, so streamed and blocking calls share entries
+            cache_key = make_cache_key(self.payload)
+            cached_text = self.client.cache.get(cache_key)
+            if cached_text is not None:
+                self.cached = True
+                self.success = True
+                self.text = cached_text
+                self.ttft = self.response_time = time.time() - start_time
+                yield cached_text
+                return
+
+        health = self.client.health
+        if health is not None and not health.allow_request(self.priority):
+            self.error = self.client._circuit_open_result()["error"]
+            self.response_time = 0.0
+            return
+
+        self.queue_wait, rejected = self.client._admit(self.priority)
+        if rejected:
+            self.error = rejected
+            self.response_time = time.time() - start_time
+            return
+        try:
+            with self.client._request('POST', '/api/generate', json=self.payload,
+                                      timeout=self.timeout, stream=True) as response:
+                if response.status_code != 200:
+                    self.error = f"HTTP {response.status_code}: {response.text}"
+                    return
+
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if "error" in chunk:
+                        self.error = chunk["error"]
+                        return
+                    token = chunk.get("response", "")
+                    if token:
+                        if self.ttft is None:
+                            self.ttft = time.time() - start_time
+                            self.client._record_ttft(self.ttft)
+                        chunks.append(token)
+                        yield token
+                    if chunk.get("done"):
+                        self.prompt_tokens = chunk.get("prompt_eval_count", self.prompt_tokens)
+                        self.client._record_prompt_tokens(self.prompt_tokens)
+                        break
+
+            self.success = True
+            if cache_key is not None:
+                self.client.cache.put(cache_key, self.model, "".join(chunks))
+        except Exception as e:
+            self.error = f"Error: {str(e)}"
+        finally:
+            self.client._release(self.priority)
+            self.text = "".join(chunks)
+            self.response_time = time.time() - start_time
+
+    def result(self):
+        """Result dict in the same shape as OllamaClient.generate"""
+        if self.success:
+            return {
+                "success": True,
+                "text": self.text,
+                "response_time": self.response_time,
+                "ttft": self.ttft,
+                "prompt_tokens": self.prompt_tokens,
+                "queue_wait": self.queue_wait,
+                "model": self.model,
+                "cached": self.cached
+            }
+        return {"success": False, "error": self.error or "Stream not consumed"}
+
+
+class OllamaHealthMonitor:
+    """Background health probe for an Ollama host with a TTL cache and circuit breaker.
+
+    A daemon thread calls /api/tags every ``ttl`` seconds while the host is
+    healthy. After ``failure_threshold`` consecutive failures (probes or real
+    requests) the circuit opens: generations fail fast and probes back off
+    exponentially up to ``max_backoff`` seconds. Once the backoff expires the
+    circuit is half-open and lets one trial request through; the first
+    successful probe or request closes it again. Emergency generations are
+    never refused, and a refused request asks for an early probe. Readers never
+    block on the network.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, client, ttl=HEALTH_TTL, failure_threshold=HEALTH_FAILURE_THRESHOLD,
+                 max_backoff=HEALTH_MAX_BACKOFF, probe_timeout=HEALTH_TIMEOUT):
+        self.client = client
+        self.ttl = ttl
+        self.failure_threshold = failure_threshold
+        self.max_backoff = max_backoff
+        self.probe_timeout = probe_timeout
+
+        self._lock = threading.Lock()
+        self._available = None  # Unknown until the first probe finishes
+        self._last_checked = None
+        self._consecutive_failures = 0
+        self._state = self.CLOSED
+        self._retry_at = None  # When an open circuit lets a trial request through (monotonic)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # Separate from the client's pool, which generations may keep busy for minutes
+        self.session = requests.Session()
+
+        client.health = self
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name=f"ollama-health-{self.client.host}", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def refresh(self):
+        """Ask the background thread to probe now"""
+        self._wake.set()
+
+    def _backoff(self):
+        extra_failures = self._consecutive_failures - self.failure_threshold
+        return min(self.ttl * (2 ** max(extra_failures, 0)), self.max_backoff)
+
+    def _next_interval(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                return self._backoff()
+            return self.ttl
+
+    def _probe(self):
+        try:
+            response = self.session.get(f"{self.client.host}/api/tags", timeout=self.probe_timeout)
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._probe():
+                self.record_success()
+            else:
+                self.record_failure()
+            with self._lock:
+                self._last_checked = time.time()
+            self._wake.wait(self._next_interval())
+            self._wake.clear()
+
+    def record_success(self):
+        with self._lock:
+            self._available = True
+            self._consecutive_failures = 0
+            self._state = self.CLOSED
+            self._retry_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._available = False
+            self._consecutive_failures += 1
+            # A failed trial (half-open) reopens the circuit with a longer backoff
+            if self._consecutive_failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._retry_at = time.monotonic() + self._backoff()
+
+    def allow_request(self, priority=None):
+        """False while the circuit is open (generations should fail fast); emergencies always pass"""
+        with self._lock:
+            if self._state == self.CLOSED or priority == 'emergency':
+                return True
+            if self._state == self.OPEN and time.monotonic() >= self._retry_at:
+                # Half-open: this request is the trial, the others keep failing fast until it ends
+                self._state = self.HALF_OPEN
+                return True
+            probe_due = self._last_checked is None or time.time() - self._last_checked >= HEALTH_REFRESH_INTERVAL
+        if probe_due:
+            self.refresh()
+        return False
+
+    def is_available(self):
+        """Last known availability; False while the first probe is still running"""
+        with self._lock:
+            return bool(self._available)
+
+    def status(self):
+        with self._lock:
+            return {
+                'available': self._available,
+                'state': self._state,
+                'consecutive_failures': self._consecutive_failures,
+                'last_checked': self._last_checked,
+            }
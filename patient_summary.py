@@ -0,0 +1,217 @@
+"""Incremental AI patient summaries for the PDF/JSON reports.
+
+Instead of re-reading the whole history and re-summarizing it on every
+"Generar Reporte" click, a rolling summary is kept per user and report scope in
+``data/resumen_ia_<user_id>.txt``. Each stored summary records the history
+high-water mark (number of consultations covered and id of the last one):
+
+- same high-water mark: the stored summary is returned without calling the LLM;
+- history grew by appending: only the new consultations are folded into the
+  previous summary;
+- anything else (history cleared, period window moved): full rebuild.
+"""
+import json
+import os
+from datetime import datetime
+
+from prompt_budget import history_block
+
+DATA_DIR = 'data'
+
+# Token budget for the consultations included in a single prompt (older ones
+# are only counted; chat transcripts are never sent, see prompt_budget.py)
+HISTORY_TOKENS = 1500
+MAX_ENTRIES_PER_PROMPT = 10
+
+SYSTEM_PROMPT = """Eres un médico especialista experimentado que revisa historiales médicos para generar resúmenes clínicos precisos y útiles. Tu análisis debe ser profesional, basado en evidencia, y proporcionar insights valiosos tanto para el paciente como para otros profesionales de la salud."""
+
+SUMMARY_SECTIONS = """Por favor, proporciona un resumen médico profesional que incluya:
+        1. ESTADO DE SALUD ACTUAL: Evaluación general basada en las consultas recientes
+        2. PATRONES IDENTIFICADOS: Síntomas recurrentes, tendencias preocupantes o mejoras
+        3. FACTORES DE RIESGO: Elementos que requieren atención o monitoreo
+        4. RECOMENDACIONES PRIORITARIAS: Acciones inmediatas y seguimiento sugerido
+        5. OBSERVACIONES CLÍNICAS: Notas importantes para el médico tratante
+
+        Mantén un tono profesional y médico, pero accesible para el paciente."""
+
+
+def history_high_water(medical_history):
+    """(number of consultations, id of the last one) identifying a history version"""
+    if not medical_history:
+        return [0, None]
+    return [len(medical_history), medical_history[-1].get('id')]
+
+
+def count_consultation_types(medical_history, counts=None):
+    counts = dict(counts or {})
+    for entry in medical_history:
+        entry_type = entry.get('type', 'general')
+        counts[entry_type] = counts.get(entry_type, 0) + 1
+    return counts
+
+
+def _entries_block(entries):
+    return history_block(entries, max_tokens=HISTORY_TOKENS, max_entries=MAX_ENTRIES_PER_PROMPT)
+
+
+def _patient_block(user_profile):
+    return f"""DATOS DEL PACIENTE:
+        - Nombre: {user_profile.get('name', 'No especificado')}
+        - Edad: {user_profile.get('age', 'No especificado')} años
+        - Ubicación: {user_profile.get('location', 'No especificado')}
+        - Condiciones crónicas: {', '.join(user_profile.get('chronic_conditions', [])) or 'Ninguna reportada'}
+        - Alergias: {', '.join(user_profile.get('allergies', [])) or 'Ninguna reportada'}
+        - Medicamentos actuales: {', '.join(user_profile.get('current_medications', [])) or 'Ninguno reportado'}"""
+
+
+def build_full_prompt(user_profile, medical_history, consultation_types):
+    return f"""
+        Como médico especialista, analiza el siguiente perfil completo del paciente y genera un resumen profesional de su estado de salud actual:
+
+        {_patient_block(user_profile)}
+
+        ESTADÍSTICAS DE CONSULTAS:
+        - Total de consultas: {len(medical_history)}
+        - Tipos de consultas: {json.dumps(consultation_types, ensure_ascii=False)}
+
+        HISTORIAL MÉDICO RECIENTE:
+        {_entries_block(medical_history)}
+
+        {SUMMARY_SECTIONS}
+        """
+
+
+def build_update_prompt(user_profile, previous_summary, new_entries, total, consultation_types):
+    return f"""
+        Como médico especialista, actualiza el resumen médico existente del paciente incorporando las nuevas consultas registradas desde el último resumen:
+
+        {_patient_block(user_profile)}
+
+        ESTADÍSTICAS DE CONSULTAS:
+        - Total de consultas: {total}
+        - Tipos de consultas: {json.dumps(consultation_types, ensure_ascii=False)}
+
+        RESUMEN MÉDICO ANTERIOR:
+        {previous_summary}
+
+        NUEVAS CONSULTAS ({len(new_entries)}):
+        {_entries_block(new_entries)}
+
+        Conserva la información del resumen anterior que siga vigente y actualiza lo que haya cambiado.
+        {SUMMARY_SECTIONS}
+        """
+
+
+def _state_path(user_id, data_dir):
+    return os.path.join(data_dir, f'resumen_ia_{user_id}.txt')
+
+
+def load_summary_state(user_id, data_dir=DATA_DIR):
+    path = _state_path(user_id, data_dir)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_summary_state(user_id, state, data_dir=DATA_DIR):
+    os.makedirs(data_dir, exist_ok=True)
+    path = _state_path(user_id, data_dir)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def delete_summary_state(user_id, data_dir=DATA_DIR):
+    """Remove the stored summaries of a user (their history was cleared)"""
+    path = _state_path(user_id, data_dir)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _is_prefix(previous, medical_history):
+    """True if the stored summary covered a prefix of `medical_history`"""
+    covered, last_id = previous.get('high_water', [0, None])
+    if covered == 0 or covered > len(medical_history):
+        return False
+    return (medical_history[covered - 1].get('id') == last_id
+            and medical_history[0].get('id') == previous.get('first_id'))
+
+
+def summarize_patient(client, model_name, user_profile, medical_history, scope='all', data_dir=DATA_DIR,
+                      consultation_types=None, priority='batch'):
+    """Return {"success", "summary", "stats", "incremental", "cached"} for the given history.
+
+    `scope` identifies the report selection (period and filters) the history
+    came from, so each selection keeps its own rolling summary.
+    `consultation_types` can pass precomputed counts by type (history_stats.py)
+    to avoid counting the history again. `priority` is the admission class
+    of the generation.
+    """
+    try:
+        user_id = user_profile.get('user_id', 'anonimo')
+        state = load_summary_state(user_id, data_dir)
+        previous = state.get(scope)
+        high_water = history_high_water(medical_history)
+
+        if previous and previous.get('high_water') == high_water and previous.get('model') == model_name:
+            return {
+                "success": True,
+                "summary": previous['summary'],
+                "stats": previous['stats'],
+                "incremental": False,
+                "cached": True
+            }
+
+        incremental = bool(previous) and previous.get('model') == model_name and _is_prefix(previous, medical_history)
+        if incremental:
+            new_entries = medical_history[previous['high_water'][0]:]
+            if consultation_types is None:
+                consultation_types = count_consultation_types(new_entries, previous['stats'])
+            analysis_prompt = build_update_prompt(
+                user_profile, previous['summary'], new_entries, len(medical_history), consultation_types
+            )
+        else:
+            if consultation_types is None:
+                consultation_types = count_consultation_types(medical_history)
+            analysis_prompt = build_full_prompt(user_profile, medical_history, consultation_types)
+
+        result = client.generate(
+            model_name, analysis_prompt,
+            temperature=0.2, max_tokens=1000,
+            system_prompt=SYSTEM_PROMPT, use_cache=True, priority=priority
+        )
+
+        if not result["success"]:
+            return {
+                "success": False,
+                "error": result.get("error", "Error generating summary")
+            }
+
+        state[scope] = {
+            'high_water': high_water,
+            'first_id': medical_history[0].get('id') if medical_history else None,
+            'model': model_name,
+            'summary': result["text"],
+            'stats': consultation_types,
+            'updated_at': datetime.now().isoformat()
+        }
+        save_summary_state(user_id, state, data_dir)
+
+        return {
+            "success": True,
+            "summary": result["text"],
+            "stats": consultation_types,
+            "incremental": incremental,
+            "cached": False
+        }
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Error in AI analysis: {str(e)}"
+        }
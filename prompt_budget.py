@@ -0,0 +1,110 @@
+"""Token budgeting for the context sent to the model.
+
+Profiles and history entries are compacted and selected by priority so the
+prompt stays under a fixed token budget no matter how long the history grows:
+
+1. Nested ``chat_history`` transcripts are never sent.
+2. History is filled newest first; each entry gets the most detailed rendering
+   that still fits (long user inputs and AI responses are truncated first,
+   then reduced to metadata, then dropped).
+
+The budget for the health-assistant context is set with the
+``PROMPT_TOKEN_BUDGET`` environment variable (default 1500 tokens).
+"""
+import json
+import os
+
+# Rough average for Spanish text with the Gemma tokenizer
+CHARS_PER_TOKEN = 4
+
+DEFAULT_CONTEXT_BUDGET = 1500
+
+# Text limits tried for each history entry, from most to least detailed.
+# None keeps only type, date and urgency level.
+HISTORY_DETAIL_LEVELS = (400, 150, None)
+
+PROFILE_FIELDS = ('name', 'age', 'location', 'chronic_conditions', 'allergies', 'current_medications')
+
+
+def context_budget_from_env():
+    return int(os.environ.get('PROMPT_TOKEN_BUDGET', DEFAULT_CONTEXT_BUDGET))
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (characters / CHARS_PER_TOKEN)"""
+    if not text:
+        return 0
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class TokenBudget:
+    """Greedy allocator: each fragment takes the most detailed variant that fits"""
+
+    def __init__(self, max_tokens):
+        self.max_tokens = max_tokens
+        self.used = 0
+        self.dropped = 0
+
+    @property
+    def remaining(self):
+        return max(self.max_tokens - self.used, 0)
+
+    def fit(self, variants):
+        """Return the first variant that fits the remaining budget, or None"""
+        for variant in variants:
+            tokens = estimate_tokens(variant)
+            if tokens <= self.remaining:
+                self.used += tokens
+                return variant
+        self.dropped += 1
+        return None
+
+
+def _truncate(text, limit):
+    text = text or ''
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def compact_profile(user_profile):
+    """Profile fields that matter clinically (no ids, phone numbers or timestamps)"""
+    return {field: user_profile[field] for field in PROFILE_FIELDS if user_profile.get(field)}
+
+
+def compact_history_entry(entry, text_limit=HISTORY_DETAIL_LEVELS[0]):
+    """Consultation without the chat transcript, with texts cut to `text_limit`"""
+    compact = {
+        'timestamp': (entry.get('timestamp') or '')[:16],
+        'type': entry.get('type', 'general'),
+    }
+    if entry.get('assessment_level'):
+        compact['assessment_level'] = entry['assessment_level']
+    if text_limit is not None:
+        compact['user_input'] = _truncate(entry.get('user_input'), text_limit)
+        compact['ai_response'] = _truncate(entry.get('ai_response'), text_limit)
+    return compact
+
+
+def fit_history(medical_history, budget, max_entries=10, detail_levels=HISTORY_DETAIL_LEVELS):
+    """Compact entries (chronological order) selected newest first under `budget`"""
+    selected = []
+    for entry in reversed(medical_history[-max_entries:]):
+        variants = [json.dumps(compact_history_entry(entry, level), ensure_ascii=False)
+                    for level in detail_levels]
+        chosen = budget.fit(variants)
+        if chosen is None:
+            # Older entries would not fit either once the smallest variant fails
+            break
+        selected.append(chosen)
+    selected.reverse()
+    return selected
+
+
+def history_block(medical_history, max_tokens, max_entries=10):
+    """JSON list of the newest history entries that fit in `max_tokens`"""
+    budget = TokenBudget(max_tokens)
+    entries = fit_history(medical_history, budget, max_entries)
+    omitted = len(medical_history) - len(entries)
+    block = '[' + ', '.join(entries) + ']'
+    if omitted:
+        block = f"({omitted} consultas anteriores omitidas) {block}"
+    return block
@@ -0,0 +1,62 @@
+"""Prompts that carry patient context, built from plain data.
+
+The Streamlit app builds them from the session, and the background job
+handlers (llm_jobs.py) from the storage backend. Job payloads therefore
+hold a user_id instead of a copy of the patient's profile and history.
+"""
+import json
+
+from prompt_budget import TokenBudget, compact_profile, context_budget_from_env, fit_history, history_block
+from remedy_retrieval import format_entry
+
+# History tokens sent with a trend analysis request
+TREND_HISTORY_TOKENS = 1200
+
+
+def health_assistant_prompt(user_profile, medical_history, herbal_db, generic_db, relevant_remedies=()):
+    """System prompt of the health assistant; `relevant_remedies` are (database, entry) pairs described in full"""
+    # Fill the context by priority under the token budget: profile, remedies
+    # relevant to the query, available remedies, then as much recent history
+    # as fits (see prompt_budget.py)
+    budget = TokenBudget(context_budget_from_env())
+    profile_context = budget.fit([json.dumps(compact_profile(user_profile), ensure_ascii=False)]) or "{}"
+    remedies = [budget.fit([format_entry(database, data)]) for database, data in relevant_remedies]
+    remedies_context = "\n  ".join(remedy for remedy in remedies if remedy)
+    herbal_context = budget.fit([json.dumps(list(herbal_db.keys()), ensure_ascii=False)]) or "[]"
+    generic_context = budget.fit([json.dumps(list(generic_db.keys()), ensure_ascii=False)]) or "[]"
+    history_context = "[" + ", ".join(fit_history(medical_history, budget, max_entries=5)) + "]"
+
+    return f"""Eres un asistente de salud especializado para comunidades rurales de Sudamérica con acceso limitado a servicios médicos.
+
+## Contexto del Usuario:
+- Información personal: {profile_context}
+- Historial médico: {history_context}
+- Plantas medicinales disponibles: {herbal_context}
+- Medicamentos genéricos disponibles: {generic_context}
+- Remedios relevantes para esta consulta: {remedies_context or "Ninguno identificado"}
+
+## Tu Rol Principal:
+EVALUAR el estado de salud considerando el perfil completo del usuario
+PROPORCIONAR orientación médica básica adaptada al contexto rural
+RECOMENDAR tratamientos accesibles priorizando plantas medicinales locales
+IDENTIFICAR niveles de urgencia médica
+DOCUMENTAR cada consulta para seguimiento
+
+## Principios:
+- Usa español simple y claro
+- Sé empático y culturalmente sensible
+- Considera limitaciones de recursos
+- NUNCA diagnostiques sin confirmación médica
+- Prioriza la seguridad del paciente"""
+
+
+def trend_analysis_prompt(consultations, checkin_features):
+    """Trend analysis request over the consultations (check-ins excluded) and the check-in features"""
+    return f"""Analiza las siguientes consultas médicas de los últimos registros:
+{history_block(consultations, max_tokens=TREND_HISTORY_TOKENS)}
+
+Tendencias de los check-ins diarios (calculadas localmente):
+{checkin_features}
+
+Identifica patrones, tendencias preocupantes y mejoras en la salud del usuario.
+"""
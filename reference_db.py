@@ -0,0 +1,220 @@
+"""Process-wide, read-mostly cache of the reference databases.
+
+The plant (``plantas_medicinales.txt``) and generic medicine
+(``medicamentos_genericos.txt``) databases used to be parsed into every
+session's ``st.session_state``, so memory grew with the number of open
+sessions and a plant added in one session was invisible to the others. They
+are now held once per process (the app keeps one ``ReferenceData`` in
+``st.cache_resource``):
+
+- readers get immutable snapshots (``MappingProxyType``) and never copy them;
+- the files' mtime and size are checked at most every ``CHECK_INTERVAL``
+  seconds, so edits made on disk (or by another process) are picked up;
+- adding an entry is copy-on-write: a new dict is written atomically to the
+  file and then published as the new snapshot, while readers keep using the
+  one they already hold;
+- ``ReferenceData.snapshot()`` also carries the search index
+  (herbal_search.py), built once per version of the files on disk; adding a
+  plant copies the previous index and indexes only that plant. The snapshot's
+  version tuple tells derived indexes (remedy_retrieval.py) when to resync.
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from herbal_search import build_index
+
+DATA_DIR = 'data'
+HERBAL_FILENAME = 'plantas_medicinales.txt'
+GENERIC_FILENAME = 'medicamentos_genericos.txt'
+# Seconds between file modification checks
+CHECK_INTERVAL = 1.0
+
+DEFAULT_HERBS = {
+    'manzanilla': {
+        'name': 'Manzanilla (Chamomile)',
+        'scientific_name': 'Matricaria chamomilla',
+        'uses': ['Digestive problems', 'Anxiety', 'Sleep disorders', 'Skin irritation'],
+        'preparation': 'Tea: 1 tsp dried flowers per cup of hot water, steep 5-10 minutes',
+        'contraindications': ['Pregnancy (large amounts)', 'Allergy to asteraceae family'],
+        'region': 'Available throughout South America'
+    },
+    'eucalipto': {
+        'name': 'Eucalipto (Eucalyptus)',
+        'scientific_name': 'Eucalyptus globulus',
+        'uses': ['Respiratory problems', 'Cough', 'Congestion', 'Wound healing'],
+        'preparation': 'Inhalation: 5-10 drops oil in hot water. Tea: 2-3 leaves per cup',
+        'contraindications': ['Not for children under 2', 'Not for internal use in pregnancy'],
+        'region': 'Common in Andean regions'
+    },
+    'hierba_buena': {
+        'name': 'Hierbabuena (Spearmint)',
+        'scientific_name': 'Mentha spicata',
+        'uses': ['Digestive issues', 'Nausea', 'Headaches', 'Common cold'],
+        'preparation': 'Tea: 1 tbsp fresh leaves or 1 tsp dried per cup, steep 5 minutes',
+        'contraindications': ['GERD (may worsen symptoms)', 'Hiatal hernia'],
+        'region': 'Grows well in most South American climates'
+    },
+    'aloe_vera': {
+        'name': 'Sábila (Aloe Vera)',
+        'scientific_name': 'Aloe barbadensis',
+        'uses': ['Burns', 'Skin wounds', 'Constipation', 'Digestive inflammation'],
+        'preparation': 'Topical: Apply gel directly. Internal: 1-2 tbsp gel (pure) in water',
+        'contraindications': ['Pregnancy', 'Breastfeeding', 'Intestinal obstruction'],
+        'region': 'Thrives in dry climates across South America'
+    },
+    'cola_de_caballo': {
+        'name': 'Cola de Caballo (Horsetail)',
+        'scientific_name': 'Equisetum arvense',
+        'uses': ['Kidney problems', 'Urinary tract infections', 'Wound healing', 'Bone health'],
+        'preparation': 'Tea: 2-3 tsp dried herb per cup, boil 5 minutes, steep 10 minutes',
+        'contraindications': ['Pregnancy', 'Heart/kidney disease', 'Low potassium'],
+        'region': 'Found in moist areas throughout South America'
+    }
+}
+
+DEFAULT_GENERICS = {
+    'paracetamol': {
+        'name': 'Paracetamol (Acetaminofén)',
+        'uses': ['Fever', 'Mild to moderate pain', 'Headache'],
+        'dosage': 'Adults: 500-1000mg every 4-6 hours (max 4g/day)',
+        'contraindications': ['Severe liver disease', 'Alcohol abuse'],
+        'side_effects': ['Rare: liver damage with overdose'],
+        'availability': 'Widely available'
+    },
+    'ibuprofeno': {
+        'name': 'Ibuprofeno',
+        'uses': ['Pain', 'Inflammation', 'Fever'],
+        'dosage': 'Adults: 200-400mg every 4-6 hours (max 1200mg/day)',
+        'contraindications': ['Stomach ulcers', 'Kidney disease', 'Heart disease'],
+        'side_effects': ['Stomach irritation', 'Nausea', 'Dizziness'],
+        'availability': 'Common in pharmacies'
+    },
+    'omeprazol': {
+        'name': 'Omeprazol',
+        'uses': ['Stomach acid reduction', 'Gastritis', 'GERD'],
+        'dosage': 'Adults: 20mg once daily before meals',
+        'contraindications': ['Known allergy to proton pump inhibitors'],
+        'side_effects': ['Headache', 'Nausea', 'Diarrhea'],
+        'availability': 'Prescription or OTC'
+    }
+}
+
+
+ReferenceSnapshot = namedtuple('ReferenceSnapshot', ['herbal', 'generic', 'version', 'search_index'])
+
+
+class ReferenceDatabase:
+    """One JSON reference file, parsed once and reloaded when it changes on disk"""
+
+    def __init__(self, path, defaults):
+        self.path = path
+        self.defaults = defaults
+        self.last_error = None
+        self._write_lock = threading.Lock()
+        self._checked_at = 0.0
+        # (read-only mapping, file version); replaced as a whole, never mutated
+        self._state = None
+
+    def _file_version(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _write(self, data):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+    def _load(self):
+        try:
+            if self._file_version() is None:
+                # Create default file
+                self._write(self.defaults)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.last_error = None
+        except Exception as e:
+            self.last_error = e
+            # Keep serving the last good version (or the defaults)
+            if self._state is not None:
+                return self._state[0], self._file_version()
+            data = self.defaults
+        return MappingProxyType(data), self._file_version()
+
+    def state(self):
+        """(read-only mapping, version) of the current contents"""
+        state = self._state
+        now = time.monotonic()
+        if state is not None and now - self._checked_at < CHECK_INTERVAL:
+            return state
+        self._checked_at = now
+        if state is None or self._file_version() != state[1]:
+            with self._write_lock:
+                state = self._state
+                if state is None or self._file_version() != state[1]:
+                    state = self._state = self._load()
+        return state
+
+    def add(self, key, entry):
+        """Add or replace one entry (copy-on-write); returns (state it was added to, new state)"""
+        with self._write_lock:
+            current = self._state
+            if current is None or self._file_version() != current[1]:
+                current = self._load()
+            data = dict(current[0])
+            data[key] = entry
+            self._write(data)
+            self._state = (MappingProxyType(data), self._file_version())
+            return current, self._state
+
+
+class ReferenceData:
+    """Plants and generic medicines shared by all sessions, with their search index"""
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.herbal = ReferenceDatabase(os.path.join(data_dir, HERBAL_FILENAME), DEFAULT_HERBS)
+        self.generic = ReferenceDatabase(os.path.join(data_dir, GENERIC_FILENAME), DEFAULT_GENERICS)
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def snapshot(self):
+        """Consistent view of both databases; the search index is rebuilt only when a file changed"""
+        herbal, herbal_version = self.herbal.state()
+        generic, generic_version = self.generic.state()
+        version = (herbal_version, generic_version)
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != version:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot.version != version:
+                    snapshot = self._snapshot = ReferenceSnapshot(
+                        herbal, generic, version, build_index(herbal, generic)
+                    )
+        return snapshot
+
+    def add_plant(self, key, entry):
+        """Save a plant and publish a snapshot whose index differs from the previous one by that plant"""
+        with self._lock:
+            previous = self._snapshot
+            base, (herbal, herbal_version) = self.herbal.add(key, entry)
+            generic, generic_version = self.generic.state()
+            if previous is None or previous.version != (base[1], generic_version):
+                # The files changed on disk since the last snapshot
+                search_index = build_index(herbal, generic)
+            else:
+                search_index = previous.search_index.copy()
+                search_index.add_document('herbal', key, entry)
+            self._snapshot = ReferenceSnapshot(herbal, generic, (herbal_version, generic_version), search_index)
+            return self._snapshot
+
+    @property
+    def errors(self):
+        return [db.last_error for db in (self.herbal, self.generic) if db.last_error is not None]
@@ -0,0 +1,210 @@
+"""Retrieval of the plants and generic medicines relevant to a consultation.
+
+The health-assistant prompt used to list only the keys of both databases, so
+the model never saw uses or contraindications. Sending the full databases
+would blow up prefill, so every entry is embedded once into a flat vector
+index and only the top-k entries closest to the user's message are injected
+into the prompt.
+
+Embeddings come from Ollama's ``/api/embed`` when ``OLLAMA_EMBED_MODEL`` is set
+(e.g. ``nomic-embed-text``); otherwise a local hashing embedder is used (accent-
+folded words expanded with the Spanish/English synonyms of herbal_search.py,
+plus character trigrams), which needs no extra model and works offline.
+
+The index is stored in ``data/indice_remedios.npz`` with a content hash per
+entry: on startup, or when a plant is added, only new or changed entries are
+embedded again. Changing the embedder rebuilds the whole index.
+"""
+import hashlib
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+
+from herbal_search import SYNONYMS, fold, tokenize, _trigrams
+
+DATA_DIR = 'data'
+INDEX_FILE = 'indice_remedios.npz'
+HASHING_DIMENSIONS = 512
+TRIGRAM_WEIGHT = 0.3
+DEFAULT_TOP_K = 4
+# Entries less similar than this are not worth the prompt tokens
+MIN_SIMILARITY = 0.15
+
+
+def embed_model_from_env():
+    return os.environ.get('OLLAMA_EMBED_MODEL') or None
+
+
+def entry_text(database, data):
+    """Text that is embedded for an entry (name, uses and cautions)"""
+    parts = [data.get('name', ''), data.get('scientific_name', '')]
+    parts.extend(data.get('uses', []))
+    parts.extend(data.get('contraindications', []))
+    return '. '.join(part for part in parts if part)
+
+
+def format_entry(database, data):
+    """Compact description of an entry for the prompt"""
+    summary = {
+        'nombre': data.get('name'),
+        'usos': data.get('uses', []),
+        'contraindicaciones': data.get('contraindications', []),
+    }
+    if database == 'herbal':
+        summary['preparacion'] = data.get('preparation')
+    else:
+        summary['dosis'] = data.get('dosage')
+    return json.dumps({key: value for key, value in summary.items() if value}, ensure_ascii=False)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+class HashingEmbedder:
+    """Offline embedder: hashed bag of (synonym-expanded) words and character trigrams"""
+
+    def __init__(self, dimensions=HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f'hashing-{dimensions}'
+
+    def _bucket(self, feature):
+        # zlib.crc32 is stable across processes, unlike hash()
+        return zlib.crc32(feature.encode('utf-8')) % self.dimensions
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                vectors[row, self._bucket(f'w:{token}')] += 1.0
+                for synonym in SYNONYMS.get(token, ()):
+                    vectors[row, self._bucket(f'w:{synonym}')] += 0.8
+                for trigram in _trigrams(token):
+                    vectors[row, self._bucket(f't:{trigram}')] += TRIGRAM_WEIGHT
+        return _normalize(vectors)
+
+
+class OllamaEmbedder:
+    """Embeddings from an Ollama embedding model through a pooled OllamaClient"""
+
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+        self.name = f'ollama:{model}'
+
+    def embed(self, texts):
+        return _normalize(np.asarray(self.client.embed(self.model, texts), dtype=np.float32))
+
+
+class RemedyIndex:
+    """Flat (brute-force cosine) vector index over the herbal and generic databases"""
+
+    def __init__(self, embedder, data_dir=DATA_DIR):
+        self.embedder = embedder
+        self.path = os.path.join(data_dir, INDEX_FILE)
+        self._lock = threading.Lock()
+        self._ids = []
+        self._hashes = []
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._entries = {}
+        # Version of the reference databases last synced (see reference_db.py)
+        self._synced_version = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as stored:
+                if str(stored['embedder']) != self.embedder.name:
+                    return
+                self._ids = [tuple(doc_id.split('/', 1)) for doc_id in stored['ids'].tolist()]
+                self._hashes = stored['hashes'].tolist()
+                self._vectors = stored['vectors']
+        except (OSError, KeyError, ValueError):
+            self._ids, self._hashes = [], []
+            self._vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = f'{self.path}.tmp.npz'
+        np.savez(
+            temp_path,
+            embedder=np.array(self.embedder.name),
+            ids=np.array([f'{database}/{key}' for database, key in self._ids]),
+            hashes=np.array(self._hashes),
+            vectors=self._vectors,
+        )
+        os.replace(temp_path, self.path)
+
+    def sync(self, databases, version=None):
+        """Bring the index up to date with {database: entries}; returns the number of entries embedded
+
+        With a `version`, syncing the same version again is a no-op.
+        """
+        if version is not None and version == self._synced_version:
+            return 0
+        current = {}
+        for database, entries in databases.items():
+            for key, data in entries.items():
+                text = entry_text(database, data)
+                current[(database, key)] = (hashlib.sha256(text.encode('utf-8')).hexdigest(), text)
+
+        with self._lock:
+            self._entries = {(database, key): data
+                             for database, entries in databases.items() for key, data in entries.items()}
+            stored = {doc_id: row for row, doc_id in enumerate(self._ids)}
+            keep_ids, keep_rows, stale = [], [], []
+            for doc_id, (content_hash, text) in current.items():
+                row = stored.get(doc_id)
+                if row is not None and self._hashes[row] == content_hash:
+                    keep_ids.append(doc_id)
+                    keep_rows.append(row)
+                else:
+                    stale.append(doc_id)
+
+            if not stale and len(keep_ids) == len(self._ids):
+                self._synced_version = version
+                return 0
+
+            vectors = [self._vectors[keep_rows]] if keep_rows else []
+            if stale:
+                vectors.append(self.embedder.embed([current[doc_id][1] for doc_id in stale]))
+            self._ids = keep_ids + stale
+            self._hashes = [current[doc_id][0] for doc_id in self._ids]
+            self._vectors = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+            self._save()
+            self._synced_version = version
+            return len(stale)
+
+    def search(self, query, k=DEFAULT_TOP_K, min_similarity=MIN_SIMILARITY):
+        """[(database, key, data, similarity)] for the k entries closest to `query`"""
+        if not query or not fold(query).strip():
+            return []
+        if not len(self):
+            return []
+        # Embedding may be a network call: keep it outside the lock
+        query_vector = self.embedder.embed([query])[0]
+        with self._lock:
+            similarities = self._vectors @ query_vector
+            top = np.argsort(-similarities)[:k]
+            return [
+                (*self._ids[row], self._entries[self._ids[row]], float(similarities[row]))
+                for row in top
+                if similarities[row] >= min_similarity and self._ids[row] in self._entries
+            ]
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def build_remedy_index(client=None, embed_model=None, data_dir=DATA_DIR):
+    """RemedyIndex using the Ollama embedding model if configured, else the hashing embedder"""
+    if client is not None and embed_model:
+        return RemedyIndex(OllamaEmbedder(client, embed_model), data_dir)
+    return RemedyIndex(HashingEmbedder(), data_dir)
@@ -0,0 +1,158 @@
+"""Persistent cache of generated reports (PDF bytes and JSON).
+
+Asking twice for the same report used to filter the history, wait for the AI
+summary and render the PDF again. Finished reports are stored in
+``data/report_cache.sqlite`` keyed by ``make_report_key``:
+
+- the user and their profile (the report prints it),
+- the report settings of Tab 5 (period, check-ins, emergencies, format, AI),
+- a content version of the history (number of consultations, id and timestamp
+  of the last one), so any new consultation produces a new key,
+- the day a relative period ("Última semana"...) starts, since the same
+  history gives a different report once the period moves,
+- the model of the AI summary.
+
+The cache is bounded by total size with least-recently-used eviction
+(``REPORT_CACHE_MAX_MB``, default 50).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from patient_summary import history_high_water
+
+DEFAULT_CACHE_PATH = os.path.join('data', 'report_cache.sqlite')
+DEFAULT_MAX_MB = 50
+
+
+def report_cache_options_from_env():
+    return {'max_bytes': int(float(os.environ.get('REPORT_CACHE_MAX_MB', DEFAULT_MAX_MB)) * 1024 * 1024)}
+
+
+def make_report_key(user_id, user_profile, medical_history, settings, cutoff=None, model=None):
+    """Hash of everything a report depends on (see the module docstring)"""
+    key_data = {
+        'user_id': user_id,
+        'profile': user_profile,
+        'history': history_high_water(medical_history),
+        'last_timestamp': medical_history[-1]['timestamp'] if medical_history else None,
+        'settings': list(settings),
+        'cutoff': cutoff.date().isoformat() if cutoff else None,
+        'model': model,
+    }
+    return hashlib.sha256(
+        json.dumps(key_data, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+
+
+class ReportCache:
+    """Size-bounded LRU cache of report artifacts backed by SQLite"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS reports (
+            key TEXT PRIMARY KEY,
+            user_id TEXT,
+            data BLOB NOT NULL,
+            file_name TEXT NOT NULL,
+            mime TEXT NOT NULL,
+            ai_summary TEXT,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_reports_last_access ON reports (last_access);
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return the cached report {data, file_name, mime, ai_summary, created_at}, or None"""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT data, file_name, mime, ai_summary, created_at FROM reports WHERE key = ?', (key,)
+        ).fetchone()
+        with self._lock:
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+
+        with conn:
+            conn.execute('UPDATE reports SET last_access = ? WHERE key = ?', (time.time(), key))
+        return {'data': bytes(row['data']), 'file_name': row['file_name'], 'mime': row['mime'],
+                'ai_summary': row['ai_summary'], 'created_at': row['created_at']}
+
+    def put(self, key, user_id, data, file_name, mime, ai_summary=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        # An artifact larger than the whole cache would only evict everything else
+        if len(data) > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO reports (key, user_id, data, file_name, mime, ai_summary, size, '
+                'created_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, user_id, sqlite3.Binary(data), file_name, mime, ai_summary, len(data), now, now)
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """Drop least recently used reports until the size limit holds"""
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM reports').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = 0
+        rows = conn.execute('SELECT key, size FROM reports ORDER BY last_access').fetchall()
+        for row in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM reports WHERE key = ?', (row['key'],))
+            total -= row['size']
+            evicted += 1
+        with self._lock:
+            self._evictions += evicted
+
+    def clear(self, user_id=None):
+        with self._connect() as conn:
+            if user_id is None:
+                conn.execute('DELETE FROM reports')
+            else:
+                conn.execute('DELETE FROM reports WHERE user_id = ?', (user_id,))
+
+    def stats(self):
+        count, total = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM reports'
+        ).fetchone()
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'entries': count,
+                'bytes': total,
+            }
@@ -0,0 +1,257 @@
+"""Patient report generation shared by the app (Tab 5) and batch_reports.py.
+
+A report covers one period of a user's history, optionally without check-ins
+or emergency assessments, and can include the AI summary from
+patient_summary.py. ``config`` carries the period label, the format and the
+precomputed consultation counts by type (history_stats.py).
+
+PDFs are rendered straight into a buffer (or an open file) with styles built
+once per process. The consultation details are fed to reportlab in chunks of
+``CONSULTATION_CHUNK`` while the document is laid out, so only one chunk of
+paragraphs is alive at a time however long the history is.
+"""
+import io
+from datetime import datetime
+from functools import lru_cache
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from history_stats import period_start
+
+# Period label -> number of calendar days (None: whole history)
+REPORT_PERIODS = {"Última semana": 7, "Último mes": 30, "Últimos 3 meses": 90, "Todo el historial": None}
+REPORT_FORMATS = ["PDF Completo", "PDF Resumido", "Datos JSON"]
+
+# Consultations turned into flowables at a time while the PDF is built
+CONSULTATION_CHUNK = 50
+# Consultations detailed in the PDF when the AI summary is included
+AI_SUMMARY_MAX_CONSULTATIONS = 5
+
+
+def report_cutoff(period, now=None):
+    """Start of a report period (midnight, see history_stats.period_start); None for the whole history"""
+    days = REPORT_PERIODS[period]
+    return period_start(days, now) if days else None
+
+
+def excluded_types(include_checkins=True, include_emergency=True):
+    return [entry_type for entry_type, included in
+            (('daily_checkin', include_checkins), ('emergency', include_emergency)) if not included]
+
+
+def report_scope(period, include_checkins=True, include_emergency=True):
+    """Key of a report selection; each selection keeps its own rolling AI summary"""
+    return f"{period}|{include_checkins}|{include_emergency}"
+
+
+def build_json_report(user_profile, medical_history, config, ai_summary=None):
+    """JSON-serializable report with the AI summary"""
+    return {
+        'patient_info': user_profile,
+        'ai_medical_summary': ai_summary,
+        'medical_history': medical_history,
+        'report_config': {
+            'period': config['period'],
+            'generated_date': datetime.now().isoformat(),
+            'total_entries': len(medical_history),
+            'ai_analysis_included': ai_summary is not None
+        }
+    }
+
+
+@lru_cache(maxsize=None)
+def report_styles():
+    """Paragraph and table styles of the PDF report, built once per process"""
+    styles = getSampleStyleSheet()
+    return {
+        'normal': styles['Normal'],
+        'body': styles['BodyText'],
+        'heading2': styles['Heading2'],
+        'heading3': styles['Heading3'],
+        'title': ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=18,
+            textColor=colors.darkblue,
+            alignment=1
+        ),
+        # Highlighted box for the AI summary
+        'ai': ParagraphStyle(
+            'AIAnalysis',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=colors.darkblue,
+            leftIndent=10,
+            rightIndent=10,
+            spaceAfter=10,
+            borderColor=colors.lightblue,
+            borderWidth=1,
+            borderPadding=10
+        ),
+        'patient_table': TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]),
+        'summary_table': TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10)
+        ]),
+    }
+
+
+class _ChunkedStory(list):
+    """Flowable list that pulls the next chunk from `chunks` whenever it runs low.
+
+    reportlab consumes the story from the front and checks its length before
+    each flowable, so the flowables of later chunks are only created when the
+    layout reaches them.
+    """
+
+    def __init__(self, head, chunks, low_water=2):
+        super().__init__(head)
+        self._chunks = iter(chunks)
+        self._low_water = low_water
+
+    def __len__(self):
+        while self._chunks is not None and super().__len__() < self._low_water:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._chunks = None
+            else:
+                self.extend(chunk)
+        return super().__len__()
+
+
+def _header_flowables(user_profile, config, ai_summary, styles):
+    story = []
+
+    # Title
+    story.append(Paragraph("REPORTE MÉDICO - ASISTENTE DE SALUD RURAL", styles['title']))
+    if ai_summary:
+        story.append(Paragraph("Incluye Análisis Médico con Inteligencia Artificial", styles['normal']))
+    story.append(Spacer(1, 20))
+
+    # Patient information
+    story.append(Paragraph("INFORMACIÓN DEL PACIENTE", styles['heading2']))
+    patient_data = [
+        ['Nombre:', user_profile.get('name', 'No especificado')],
+        ['Edad:', user_profile.get('age', 'No especificado')],
+        ['Ubicación:', user_profile.get('location', 'No especificado')],
+        ['Teléfono:', user_profile.get('phone', 'No especificado')],
+        ['Contacto de emergencia:', user_profile.get('emergency_contact', 'No especificado')],
+        ['Período del reporte:', config['period']],
+        ['Fecha de generación:', datetime.now().strftime('%d/%m/%Y %H:%M')]
+    ]
+    patient_table = Table(patient_data, colWidths=[2*inch, 4*inch])
+    patient_table.setStyle(styles['patient_table'])
+    story.append(patient_table)
+    story.append(Spacer(1, 20))
+
+    # AI medical summary
+    if ai_summary:
+        story.append(Paragraph("ANÁLISIS MÉDICO CON INTELIGENCIA ARTIFICIAL", styles['heading2']))
+        story.append(Paragraph(ai_summary.replace('\n', '<br/>'), styles['ai']))
+        story.append(Spacer(1, 20))
+
+    # Medical conditions
+    if user_profile.get('chronic_conditions') or user_profile.get('allergies'):
+        story.append(Paragraph("CONDICIONES MÉDICAS", styles['heading2']))
+
+        if user_profile.get('chronic_conditions'):
+            story.append(Paragraph(f"<b>Condiciones crónicas:</b> {', '.join(user_profile['chronic_conditions'])}", styles['normal']))
+
+        if user_profile.get('allergies'):
+            story.append(Paragraph(f"<b>Alergias:</b> {', '.join(user_profile['allergies'])}", styles['normal']))
+
+        if user_profile.get('current_medications'):
+            story.append(Paragraph(f"<b>Medicamentos actuales:</b> {', '.join(user_profile['current_medications'])}", styles['normal']))
+
+        story.append(Spacer(1, 15))
+
+    # Consultation summary (precomputed counts by type for the report selection)
+    story.append(Paragraph("RESUMEN DE CONSULTAS", styles['heading2']))
+    counts = config['counts']
+    summary_data = [
+        ['Total de consultas:', str(sum(counts.values()))],
+        ['Evaluaciones médicas:', str(counts.get('medical_evaluation', 0))],
+        ['Evaluaciones de emergencia:', str(counts.get('emergency', 0))],
+        ['Check-ins diarios:', str(counts.get('daily_checkin', 0))],
+        ['Análisis IA incluido:', 'Sí' if ai_summary else 'No']
+    ]
+    summary_table = Table(summary_data, colWidths=[3*inch, 1*inch])
+    summary_table.setStyle(styles['summary_table'])
+    story.append(summary_table)
+    story.append(Spacer(1, 15))
+
+    story.append(Paragraph("DETALLE DE CONSULTAS", styles['heading2']))
+    return story
+
+
+def _consultation_flowables(number, consultation, ai_summary, styles):
+    entry_date = datetime.fromisoformat(consultation['timestamp'])
+    flowables = [Paragraph(f"Consulta {number} - {entry_date.strftime('%d/%m/%Y %H:%M')}", styles['heading3'])]
+
+    consultation_type = consultation.get('type', 'general').replace('_', ' ').title()
+    flowables.append(Paragraph(f"<b>Tipo:</b> {consultation_type}", styles['normal']))
+
+    if consultation.get('assessment_level'):
+        flowables.append(Paragraph(f"<b>Nivel de urgencia:</b> {consultation['assessment_level']}", styles['normal']))
+
+    # Shortened version for space efficiency when the AI summary is included
+    if ai_summary and len(consultation['user_input']) > 200:
+        flowables.append(Paragraph(f"<b>Consulta:</b> {consultation['user_input'][:200]}...", styles['body']))
+        flowables.append(Paragraph(f"<b>Respuesta:</b> {consultation['ai_response'][:200]}...", styles['body']))
+    else:
+        flowables.append(Paragraph("<b>Síntomas/Consulta:</b>", styles['normal']))
+        flowables.append(Paragraph(consultation['user_input'], styles['body']))
+        flowables.append(Paragraph("<b>Evaluación y recomendaciones:</b>", styles['normal']))
+        flowables.append(Paragraph(consultation['ai_response'], styles['body']))
+
+    flowables.append(Spacer(1, 12))
+    return flowables
+
+
+def _consultation_chunks(medical_history, ai_summary, styles, chunk_size):
+    """Flowables of the consultations, newest first, `chunk_size` consultations at a time"""
+    consultations = sorted(medical_history, key=lambda x: x['timestamp'], reverse=True)
+    # With the AI summary only the most recent consultations are detailed
+    shown = min(len(consultations), AI_SUMMARY_MAX_CONSULTATIONS) if ai_summary else len(consultations)
+
+    for chunk_start in range(0, shown, chunk_size):
+        chunk = []
+        for number in range(chunk_start, min(chunk_start + chunk_size, shown)):
+            chunk.extend(_consultation_flowables(number + 1, consultations[number], ai_summary, styles))
+        yield chunk
+
+    if len(consultations) > shown:
+        yield [Paragraph(f"... y {len(consultations) - shown} consultas adicionales (ver historial completo para más detalles)", styles['normal'])]
+
+
+def render_pdf_report(user_profile, medical_history, config, ai_summary=None, output=None,
+                      chunk_size=CONSULTATION_CHUNK):
+    """Render the PDF report into `output` (a path or binary file); returns the PDF bytes when `output` is None.
+
+    `chunk_size=None` builds every consultation up front (one single story).
+    """
+    buffer = io.BytesIO() if output is None else None
+    doc = SimpleDocTemplate(buffer or output, pagesize=letter)
+    styles = report_styles()
+
+    head = _header_flowables(user_profile, config, ai_summary, styles)
+    if chunk_size is None:
+        chunks = _consultation_chunks(medical_history, ai_summary, styles, max(len(medical_history), 1))
+        doc.build(head + [flowable for chunk in chunks for flowable in chunk])
+    else:
+        doc.build(_ChunkedStory(head, _consultation_chunks(medical_history, ai_summary, styles, chunk_size)))
+    return buffer.getvalue() if buffer is not None else None
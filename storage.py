@@ -0,0 +1,581 @@
+"""Storage backends for user profiles, medical history and daily check-ins.
+
+Two interchangeable backends are available:
+
+- ``TxtStorage``: the original one-JSON-file-per-user layout under ``data/``
+  (the medical history uses a snapshot + append-only JSON-Lines journal).
+- ``SQLiteStorage``: a single embedded database with indexes on
+  ``(user_id, timestamp)`` and ``(user_id, type)`` so history filters and
+  counters run as indexed queries instead of Python-side scans.
+
+Chat conversations are stored once per thread (one record per message); each
+consultation only references its ``thread_id`` and ``turn_index`` instead of
+carrying a copy of the whole transcript.
+
+The backend is chosen with the ``SALUD_STORAGE_BACKEND`` environment variable
+(``txt`` by default, or ``sqlite``). Existing txt data can be copied into the
+database with::
+
+    python storage.py migrate
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+DATA_DIR = 'data'
+SQLITE_FILENAME = 'salud.sqlite'
+CHECKIN_RETENTION_DAYS = 30
+
+# The history journal is folded into the snapshot once it grows past this size,
+# so a save never rewrites the whole history.
+HISTORY_JOURNAL_MAX_BYTES = 256 * 1024
+
+
+def checkin_cutoff(now=None):
+    """Oldest check-in date (YYYY-MM-DD) kept by the backends"""
+    return ((now or datetime.now()) - timedelta(days=CHECKIN_RETENTION_DAYS)).strftime('%Y-%m-%d')
+
+
+def _matches(entry, types=None, since=None, exclude_types=()):
+    """Python-side equivalent of the indexed history filters"""
+    entry_type = entry.get('type', 'general')
+    if types is not None and entry_type not in types:
+        return False
+    if entry_type in exclude_types:
+        return False
+    if since is not None and datetime.fromisoformat(entry['timestamp']) <= since:
+        return False
+    return True
+
+
+def _append_lines(path, text):
+    """Append newline-terminated lines, starting on a fresh line if a previous append was interrupted"""
+    with open(path, 'a+b') as f:
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                text = '\n' + text
+        f.write(text.encode('utf-8'))
+
+
+def _is_emergency(entry):
+    return entry.get('assessment_level') == 'EMERGENCY' or entry.get('type') == 'emergency'
+
+
+class TxtStorage:
+    """One JSON .txt file per user and data kind (original layout)"""
+
+    name = 'txt'
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self._locks_guard = threading.Lock()
+        self._history_locks = {}
+
+    def _history_lock(self, user_id):
+        """Per-user lock serializing journal appends, compaction and history rewrites"""
+        with self._locks_guard:
+            return self._history_locks.setdefault(user_id, threading.RLock())
+
+    def _ensure_data_directory(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+
+    def _path(self, filename):
+        return os.path.join(self.data_dir, filename)
+
+    # --- User profiles ---
+
+    def list_user_ids(self):
+        """Return the ids of all users with a saved profile"""
+        if not os.path.exists(self.data_dir):
+            return []
+        return sorted(
+            f[len('perfil_usuario_'):-len('.txt')]
+            for f in os.listdir(self.data_dir)
+            if f.startswith('perfil_usuario_') and f.endswith('.txt')
+        )
+
+    def load_user_profile(self, user_id):
+        """Return the stored profile, or None if the user has none"""
+        profile_file = self._path(f'perfil_usuario_{user_id}.txt')
+        if not os.path.exists(profile_file):
+            return None
+        with open(profile_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_user_profile(self, profile_data):
+        self._ensure_data_directory()
+        profile_file = self._path(f'perfil_usuario_{profile_data["user_id"]}.txt')
+        with open(profile_file, 'w', encoding='utf-8') as f:
+            json.dump(profile_data, f, indent=2, ensure_ascii=False)
+
+    # --- Medical history ---
+
+    def get_history_paths(self, user_id):
+        """Return the snapshot and journal paths of a user's medical history"""
+        return (self._path(f'historial_medico_{user_id}.txt'),
+                self._path(f'historial_medico_{user_id}.jsonl'))
+
+    def load_medical_history(self, user_id):
+        """Read snapshot + journal and return the merged list of consultations"""
+        with self._history_lock(user_id):
+            return self._read_history(user_id)
+
+    def _read_history(self, user_id):
+        snapshot_file, journal_file = self.get_history_paths(user_id)
+        history = []
+        if os.path.exists(snapshot_file):
+            with open(snapshot_file, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+
+        if os.path.exists(journal_file):
+            # A crash between compaction and journal removal can leave entries in both files
+            seen_ids = {entry.get('id') for entry in history}
+            with open(journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Partially written line (interrupted append); skip it
+                        continue
+                    if entry.get('id') in seen_ids:
+                        continue
+                    history.append(entry)
+        return history
+
+    def save_medical_history(self, user_id, history_data):
+        """Atomically replace the snapshot and drop the journal"""
+        self._ensure_data_directory()
+        snapshot_file, journal_file = self.get_history_paths(user_id)
+        temp_file = f'{snapshot_file}.tmp'
+        with self._history_lock(user_id):
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(history_data, f, indent=2, ensure_ascii=False)
+            os.replace(temp_file, snapshot_file)
+            if os.path.exists(journal_file):
+                os.remove(journal_file)
+
+    def compact_medical_history(self, user_id):
+        """Fold the journal into the snapshot; appends wait, so none is lost with the old journal"""
+        with self._history_lock(user_id):
+            self.save_medical_history(user_id, self._read_history(user_id))
+
+    def append_consultation(self, user_id, entry):
+        """Append a single consultation to the history journal"""
+        self._ensure_data_directory()
+        _, journal_file = self.get_history_paths(user_id)
+
+        with self._history_lock(user_id):
+            _append_lines(journal_file, json.dumps(entry, ensure_ascii=False) + '\n')
+            if os.path.getsize(journal_file) > HISTORY_JOURNAL_MAX_BYTES:
+                self.compact_medical_history(user_id)
+
+    def query_history(self, user_id, types=None, since=None, exclude_types=()):
+        """Return consultations matching the type list, newer than `since` and not of `exclude_types`"""
+        return [entry for entry in self.load_medical_history(user_id)
+                if _matches(entry, types, since, exclude_types)]
+
+    def count_history(self, user_id, types=None, since=None, exclude_types=()):
+        return len(self.query_history(user_id, types, since, exclude_types))
+
+    def count_emergencies(self, user_id):
+        return sum(1 for entry in self.load_medical_history(user_id) if _is_emergency(entry))
+
+    # --- Aggregate stats (see history_stats.py) ---
+
+    def load_history_stats(self, user_id):
+        stats_file = self._path(f'estadisticas_{user_id}.txt')
+        if not os.path.exists(stats_file):
+            return None
+        try:
+            with open(stats_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            return None
+
+    def save_history_stats(self, user_id, stats):
+        self._ensure_data_directory()
+        stats_file = self._path(f'estadisticas_{user_id}.txt')
+        temp_file = f'{stats_file}.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, ensure_ascii=False)
+        os.replace(temp_file, stats_file)
+
+    # --- Chat threads ---
+
+    def _chat_path(self, user_id):
+        return self._path(f'conversaciones_{user_id}.jsonl')
+
+    def append_chat_messages(self, user_id, thread_id, messages, start_turn):
+        """Append messages to a thread; the first one gets turn index `start_turn`"""
+        self._ensure_data_directory()
+        lines = ''.join(
+            json.dumps({'thread_id': thread_id, 'turn': start_turn + i, **message}, ensure_ascii=False) + '\n'
+            for i, message in enumerate(messages)
+        )
+        _append_lines(self._chat_path(user_id), lines)
+
+    def delete_chat_threads(self, user_id):
+        """Remove every conversation of a user"""
+        chat_file = self._chat_path(user_id)
+        if os.path.exists(chat_file):
+            os.remove(chat_file)
+
+    def load_chat_threads(self, user_id, thread_ids=None):
+        """Return {thread_id: [messages in turn order]} for the requested threads"""
+        chat_file = self._chat_path(user_id)
+        threads = {}
+        if not os.path.exists(chat_file):
+            return threads
+        with open(chat_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                thread_id = record.pop('thread_id')
+                if thread_ids is not None and thread_id not in thread_ids:
+                    continue
+                threads.setdefault(thread_id, []).append(record)
+        for messages in threads.values():
+            messages.sort(key=lambda m: m['turn'])
+        return threads
+
+    def load_chat_thread(self, user_id, thread_id, upto_turn=None):
+        """Messages of one thread, optionally only the first `upto_turn` ones"""
+        messages = self.load_chat_threads(user_id, {thread_id}).get(thread_id, [])
+        return messages if upto_turn is None else messages[:upto_turn]
+
+    # --- Daily check-ins ---
+
+    def load_daily_checkins(self, user_id):
+        checkin_file = self._path(f'checkin_diario_{user_id}.txt')
+        if not os.path.exists(checkin_file):
+            return []
+        with open(checkin_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_daily_checkin(self, user_id, checkin_data):
+        """Add a check-in and keep only the last CHECKIN_RETENTION_DAYS days"""
+        self._ensure_data_directory()
+        all_checkins = self.load_daily_checkins(user_id)
+        all_checkins.append(checkin_data)
+
+        cutoff_date = checkin_cutoff()
+        all_checkins = [c for c in all_checkins if c['date'] >= cutoff_date]
+
+        checkin_file = self._path(f'checkin_diario_{user_id}.txt')
+        with open(checkin_file, 'w', encoding='utf-8') as f:
+            json.dump(all_checkins, f, indent=2, ensure_ascii=False)
+
+
+class SQLiteStorage:
+    """Embedded SQLite database with indexed history queries"""
+
+    name = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS consultations (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT UNIQUE,
+            user_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            type TEXT NOT NULL,
+            assessment_level TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_consultations_user_timestamp
+            ON consultations (user_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_consultations_user_type
+            ON consultations (user_id, type);
+        CREATE TABLE IF NOT EXISTS daily_checkins (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            date TEXT NOT NULL,
+            data TEXT NOT NULL,
+            UNIQUE (user_id, timestamp)
+        );
+        CREATE INDEX IF NOT EXISTS idx_checkins_user_date
+            ON daily_checkins (user_id, date);
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            user_id TEXT NOT NULL,
+            thread_id TEXT NOT NULL,
+            turn INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (thread_id, turn)
+        );
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_user_thread
+            ON chat_messages (user_id, thread_id);
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, data_dir=DATA_DIR, db_path=None):
+        self.data_dir = data_dir
+        self.db_path = db_path or os.path.join(data_dir, SQLITE_FILENAME)
+        # Streamlit serves each session from its own thread; sqlite3 connections
+        # must not be shared across threads, so keep one per thread.
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # --- User profiles ---
+
+    def list_user_ids(self):
+        rows = self._connect().execute('SELECT user_id FROM user_profiles ORDER BY user_id')
+        return [row[0] for row in rows]
+
+    def load_user_profile(self, user_id):
+        row = self._connect().execute(
+            'SELECT data FROM user_profiles WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_user_profile(self, profile_data):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO user_profiles (user_id, data) VALUES (?, ?)',
+                (profile_data['user_id'], json.dumps(profile_data, ensure_ascii=False))
+            )
+
+    # --- Medical history ---
+
+    @staticmethod
+    def _consultation_row(user_id, entry):
+        return (
+            entry.get('id'), user_id, entry['timestamp'], entry.get('type', 'general'),
+            entry.get('assessment_level', ''), json.dumps(entry, ensure_ascii=False)
+        )
+
+    def load_medical_history(self, user_id):
+        rows = self._connect().execute(
+            'SELECT data FROM consultations WHERE user_id = ? ORDER BY seq', (user_id,)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def save_medical_history(self, user_id, history_data):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM consultations WHERE user_id = ?', (user_id,))
+            conn.executemany(
+                'INSERT OR REPLACE INTO consultations (id, user_id, timestamp, type, assessment_level, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [self._consultation_row(user_id, entry) for entry in history_data]
+            )
+
+    def append_consultation(self, user_id, entry):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO consultations (id, user_id, timestamp, type, assessment_level, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                self._consultation_row(user_id, entry)
+            )
+
+    @staticmethod
+    def _where(user_id, types=None, since=None, exclude_types=()):
+        clauses, params = ['user_id = ?'], [user_id]
+        if types is not None:
+            types = list(types)
+            clauses.append(f"type IN ({', '.join('?' * len(types))})")
+            params.extend(types)
+        if exclude_types:
+            exclude_types = list(exclude_types)
+            clauses.append(f"type NOT IN ({', '.join('?' * len(exclude_types))})")
+            params.extend(exclude_types)
+        if since is not None:
+            clauses.append('timestamp > ?')
+            params.append(since.isoformat())
+        return ' AND '.join(clauses), params
+
+    def query_history(self, user_id, types=None, since=None, exclude_types=()):
+        where, params = self._where(user_id, types, since, exclude_types)
+        rows = self._connect().execute(
+            f'SELECT data FROM consultations WHERE {where} ORDER BY seq', params
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def count_history(self, user_id, types=None, since=None, exclude_types=()):
+        where, params = self._where(user_id, types, since, exclude_types)
+        return self._connect().execute(
+            f'SELECT COUNT(*) FROM consultations WHERE {where}', params
+        ).fetchone()[0]
+
+    def count_emergencies(self, user_id):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM consultations WHERE user_id = ? "
+            "AND (type = 'emergency' OR assessment_level = 'EMERGENCY')",
+            (user_id,)
+        ).fetchone()[0]
+
+    # --- Aggregate stats (see history_stats.py) ---
+
+    def load_history_stats(self, user_id):
+        row = self._connect().execute(
+            'SELECT data FROM user_stats WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_history_stats(self, user_id, stats):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO user_stats (user_id, data) VALUES (?, ?)',
+                (user_id, json.dumps(stats, ensure_ascii=False))
+            )
+
+    # --- Chat threads ---
+
+    def append_chat_messages(self, user_id, thread_id, messages, start_turn):
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO chat_messages (user_id, thread_id, turn, data) VALUES (?, ?, ?, ?)',
+                [(user_id, thread_id, start_turn + i,
+                  json.dumps({'turn': start_turn + i, **message}, ensure_ascii=False))
+                 for i, message in enumerate(messages)]
+            )
+
+    def delete_chat_threads(self, user_id):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM chat_messages WHERE user_id = ?', (user_id,))
+
+    def load_chat_threads(self, user_id, thread_ids=None):
+        if thread_ids is None:
+            rows = self._connect().execute(
+                'SELECT thread_id, data FROM chat_messages WHERE user_id = ? ORDER BY thread_id, turn',
+                (user_id,)
+            )
+        else:
+            thread_ids = list(thread_ids)
+            rows = self._connect().execute(
+                f"SELECT thread_id, data FROM chat_messages WHERE user_id = ? "
+                f"AND thread_id IN ({', '.join('?' * len(thread_ids))}) ORDER BY thread_id, turn",
+                [user_id] + thread_ids
+            )
+        threads = {}
+        for thread_id, data in rows:
+            threads.setdefault(thread_id, []).append(json.loads(data))
+        return threads
+
+    def load_chat_thread(self, user_id, thread_id, upto_turn=None):
+        query = 'SELECT data FROM chat_messages WHERE user_id = ? AND thread_id = ?'
+        params = [user_id, thread_id]
+        if upto_turn is not None:
+            query += ' AND turn < ?'
+            params.append(upto_turn)
+        rows = self._connect().execute(query + ' ORDER BY turn', params)
+        return [json.loads(row[0]) for row in rows]
+
+    # --- Daily check-ins ---
+
+    def load_daily_checkins(self, user_id):
+        rows = self._connect().execute(
+            'SELECT data FROM daily_checkins WHERE user_id = ? ORDER BY seq', (user_id,)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def save_daily_checkin(self, user_id, checkin_data):
+        """Add a check-in and keep only the last CHECKIN_RETENTION_DAYS days"""
+        cutoff_date = checkin_cutoff()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO daily_checkins (user_id, timestamp, date, data) VALUES (?, ?, ?, ?)',
+                (user_id, checkin_data['timestamp'], checkin_data['date'],
+                 json.dumps(checkin_data, ensure_ascii=False))
+            )
+            conn.execute(
+                'DELETE FROM daily_checkins WHERE user_id = ? AND date < ?', (user_id, cutoff_date)
+            )
+
+
+BACKENDS = {
+    TxtStorage.name: TxtStorage,
+    SQLiteStorage.name: SQLiteStorage,
+}
+
+
+def get_storage(backend=None, data_dir=DATA_DIR):
+    """Create the storage backend selected by name or SALUD_STORAGE_BACKEND"""
+    backend = backend or os.environ.get('SALUD_STORAGE_BACKEND', TxtStorage.name)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{backend}'. Options: {', '.join(BACKENDS)}")
+    return BACKENDS[backend](data_dir=data_dir)
+
+
+def migrate_txt_to_sqlite(data_dir=DATA_DIR, db_path=None):
+    """Copy every profile, history and check-in from the txt files into SQLite.
+
+    Safe to run more than once: consultations are keyed by id and check-ins by
+    (user_id, timestamp), so already migrated rows are not duplicated.
+    """
+    source = TxtStorage(data_dir)
+    target = SQLiteStorage(data_dir, db_path)
+    counts = {'profiles': 0, 'consultations': 0, 'checkins': 0, 'chat_messages': 0}
+
+    conn = target._connect()
+    with conn:
+        for user_id in source.list_user_ids():
+            profile = source.load_user_profile(user_id)
+            conn.execute(
+                'INSERT OR REPLACE INTO user_profiles (user_id, data) VALUES (?, ?)',
+                (user_id, json.dumps(profile, ensure_ascii=False))
+            )
+            counts['profiles'] += 1
+
+            history = source.load_medical_history(user_id)
+            conn.executemany(
+                'INSERT OR IGNORE INTO consultations (id, user_id, timestamp, type, assessment_level, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [target._consultation_row(user_id, entry) for entry in history]
+            )
+            counts['consultations'] += len(history)
+
+            checkins = source.load_daily_checkins(user_id)
+            conn.executemany(
+                'INSERT OR IGNORE INTO daily_checkins (user_id, timestamp, date, data) VALUES (?, ?, ?, ?)',
+                [(user_id, c['timestamp'], c['date'], json.dumps(c, ensure_ascii=False)) for c in checkins]
+            )
+            counts['checkins'] += len(checkins)
+
+            for thread_id, messages in source.load_chat_threads(user_id).items():
+                conn.executemany(
+                    'INSERT OR IGNORE INTO chat_messages (user_id, thread_id, turn, data) VALUES (?, ?, ?, ?)',
+                    [(user_id, thread_id, m['turn'], json.dumps(m, ensure_ascii=False)) for m in messages]
+                )
+                counts['chat_messages'] += len(messages)
+
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Herramientas de almacenamiento del Asistente de Salud Rural')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help='Migrar los archivos .txt a SQLite')
+    migrate_parser.add_argument('--data-dir', default=DATA_DIR)
+    migrate_parser.add_argument('--db-path', default=None)
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        result = migrate_txt_to_sqlite(args.data_dir, args.db_path)
+        print(f"Perfiles: {result['profiles']} | Consultas: {result['consultations']} | "
+              f"Check-ins: {result['checkins']} | Mensajes de chat: {result['chat_messages']}")
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not reached')
+        time.sleep(0.005)
+
+
+class Waiter(threading.Thread):
+    """Acquires a slot of `cls`, records its admission and releases it at once"""
+
+    def __init__(self, controller, cls, admitted):
+        super().__init__(daemon=True)
+        self.controller, self.cls, self.admitted = controller, cls, admitted
+
+    def run(self):
+        with self.controller.slot(self.cls):
+            self.admitted.append(self.name)
+
+
+def start_waiting(controller, cls, admitted, name=None):
+    """Start a waiter and return once it is queued"""
+    waiting = controller.stats()[cls]['waiting']
+    waiter = Waiter(controller, cls, admitted)
+    waiter.name = name or cls
+    waiter.start()
+    wait_until(lambda: controller.stats()[cls]['waiting'] == waiting + 1)
+    return waiter
+
+
+def test_freed_slot_goes_to_the_highest_priority_class():
+    controller = AdmissionController(parallel=1)
+    controller.acquire('chat')
+    admitted = []
+    waiters = [start_waiting(controller, cls, admitted) for cls in ('batch', 'checkin', 'chat')]
+
+    controller.release('chat')
+    for waiter in waiters:
+        waiter.join(5)
+
+    assert admitted == ['chat', 'checkin', 'batch']
+
+
+def test_same_class_is_first_in_first_out():
+    controller = AdmissionController(parallel=1)
+    controller.acquire('chat')
+    admitted = []
+    waiters = [start_waiting(controller, 'chat', admitted, name=f'chat {i}') for i in range(3)]
+
+    controller.release('chat')
+    for waiter in waiters:
+        waiter.join(5)
+
+    assert admitted == ['chat 0', 'chat 1', 'chat 2']
+
+
+def test_emergency_takes_the_reserve_slot_without_waiting():
+    controller = AdmissionController(parallel=1)
+    controller.acquire('batch')
+    admitted = []
+    start_waiting(controller, 'chat', admitted)
+
+    assert controller.acquire('emergency') < 0.1
+    assert admitted == []
+    stats = controller.stats()
+    assert stats['emergency']['in_flight'] == 1 and stats['chat']['waiting'] == 1
+
+    controller.release('emergency')
+    controller.release('batch')
+    wait_until(lambda: admitted == ['chat'])
+
+
+def test_capped_class_does_not_block_lower_ones():
+    controller = AdmissionController(parallel=2)
+    controller.acquire('batch')
+    admitted = []
+    blocked = start_waiting(controller, 'batch', admitted, name='batch 2')
+
+    # The waiting batch request is over its cap, so checkin may pass it
+    assert controller.acquire('checkin') < 0.1
+    assert admitted == []
+
+    controller.release('batch')
+    blocked.join(5)
+    assert admitted == ['batch 2']
+    controller.release('checkin')
+
+
+def test_request_waiting_too_long_is_rejected():
+    controller = AdmissionController(parallel=1, max_wait={'batch': 0.05})
+    controller.acquire('chat')
+
+    with pytest.raises(AdmissionRejected):
+        controller.acquire('batch')
+
+    stats = controller.stats()
+    assert stats['batch']['rejected'] == 1 and stats['batch']['waiting'] == 0
+
+
+def test_unknown_class_is_rejected():
+    with pytest.raises(ValueError):
+        AdmissionController().acquire('urgent')
+
+
+def test_metrics_count_admissions_and_waits():
+    controller = AdmissionController(parallel=1)
+    with controller.slot('chat'):
+        assert controller.stats()['chat']['in_flight'] == 1
+
+    stats = controller.stats()['chat']
+    assert stats['admitted'] == 1 and stats['in_flight'] == 0
+    assert stats['avg_wait'] is not None and stats['max_wait'] >= 0
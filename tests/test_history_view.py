@@ -0,0 +1,97 @@
+from history_view import paginate, sorted_keys
+
+
+def history(count):
+    return [{'id': f'c{i:03d}', 'timestamp': f'2025-07-01T10:{i // 60:02d}:{i % 60:02d}'} for i in range(count)]
+
+
+def ids(page):
+    return [entry['id'] for entry in page.entries]
+
+
+def walk_older(entries, page_size):
+    pages, cursor = [], None
+    while True:
+        page = paginate(entries, cursor, page_size)
+        pages.append(page)
+        if page.older_cursor is None:
+            return pages
+        cursor = page.older_cursor
+
+
+def test_empty_history_is_one_empty_page():
+    page = paginate([], page_size=10)
+    assert page.entries == []
+    assert (page.number, page.total_pages, page.total) == (1, 1, 0)
+    assert page.newer_cursor is None and page.older_cursor is None
+
+
+def test_walking_older_visits_every_entry_once_newest_first():
+    entries = history(25)
+    pages = walk_older(entries, 10)
+
+    assert [ids(page) for page in pages] == [
+        [f'c{i:03d}' for i in range(24, 14, -1)],
+        [f'c{i:03d}' for i in range(14, 4, -1)],
+        [f'c{i:03d}' for i in range(4, -1, -1)],
+    ]
+    assert [page.number for page in pages] == [1, 2, 3]
+    assert {page.total_pages for page in pages} == {3}
+
+
+def test_exact_multiple_of_page_size_has_no_empty_last_page():
+    pages = walk_older(history(20), 10)
+    assert [len(page.entries) for page in pages] == [10, 10]
+    assert pages[-1].older_cursor is None
+
+
+def test_newer_cursor_returns_to_previous_page():
+    entries = history(25)
+    first = paginate(entries, None, 10)
+    second = paginate(entries, first.older_cursor, 10)
+    third = paginate(entries, second.older_cursor, 10)
+
+    assert first.newer_cursor is None
+    assert ids(paginate(entries, third.newer_cursor, 10)) == ids(second)
+    assert ids(paginate(entries, second.newer_cursor, 10)) == ids(first)
+
+
+def test_new_entry_does_not_shift_the_page_being_read():
+    entries = history(25)
+    second_cursor = paginate(entries, None, 10).older_cursor
+    before = paginate(entries, second_cursor, 10)
+
+    entries.append({'id': 'new', 'timestamp': '2025-07-02T00:00:00'})
+    after = paginate(entries, second_cursor, 10)
+
+    assert ids(after) == ids(before)
+    assert after.total == 26
+    # The older page left behind is still counted
+    assert (after.number, after.total_pages) == (3, 4)
+    assert paginate(entries, after.older_cursor, 10).number == 4
+
+
+def test_cursor_older_than_every_entry_restarts_at_newest_page():
+    entries = history(5)
+    page = paginate(entries, ('2000-01-01T00:00:00', ''), 10)
+    assert ids(page) == ids(paginate(entries, None, 10))
+
+
+def test_cursor_survives_json_round_trip_as_list():
+    entries = history(25)
+    cursor = paginate(entries, None, 10).older_cursor
+    assert ids(paginate(entries, list(cursor), 10)) == ids(paginate(entries, cursor, 10))
+
+
+def test_equal_timestamps_are_ordered_by_id_and_split_across_pages():
+    entries = [{'id': f'c{i}', 'timestamp': '2025-07-01T10:00:00'} for i in range(5)]
+    pages = walk_older(entries, 2)
+    assert [ids(page) for page in pages] == [['c4', 'c3'], ['c2', 'c1'], ['c0']]
+
+
+def test_unsorted_input_and_precomputed_order():
+    entries = list(reversed(history(7)))
+    order = sorted_keys(entries)
+    page = paginate(entries, None, 3, order=order)
+    assert ids(page) == ['c006', 'c005', 'c004']
+    assert ids(paginate(entries, page.older_cursor, 3, order=order)) == ['c003', 'c002', 'c001']
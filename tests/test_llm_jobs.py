@@ -0,0 +1,152 @@
+import time
+
+import pytest
+
+from llm_jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue, make_handlers
+from reference_db import ReferenceData
+from storage import TxtStorage
+
+
+def make_queue(tmp_path, handlers=None, workers=1):
+    handlers = handlers or {'echo': lambda payload: {'success': True, 'text': payload['text']}}
+    return JobQueue(handlers, db_path=str(tmp_path / 'jobs.sqlite'), workers=workers)
+
+
+def wait_finished(queue, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in (DONE, FAILED):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+def test_submit_runs_the_handler(tmp_path):
+    queue = make_queue(tmp_path).start()
+    job_id = queue.submit('echo', {'text': 'hola'}, user_id='u')
+
+    job = wait_finished(queue, job_id)
+
+    assert job['status'] == DONE
+    assert job['result'] == {'success': True, 'text': 'hola'}
+    queue.stop()
+
+
+def test_unknown_kind_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        make_queue(tmp_path).submit('missing', {})
+
+
+def test_failing_handler_marks_the_job_failed(tmp_path):
+    def fail(payload):
+        raise RuntimeError('sin conexión')
+
+    queue = make_queue(tmp_path, {'fail': fail}).start()
+    job = wait_finished(queue, queue.submit('fail', {}))
+
+    assert job['status'] == FAILED
+    assert job['error'] == 'sin conexión'
+    assert job['result'] is None
+    queue.stop()
+
+
+def test_identical_pending_job_is_deduplicated(tmp_path):
+    queue = make_queue(tmp_path)
+    first = queue.submit('echo', {'text': 'a'}, user_id='u')
+
+    assert queue.submit('echo', {'text': 'a'}, user_id='u') == first
+    assert queue.submit('echo', {'text': 'b'}, user_id='u') != first
+    # Same payload for another user is another job
+    assert queue.submit('echo', {'text': 'a'}, user_id='v') != first
+
+
+def test_finished_job_is_not_reused(tmp_path):
+    queue = make_queue(tmp_path).start()
+    first = queue.submit('echo', {'text': 'a'}, user_id='u')
+    wait_finished(queue, first)
+
+    assert queue.submit('echo', {'text': 'a'}, user_id='u') != first
+    queue.stop()
+
+
+def test_higher_lanes_run_first(tmp_path):
+    order = []
+    queue = make_queue(tmp_path, {'record': lambda payload: order.append(payload['name'])})
+    queue.submit('record', {'name': 'batch'}, lane='batch')
+    queue.submit('record', {'name': 'chat'}, lane='chat')
+    queue.submit('record', {'name': 'emergency'}, lane='emergency')
+    last = queue.submit('record', {'name': 'batch 2'}, lane='batch')
+
+    assert queue.get(last)['position'] == 4
+    queue.start()
+    wait_finished(queue, last)
+
+    assert order == ['emergency', 'chat', 'batch', 'batch 2']
+    queue.stop()
+
+
+def test_get_hides_jobs_of_other_users(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id = queue.submit('echo', {'text': 'a'}, user_id='u')
+
+    assert queue.get(job_id, user_id='u')['status'] == QUEUED
+    assert queue.get(job_id, user_id='v') is None
+
+
+def test_clear_removes_only_that_users_jobs(tmp_path):
+    queue = make_queue(tmp_path)
+    mine = queue.submit('echo', {'text': 'a'}, user_id='u')
+    theirs = queue.submit('echo', {'text': 'a'}, user_id='v')
+
+    queue.clear('u')
+
+    assert queue.get(mine) is None
+    assert queue.latest_job_id('u', 'echo') is None
+    assert queue.latest_job_id('v', 'echo') == theirs
+
+
+def test_unfinished_jobs_run_after_a_restart(tmp_path):
+    queue = make_queue(tmp_path)
+    queued = queue.submit('echo', {'text': 'a'})
+    interrupted = queue.submit('echo', {'text': 'b'})
+    # The process stopped while this one was running
+    with queue._connect() as conn:
+        conn.execute('UPDATE jobs SET status = ? WHERE id = ?', (RUNNING, interrupted))
+
+    restarted = make_queue(tmp_path).start()
+
+    assert wait_finished(restarted, queued)['result']['text'] == 'a'
+    assert wait_finished(restarted, interrupted)['result']['text'] == 'b'
+    restarted.stop()
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    def generate(self, model, prompt, **options):
+        self.calls.append(dict(options, model=model, prompt=prompt))
+        return {'success': True, 'text': 'ok'}
+
+
+def test_trend_analysis_builds_the_prompt_from_storage(tmp_path):
+    storage = TxtStorage(str(tmp_path))
+    storage.save_user_profile({'user_id': 'u', 'name': 'Ana', 'allergies': 'penicilina'})
+    storage.save_medical_history('u', [
+        {'id': 'c1', 'timestamp': '2025-07-01T10:00:00', 'type': 'medical_evaluation', 'user_input': 'dolor de cabeza'},
+        {'id': 'c2', 'timestamp': '2025-07-02T10:00:00', 'type': 'daily_checkin', 'user_input': 'check-in diario'},
+    ])
+    client = FakeClient()
+    handlers = make_handlers(lambda host: client, storage, ReferenceData(str(tmp_path)))
+
+    result = handlers['trend_analysis']({'host': 'h', 'model': 'm', 'user_id': 'u'})
+
+    assert result['success']
+    call = client.calls[0]
+    assert 'dolor de cabeza' in call['prompt']
+    # Check-ins are sent as features, not one by one
+    assert 'check-in diario' not in call['prompt']
+    assert 'penicilina' in call['system_prompt']
+    assert call['priority'] == 'batch'
+    assert handlers['trend_analysis']({'host': 'h', 'model': 'm', 'user_id': 'x'})['success'] is False
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+import pytest
+
+import storage
+from storage import SQLiteStorage, TxtStorage, migrate_txt_to_sqlite
+
+
+def consultation(i, entry_type='general'):
+    return {'id': f'c{i}', 'timestamp': f'2025-07-{i % 28 + 1:02d}T10:00:{i % 60:02d}', 'type': entry_type}
+
+
+@pytest.fixture
+def txt(tmp_path):
+    return TxtStorage(str(tmp_path))
+
+
+def test_journal_is_folded_into_snapshot_past_max_size(txt, monkeypatch):
+    monkeypatch.setattr(storage, 'HISTORY_JOURNAL_MAX_BYTES', 500)
+    entries = [consultation(i) for i in range(20)]
+    for entry in entries:
+        txt.append_consultation('u', entry)
+
+    snapshot_file, journal_file = txt.get_history_paths('u')
+    assert os.path.exists(snapshot_file)
+    assert not os.path.exists(journal_file) or os.path.getsize(journal_file) <= 500
+    assert txt.load_medical_history('u') == entries
+
+
+def test_compaction_keeps_order_and_drops_journal(txt):
+    txt.save_medical_history('u', [consultation(0)])
+    txt.append_consultation('u', consultation(1))
+    txt.append_consultation('u', consultation(2))
+
+    txt.compact_medical_history('u')
+
+    snapshot_file, journal_file = txt.get_history_paths('u')
+    assert not os.path.exists(journal_file)
+    with open(snapshot_file, encoding='utf-8') as f:
+        assert [entry['id'] for entry in json.load(f)] == ['c0', 'c1', 'c2']
+
+
+def test_entries_left_in_both_files_are_read_once(txt):
+    # Crash between writing the snapshot and removing the journal
+    entries = [consultation(0), consultation(1)]
+    txt.append_consultation('u', entries[0])
+    txt.append_consultation('u', entries[1])
+    snapshot_file, _ = txt.get_history_paths('u')
+    with open(snapshot_file, 'w', encoding='utf-8') as f:
+        json.dump(entries, f)
+
+    assert txt.load_medical_history('u') == entries
+
+
+def test_interrupted_append_is_skipped_and_next_append_survives(txt):
+    txt.append_consultation('u', consultation(0))
+    _, journal_file = txt.get_history_paths('u')
+    with open(journal_file, 'a', encoding='utf-8') as f:
+        f.write('{"id": "c1", "timest')
+
+    txt.append_consultation('u', consultation(2))
+
+    assert [entry['id'] for entry in txt.load_medical_history('u')] == ['c0', 'c2']
+
+
+def test_concurrent_appends_survive_compaction(txt, monkeypatch):
+    monkeypatch.setattr(storage, 'HISTORY_JOURNAL_MAX_BYTES', 2000)
+
+    def append_many(worker):
+        for i in range(50):
+            txt.append_consultation('u', consultation(worker * 100 + i))
+
+    threads = [threading.Thread(target=append_many, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids = [entry['id'] for entry in txt.load_medical_history('u')]
+    assert len(ids) == 200
+    assert set(ids) == {f'c{worker * 100 + i}' for worker in range(4) for i in range(50)}
+
+
+def fill_txt(txt):
+    txt.save_user_profile({'user_id': 'u', 'nombre': 'Ana'})
+    txt.save_medical_history('u', [consultation(0), consultation(1, 'emergency')])
+    txt.append_consultation('u', consultation(2, 'daily_checkin'))
+    txt.save_daily_checkin('u', {'timestamp': datetime.now().isoformat(),
+                                 'date': datetime.now().strftime('%Y-%m-%d'), 'mood': 4})
+    txt.append_chat_messages('u', 't1', [{'role': 'user', 'content': 'hola'},
+                                         {'role': 'assistant', 'content': '¿En qué le ayudo?'}], 0)
+
+
+def test_migration_copies_everything(tmp_path, txt):
+    fill_txt(txt)
+
+    counts = migrate_txt_to_sqlite(str(tmp_path))
+
+    assert counts == {'profiles': 1, 'consultations': 3, 'checkins': 1, 'chat_messages': 2}
+    db = SQLiteStorage(str(tmp_path))
+    assert db.list_user_ids() == ['u']
+    assert db.load_user_profile('u') == txt.load_user_profile('u')
+    assert db.load_medical_history('u') == txt.load_medical_history('u')
+    assert db.load_daily_checkins('u') == txt.load_daily_checkins('u')
+    assert db.load_chat_threads('u') == txt.load_chat_threads('u')
+
+
+def test_migration_can_run_twice(tmp_path, txt):
+    fill_txt(txt)
+
+    migrate_txt_to_sqlite(str(tmp_path))
+    migrate_txt_to_sqlite(str(tmp_path))
+
+    db = SQLiteStorage(str(tmp_path))
+    assert len(db.load_medical_history('u')) == 3
+    assert len(db.load_daily_checkins('u')) == 1
+    assert len(db.load_chat_thread('u', 't1')) == 2
+
+
+def test_indexed_queries_match_txt_backend(tmp_path, txt):
+    fill_txt(txt)
+    migrate_txt_to_sqlite(str(tmp_path))
+    db = SQLiteStorage(str(tmp_path))
+    since = datetime.fromisoformat(consultation(0)['timestamp'])
+
+    for backend in (txt, db):
+        assert [e['id'] for e in backend.query_history('u', exclude_types=['daily_checkin'])] == ['c0', 'c1']
+        assert [e['id'] for e in backend.query_history('u', since=since)] == ['c1', 'c2']
+        assert backend.count_history('u', types=['emergency']) == 1
+        assert backend.count_emergencies('u') == 1
@@ -0,0 +1,184 @@
+"""Speech-to-text backends for the voice input.
+
+Two interchangeable transcribers are available:
+
+- ``VoskTranscriber``: offline recognition on the CPU with a local Vosk model,
+  so voice input works without internet and without a WAN round-trip. The
+  model is loaded once when the transcriber is created (the app keeps one
+  transcriber per process); ``speech_recognition``'s own ``recognize_vosk``
+  reloads the model on every call.
+- ``GoogleTranscriber``: the Google Web Speech API (needs internet).
+
+The backend is chosen with the ``SPEECH_BACKEND`` environment variable:
+``auto`` (default, Vosk when the package and the model are available,
+otherwise Google), ``vosk`` or ``google``. ``VOSK_MODEL_PATH`` points to the
+unpacked model (by default ``models/vosk-model-small-es-0.42``) and
+``SPEECH_LANGUAGE`` sets the Google language (``es-ES``).
+
+Audio is passed in memory (``sr.AudioData``, see ``segment_to_audio_data``),
+and every transcription reports its real-time factor: processing time divided
+by audio duration (below 1 is faster than real time). Long recordings split
+by audio_pipeline.py are transcribed in parallel (``SPEECH_WORKERS``, default
+4) and their texts joined in order.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import speech_recognition as sr
+
+SAMPLE_RATE = 16000
+DEFAULT_VOSK_MODEL_PATH = os.path.join('models', 'vosk-model-small-es-0.42')
+DEFAULT_LANGUAGE = 'es-ES'
+DEFAULT_WORKERS = 4
+
+
+class GoogleTranscriber:
+    """Google Web Speech API (online)"""
+
+    name = 'google'
+    offline = False
+
+    def __init__(self, language=DEFAULT_LANGUAGE):
+        self.language = language
+        self.recognizer = sr.Recognizer()
+
+    def recognize(self, audio_data):
+        return self.recognizer.recognize_google(audio_data, language=self.language)
+
+
+class VoskTranscriber:
+    """Offline Vosk recognizer; the model is loaded once and shared by all calls"""
+
+    name = 'vosk'
+    offline = True
+
+    def __init__(self, model_path=DEFAULT_VOSK_MODEL_PATH):
+        if not os.path.isdir(model_path):
+            raise FileNotFoundError(f"Modelo Vosk no encontrado en '{model_path}'")
+        import vosk
+
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        self.model = vosk.Model(model_path)
+
+    def recognize(self, audio_data):
+        # One lightweight recognizer per call; the model itself is thread-safe
+        recognizer = self._vosk.KaldiRecognizer(self.model, SAMPLE_RATE)
+        recognizer.AcceptWaveform(audio_data.get_raw_data(convert_rate=SAMPLE_RATE, convert_width=2))
+        text = json.loads(recognizer.FinalResult()).get('text', '')
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+TRANSCRIBERS = {
+    VoskTranscriber.name: VoskTranscriber,
+    GoogleTranscriber.name: GoogleTranscriber,
+}
+
+
+def get_transcription_service(backend=None):
+    """Create the transcription service selected by name or SPEECH_BACKEND ('auto' prefers Vosk)"""
+    backend = backend or os.environ.get('SPEECH_BACKEND', 'auto')
+    model_path = os.environ.get('VOSK_MODEL_PATH', DEFAULT_VOSK_MODEL_PATH)
+    language = os.environ.get('SPEECH_LANGUAGE', DEFAULT_LANGUAGE)
+    workers = max(int(os.environ.get('SPEECH_WORKERS', DEFAULT_WORKERS)), 1)
+    if backend == 'auto':
+        try:
+            return TranscriptionService(VoskTranscriber(model_path), workers)
+        except Exception:
+            # vosk not installed, model missing or unreadable
+            return TranscriptionService(GoogleTranscriber(language), workers)
+    if backend == VoskTranscriber.name:
+        return TranscriptionService(VoskTranscriber(model_path), workers)
+    if backend == GoogleTranscriber.name:
+        return TranscriptionService(GoogleTranscriber(language), workers)
+    raise ValueError(f"Unknown speech backend '{backend}'. Options: auto, {', '.join(TRANSCRIBERS)}")
+
+
+def segment_to_audio_data(segment):
+    """In-memory sr.AudioData from a pydub AudioSegment (as returned by audiorecorder)"""
+    segment = segment.set_channels(1)
+    return sr.AudioData(segment.raw_data, segment.frame_rate, segment.sample_width)
+
+
+class TranscriptionService:
+    """A transcriber plus real-time-factor statistics"""
+
+    def __init__(self, transcriber, workers=DEFAULT_WORKERS):
+        self.transcriber = transcriber
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._count = 0
+        self._audio_seconds = 0.0
+        self._transcribe_seconds = 0.0
+
+    @property
+    def name(self):
+        return self.transcriber.name
+
+    @property
+    def offline(self):
+        return self.transcriber.offline
+
+    def _recognize(self, audio_data):
+        """(text or None, error or None) of one chunk"""
+        try:
+            return self.transcriber.recognize(audio_data), None
+        except sr.UnknownValueError:
+            return None, None
+        except sr.RequestError as e:
+            return None, f"Error en el servicio de reconocimiento de voz; {e}"
+
+    def transcribe(self, audio_data):
+        """Return {"success", "text"/"error", "audio_seconds", "transcribe_seconds", "rtf", "backend"}"""
+        return self.transcribe_chunks([audio_data])
+
+    def transcribe_chunks(self, chunks):
+        """Transcribe consecutive chunks of one recording in parallel; same result as transcribe"""
+        audio_seconds = sum(len(c.frame_data) / (c.sample_rate * c.sample_width) for c in chunks)
+        start = time.perf_counter()
+        if len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(chunks))) as pool:
+                outcomes = list(pool.map(self._recognize, chunks))
+        else:
+            outcomes = [self._recognize(chunk) for chunk in chunks]
+        transcribe_seconds = time.perf_counter() - start
+
+        texts = [text for text, _ in outcomes if text]
+        errors = [error for _, error in outcomes if error]
+        # A chunk without recognizable words (a cough, a pause) is skipped
+        if errors:
+            result = {"success": False, "error": errors[0]}
+        elif texts:
+            result = {"success": True, "text": " ".join(texts)}
+        else:
+            result = {"success": False, "error": "No se pudo entender el audio. Inténtalo de nuevo."}
+
+        # When the service was not reached the time says nothing about transcription speed
+        if not errors:
+            with self._lock:
+                self._count += 1
+                self._audio_seconds += audio_seconds
+                self._transcribe_seconds += transcribe_seconds
+        result.update({
+            "audio_seconds": audio_seconds,
+            "transcribe_seconds": transcribe_seconds,
+            "rtf": transcribe_seconds / audio_seconds if audio_seconds else None,
+            "backend": self.name,
+            "chunks": len(chunks),
+        })
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.name,
+                'offline': self.offline,
+                'transcriptions': self._count,
+                'audio_seconds': self._audio_seconds,
+                'avg_rtf': self._transcribe_seconds / self._audio_seconds if self._audio_seconds else None,
+            }